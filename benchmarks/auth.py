@@ -0,0 +1,55 @@
+"""Compare authenticated API requests per second with and without the
+credential cache.
+
+Each iteration adds a streamer and deletes it again, like a script that
+manages many streamers would. The database is a temporary SQLite file.
+
+Usage: python benchmarks/auth.py [--requests 200]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+_workdir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_workdir.name}/offstream.db"
+
+from offstream import app as app_module  # noqa: E402
+from offstream import db  # noqa: E402
+
+
+def _measure(requests: int, auth: tuple[str, str]) -> float:
+    client = app_module.app.test_client()
+    app_module._credentials.invalidate()
+    started = time.perf_counter()
+    for num in range(requests // 2):
+        name = f"streamer{num}"
+        response = client.post("/streamers", data={"name": name}, auth=auth)
+        assert response.status_code == 201, response.json
+        response = client.delete(f"/streamers/{name}", auth=auth)
+        assert response.status_code == 200, response.json
+    return requests / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    db.Base.metadata.create_all(db.engine)
+    with db.Session() as session:
+        settings, password = db.settings()
+        session.add(settings)
+        session.commit()
+        auth = (str(settings.username), password)
+    ttl = app_module._CredentialCache.ttl
+    app_module._CredentialCache.ttl = 0
+    uncached = _measure(args.requests, auth)
+    app_module._CredentialCache.ttl = ttl
+    cached = _measure(args.requests, auth)
+    print(f"uncached: {uncached:.0f} req/s, cached: {cached:.0f} req/s")
+    _workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
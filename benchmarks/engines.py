@@ -0,0 +1,113 @@
+"""Compare threads and CPU per stream of the thread and asyncio engines.
+
+Each engine records the same number of synthetic live streams from a local
+HLS origin and uploads them to a fake IPFS API, so no network is needed.
+
+Usage: python benchmarks/engines.py [--streams 20] [--seconds 60]
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from typing import Any
+
+from stubs import Stubs
+
+
+def _record(engine: str, args: argparse.Namespace, stubs: Any, results: Any) -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        # This must happen before offstream is imported.
+        os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/offstream.db"
+        os.environ["OFFSTREAM_MAX_CONCURRENT_RECORDERS"] = str(args.streams)
+        os.environ.setdefault("OFFSTREAM_FLUSH_THRESHOLD", str(args.flush_threshold))
+        results.put(_measure(engine, args, stubs))
+
+
+def _measure(engine: str, args: argparse.Namespace, stubs: Any) -> dict[str, Any]:
+    from offstream import db
+    from offstream.streaming import AsyncRecorder, Prober, Recorder
+    from offstream.streaming.recorder import _Worker
+
+    class AlwaysLive(Prober):
+        def probe_batch(self, names: Any) -> Any:
+            return names
+
+    db.Streamer._uri_template = f"hls://{stubs['origin_url']}/{{name}}.m3u8"
+    _Worker.ipfs_api_addr = stubs["ipfs_multiaddr"]
+    _Worker.ipfs_gateway_uri_template = "http://{cid}.ipfs.localhost/{path}"
+    db.Base.metadata.create_all(db.engine)
+    with db.Session() as session:
+        for i in range(args.streams):
+            session.add(db.Streamer(name=f"{engine}{i}"))
+        session.commit()
+
+    recorder_class = AsyncRecorder if engine == "async" else Recorder
+    recorder = recorder_class(prober=AlwaysLive())
+    baseline_threads = threading.active_count()
+    served = stubs["segments_served"]
+    served_before = served.value
+    peak_threads = 0
+    sampling = threading.Event()
+
+    def _sample() -> None:
+        nonlocal peak_threads
+        while not sampling.wait(0.5):
+            threads = threading.active_count() - baseline_threads
+            peak_threads = max(peak_threads, threads)
+
+    # Close the recorder from a signal handler, just like the CLI does.
+    signal.signal(signal.SIGALRM, lambda *_args: recorder.close())
+    signal.setitimer(signal.ITIMER_REAL, args.seconds)
+    sampler = threading.Thread(target=_sample)
+    sampler.start()
+    cpu_before = time.process_time()
+    recorder.start()
+    cpu = time.process_time() - cpu_before
+    sampling.set()
+    sampler.join()
+    return {
+        "engine": engine,
+        "streams": args.streams,
+        "peak threads": peak_threads,
+        "threads/stream": round(peak_threads / args.streams, 2),
+        "cpu %/stream": round(100 * cpu / args.seconds / args.streams, 3),
+        "segments": served.value - served_before,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--bitrate", type=int, default=6_000_000)
+    parser.add_argument("--segment-duration", type=float, default=2.0)
+    parser.add_argument("--flush-threshold", type=int, default=20_000_000)
+    parser.add_argument(
+        "--engine", choices=["thread", "async"], action="append", dest="engines"
+    )
+    args = parser.parse_args()
+    context = multiprocessing.get_context("spawn")
+    with Stubs(args.bitrate, args.segment_duration) as stubs:
+        shared = {
+            "origin_url": stubs.origin_url,
+            "ipfs_multiaddr": stubs.ipfs_multiaddr,
+            "segments_served": stubs.segments_served,
+        }
+        for engine in args.engines or ["thread", "async"]:
+            # A fresh process per engine keeps thread counts comparable.
+            results = context.Queue()
+            process = context.Process(
+                target=_record, args=(engine, args, shared, results)
+            )
+            process.start()
+            result = results.get()
+            process.join()
+            print(", ".join(f"{key}: {value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
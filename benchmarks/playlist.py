@@ -0,0 +1,86 @@
+"""Time writing a growing playlist after every flush, and its memory.
+
+A 12 hour stream with 1 second segments has about 50k segments. The
+playlist is written once per flush, like the recorder does.
+
+Usage: python benchmarks/playlist.py [--segments 50000] [--flush-every 50]
+"""
+
+import argparse
+import math
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+from offstream.streaming.hls import Playlist
+
+
+class _Segment(NamedTuple):
+    url: str
+    duration: float
+    title: str
+
+
+def _rewrite(segments: list[tuple[str, float]], path: Path) -> None:
+    # What Playlist.write used to do: render every segment on every write.
+    target_duration = max((math.ceil(duration) for _, duration in segments))
+    with path.open(mode="w", encoding="utf-8") as m3u8:
+        m3u8.write("#EXTM3U\n#EXT-X-PLAYLIST-TYPE:VOD\n")
+        m3u8.write(f"#EXT-X-TARGETDURATION:{target_duration}\n")
+        m3u8.write("#EXT-X-VERSION:3\n#EXT-X-MEDIA-SEQUENCE:0\n#EXT-X-ENDLIST\n")
+        for url, duration in segments:
+            m3u8.write(f"#EXTINF:{duration:.3f},\n")
+            m3u8.write(f"{url}\n")
+
+
+def _memory(args: argparse.Namespace, append: Callable[[str, float], None]) -> int:
+    tracemalloc.start()
+    _time(args, append, lambda: None)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def _time(
+    args: argparse.Namespace,
+    append: Callable[[str, float], None],
+    write: Callable[[], None],
+) -> float:
+    started = time.perf_counter()
+    for num in range(args.segments):
+        cid = f"bafybeig{num // args.flush_every:051d}"
+        append(f"https://{cid}.ipfs.infura-ipfs.io/{num}.ts", 1.0 + num % 3 / 1000)
+        if num % args.flush_every == args.flush_every - 1:
+            write()
+    write()
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--segments", type=int, default=50_000)
+    parser.add_argument("--flush-every", type=int, default=50)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        path = Path(workdir) / "playlist.m3u8"
+        segments: list[tuple[str, float]] = []
+        rewrite = _time(
+            args,
+            lambda url, duration: segments.append((url, duration)),
+            lambda: _rewrite(segments, path),
+        )
+        playlist = Playlist()
+        incremental = _time(args, playlist.append, lambda: playlist.write(path))
+    print(f"full rewrite: {rewrite:.2f}s, incremental: {incremental:.2f}s")
+    tuples: list[_Segment] = []
+    tuples_size = _memory(
+        args, lambda url, duration: tuples.append(_Segment(url, duration, ""))
+    )
+    columns_size = _memory(args, Playlist().append)
+    print(f"named tuples: {tuples_size // 1024}K, columns: {columns_size // 1024}K")
+
+
+if __name__ == "__main__":
+    main()
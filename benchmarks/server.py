@@ -0,0 +1,108 @@
+"""Measure concurrent /latest throughput of the simple and threaded servers.
+
+The server runs in a child process with a temporary SQLite database. Each
+client thread keeps one connection open, if the server allows it, and
+requests /latest/<name> as fast as it can. Slow clients open a connection
+and never finish their request, like a stalled mobile client would.
+
+Usage: python benchmarks/server.py [--clients 16] [--seconds 10]
+                                   [--threads 8] [--slow-clients 1]
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+from http.client import HTTPConnection
+from typing import Any
+
+
+def _serve(ready: Any, server: str, threads: int) -> None:
+    from offstream.app import app
+    from offstream.server import make_server
+
+    httpd = make_server("127.0.0.1", 0, app, server=server, threads=threads)
+    ready.put(httpd.server_address[1])
+    httpd.serve_forever()
+
+
+def _client(port: int, deadline: float, results: list[tuple[int, int]]) -> None:
+    done = errors = 0
+    connection = HTTPConnection("127.0.0.1", port, timeout=2)
+    while time.monotonic() < deadline:
+        try:
+            connection.request("GET", "/latest/benchmark")
+            response = connection.getresponse()
+            response.read()
+        except OSError:
+            errors += 1
+            connection.close()
+            continue
+        if response.status == 302:
+            done += 1
+        else:
+            errors += 1
+        if response.will_close:
+            connection.close()
+    connection.close()
+    results.append((done, errors))
+
+
+def _measure(args: argparse.Namespace, server: str) -> str:
+    context = multiprocessing.get_context("spawn")
+    ready: Any = context.Queue()
+    process = context.Process(
+        target=_serve, args=(ready, server, args.threads), daemon=True
+    )
+    process.start()
+    port = ready.get(timeout=30)
+    slow = []
+    for _ in range(args.slow_clients):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(b"GET /latest/benchmark HTTP/1.1\r\n")
+        slow.append(sock)
+    results: list[tuple[int, int]] = []
+    deadline = time.monotonic() + args.seconds
+    clients = [
+        threading.Thread(target=_client, args=(port, deadline, results))
+        for _ in range(args.clients)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    for sock in slow:
+        sock.close()
+    process.terminate()
+    process.join()
+    done = sum(done for done, _ in results)
+    errors = sum(errors for _, errors in results)
+    return f"{server}: {done / args.seconds:.0f} req/s, {errors} errors"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--slow-clients", type=int, default=1)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        # Servers inherit it.
+        os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/offstream.db"
+        from offstream import db
+
+        db.Base.metadata.create_all(db.engine)
+        with db.Session() as session:
+            streamer = db.Streamer(name="benchmark")
+            session.add(db.Stream(streamer=streamer, url="https://example.org/"))
+            session.commit()
+        for server in ("simple", "threaded"):
+            print(_measure(args, server))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Local stand-ins for the HLS origin and the IPFS HTTP API.
+
+Both servers run in a child process so that their CPU time is not
+attributed to the recorder being measured.
+"""
+
+import json
+import multiprocessing
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+TS_PACKET = b"\x47" + b"\xff" * 187
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_body(self, body: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args: Any) -> None:
+        pass
+
+
+class HLSOrigin(ThreadingHTTPServer):
+    """Serves endless live streams at /<channel>.m3u8."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        bitrate: int = 6_000_000,
+        segment_duration: float = 2.0,
+        window: int = 5,
+        counter: Optional[Any] = None,
+    ) -> None:
+        super().__init__(address, _OriginHandler)
+        self.segment_duration = segment_duration
+        self.window = window
+        self.counter = counter
+        size = int(bitrate / 8 * segment_duration)
+        self.segment = TS_PACKET * (size // len(TS_PACKET) + 1)
+        self.started = time.monotonic()
+
+    def playlist(self) -> bytes:
+        elapsed = time.monotonic() - self.started
+        last = int(elapsed / self.segment_duration)
+        first = max(0, last - self.window + 1)
+        duration = self.segment_duration
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{int(duration + 0.999)}",
+            f"#EXT-X-MEDIA-SEQUENCE:{first}",
+        ]
+        for num in range(first, last + 1):
+            lines += [f"#EXTINF:{duration:.3f},", f"{num}.ts"]
+        return "\n".join(lines).encode() + b"\n"
+
+
+class _OriginHandler(_Handler):
+    server: HLSOrigin
+
+    def do_GET(self) -> None:
+        if self.path.endswith(".m3u8"):
+            self.send_body(self.server.playlist(), "application/vnd.apple.mpegurl")
+        elif self.path.endswith(".ts"):
+            if self.server.counter is not None:
+                with self.server.counter.get_lock():
+                    self.server.counter.value += 1
+            self.send_body(self.server.segment, "video/mp2t")
+        else:
+            self.send_error(404)
+
+
+class FakeIPFS(ThreadingHTTPServer):
+    """Answers /api/v0/add after a configurable delay."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        latency: float = 0.0,
+        counter: Optional[Any] = None,
+    ) -> None:
+        super().__init__(address, _IPFSHandler)
+        self.latency = latency
+        self.counter = counter
+        self.requests = 0
+
+
+class _IPFSHandler(_Handler):
+    server: FakeIPFS
+
+    def do_POST(self) -> None:
+        if self.path.startswith("/api/v0/version"):
+            self.send_body(b'{"Version": "0.8.0"}\n', "application/json")
+            return
+        if not self.path.startswith("/api/v0/add"):
+            self.send_error(404)
+            return
+        names = re.findall(rb'filename="([^"]+)"', self._read_body())
+        time.sleep(self.server.latency)
+        self.server.requests += 1
+        if self.server.counter is not None:
+            with self.server.counter.get_lock():
+                self.server.counter.value += 1
+        cid = f"bafy{self.server.requests:08d}"
+        entries = [
+            {"Name": name.decode(), "Hash": f"{cid}{i}"} for i, name in enumerate(names)
+        ]
+        if "wrap-with-directory=true" in self.path.lower():
+            entries.append({"Name": "", "Hash": cid})
+        body = "".join(json.dumps(entry) + "\n" for entry in entries).encode()
+        self.send_body(body, "application/json")
+
+    def _read_body(self) -> bytes:
+        if "chunked" not in self.headers.get("transfer-encoding", ""):
+            return self.rfile.read(int(self.headers.get("content-length", 0)))
+        body = bytearray()
+        while size := int(self.rfile.readline().strip(), 16):
+            # Keep the multipart headers only, drop segment payloads.
+            chunk = self.rfile.read(size)
+            body += chunk if b"filename=" in chunk else b""
+            self.rfile.readline()
+        self.rfile.readline()
+        return bytes(body)
+
+
+def _serve(
+    ready: Any, origin_options: dict[str, Any], ipfs_options: dict[str, Any]
+) -> None:
+    origin = HLSOrigin(("127.0.0.1", 0), **origin_options)
+    ipfs = FakeIPFS(("127.0.0.1", 0), **ipfs_options)
+    threading.Thread(target=ipfs.serve_forever, daemon=True).start()
+    ready.put((origin.server_address[1], ipfs.server_address[1]))
+    origin.serve_forever()
+
+
+class Stubs:
+    """Runs `HLSOrigin` and `FakeIPFS` in a child process."""
+
+    def __init__(
+        self,
+        bitrate: int = 6_000_000,
+        segment_duration: float = 2.0,
+        ipfs_latency: float = 0.0,
+    ) -> None:
+        context = multiprocessing.get_context("spawn")
+        self.segments_served = context.Value("L", 0)
+        self.uploads = context.Value("L", 0)
+        ready: Any = context.Queue()
+        origin_options = {
+            "bitrate": bitrate,
+            "segment_duration": segment_duration,
+            "counter": self.segments_served,
+        }
+        ipfs_options = {"latency": ipfs_latency, "counter": self.uploads}
+        self._process = context.Process(
+            target=_serve, args=(ready, origin_options, ipfs_options), daemon=True
+        )
+        self._process.start()
+        origin_port, ipfs_port = ready.get(timeout=10)
+        self.origin_url = f"http://127.0.0.1:{origin_port}"
+        self.ipfs_multiaddr = f"/ip4/127.0.0.1/tcp/{ipfs_port}/http"
+
+    def close(self) -> None:
+        self._process.terminate()
+        self._process.join()
+
+    def __enter__(self) -> "Stubs":
+        return self
+
+    def __exit__(self, *_args: Any) -> None:
+        self.close()
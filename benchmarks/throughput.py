@@ -0,0 +1,151 @@
+"""Measure how many concurrent streams a recorder sustains.
+
+The recorder records synthetic live streams from a local HLS origin and
+uploads them to a fake IPFS API with a configurable latency, so no network
+is needed. Each stream count runs in a fresh process with a temporary
+SQLite database. A recorder keeps up while it fetches segments as fast as
+the origin publishes them and its flush latency, the time from a flush to
+the commit of its segments, stays flat.
+
+Usage: python benchmarks/throughput.py [--streams 10 20 40] [--seconds 60]
+                                       [--engine thread] [--bitrate 6000000]
+                                       [--segment-duration 2]
+                                       [--ipfs-latency 0.5]
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import signal
+import statistics
+import tempfile
+import time
+from collections import defaultdict, deque
+from typing import Any
+
+from stubs import Stubs
+
+
+def _record(streams: int, args: argparse.Namespace, stubs: Any, results: Any) -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        # This must happen before offstream is imported.
+        os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/offstream.db"
+        os.environ["OFFSTREAM_MAX_CONCURRENT_RECORDERS"] = str(streams)
+        # A few segments per flush, so that there are flushes to measure.
+        segment_size = args.bitrate // 8 * args.segment_duration
+        threshold = args.flush_threshold or int(segment_size * 4)
+        os.environ["OFFSTREAM_FLUSH_THRESHOLD"] = str(threshold)
+        results.put(_measure(streams, args, stubs))
+
+
+def _measure(streams: int, args: argparse.Namespace, stubs: Any) -> dict[str, Any]:
+    from sqlalchemy import func, select
+
+    from offstream import db
+    from offstream.streaming import AsyncRecorder, Prober, Recorder
+    from offstream.streaming.aio import _AsyncWorker
+    from offstream.streaming.recorder import _Worker
+
+    class AlwaysLive(Prober):
+        def probe_batch(self, names: Any) -> Any:
+            return names
+
+    db.Streamer._uri_template = f"hls://{stubs['origin_url']}/{{name}}.m3u8"
+    _Worker.ipfs_api_addr = stubs["ipfs_multiaddr"]
+    _Worker.ipfs_gateway_uri_template = "http://{cid}.ipfs.localhost/{path}"
+    db.Base.metadata.create_all(db.engine)
+    with db.Session() as session:
+        for i in range(streams):
+            session.add(db.Streamer(name=f"stream{i}"))
+        session.commit()
+
+    # Flushes are committed in order, so commits pair up with flushes.
+    flushed: defaultdict[int, deque[float]] = defaultdict(deque)
+    latencies: list[float] = []
+
+    def _timed_flush(flush: Any) -> Any:
+        def _flush(self: Any) -> None:
+            flushed[id(self)].append(time.monotonic())
+            flush(self)
+
+        return _flush
+
+    def _journal_committed(self: Any) -> None:
+        if queue := flushed[id(self)]:
+            latencies.append(time.monotonic() - queue.popleft())
+        journal_committed(self)
+
+    journal_committed = _Worker._journal_committed
+    _Worker._journal_committed = _journal_committed  # type: ignore
+    _Worker._flush = _timed_flush(_Worker._flush)  # type: ignore
+    _AsyncWorker._flush = _timed_flush(_AsyncWorker._flush)  # type: ignore
+
+    recorder_class = AsyncRecorder if args.engine == "async" else Recorder
+    recorder = recorder_class(prober=AlwaysLive())
+    served = stubs["segments_served"]
+    served_before = served.value
+    # Close the recorder from a signal handler, just like the CLI does.
+    signal.signal(signal.SIGALRM, lambda *_args: recorder.close())
+    signal.setitimer(signal.ITIMER_REAL, args.seconds)
+    cpu_before = time.process_time()
+    recorder.start()
+    cpu = time.process_time() - cpu_before
+    with db.Session() as session:
+        committed = session.scalar(select(func.count(db.Segment.id)))
+    segment_bits = args.bitrate * args.segment_duration
+    latencies.sort()
+    return {
+        "engine": args.engine,
+        "streams": streams,
+        "published seg/s": round(streams / args.segment_duration, 1),
+        "fetched seg/s": round((served.value - served_before) / args.seconds, 1),
+        "committed seg/s": round(committed / args.seconds, 1),
+        "committed Mbit/s": round(committed * segment_bits / args.seconds / 1e6, 1),
+        "flush p50 s": _percentile(latencies, 0.5),
+        "flush p95 s": _percentile(latencies, 0.95),
+        "cpu %/stream": round(100 * cpu / args.seconds / streams, 3),
+        "peak rss MB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+    }
+
+
+def _percentile(values: list[float], fraction: float) -> Any:
+    if not values:
+        return "-"
+    if len(values) == 1:
+        return round(values[0], 2)
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return round(cuts[int(fraction * 100) - 1], 2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, nargs="+", default=[10, 20, 40])
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread")
+    parser.add_argument("--bitrate", type=int, default=6_000_000)
+    parser.add_argument("--segment-duration", type=float, default=2.0)
+    parser.add_argument("--ipfs-latency", type=float, default=0.5)
+    parser.add_argument("--flush-threshold", type=int)
+    args = parser.parse_args()
+    context = multiprocessing.get_context("spawn")
+    with Stubs(args.bitrate, args.segment_duration, args.ipfs_latency) as stubs:
+        shared = {
+            "origin_url": stubs.origin_url,
+            "ipfs_multiaddr": stubs.ipfs_multiaddr,
+            "segments_served": stubs.segments_served,
+        }
+        for streams in args.streams:
+            # A fresh process per run keeps RSS and threads comparable.
+            results = context.Queue()
+            process = context.Process(
+                target=_record, args=(streams, args, shared, results)
+            )
+            process.start()
+            result = results.get()
+            process.join()
+            print(", ".join(f"{key}: {value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,40 @@
+import base64
+import binascii
 import datetime as dt
-from typing import Any, Optional
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Iterator, NamedTuple, Optional
 
-from flask import Flask, abort, make_response, render_template, request
+from flask import (
+    Flask,
+    Response,
+    abort,
+    g,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
 from flask.typing import ResponseReturnValue
-from sqlalchemy import select
+from sqlalchemy import event, select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.sql.expression import Select
 from werkzeug.exceptions import HTTPException
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import check_password_hash
 
-from offstream import db
+from offstream import db, metrics
 from offstream.cli import main
+from offstream.streaming import live
+from offstream.streaming.hls import Playlist
 
 app = Flask("offstream", static_url_path="/")
 app.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
@@ -18,20 +42,322 @@ app.cli.add_command(main)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1)  # type: ignore
 
 
+class _PlaylistCache:
+    """Playlists of recently requested streams.
+
+    A cached playlist only queries the segments that were added since it
+    was last rendered. While a playlist is being updated, it is taken out
+    of the cache, so concurrent requests never append to the same one.
+    """
+
+    def __init__(self, size: int = 16) -> None:
+        self.size = size
+        self._lock = Lock()
+        # Stream -> last segment id, playlist and its rendering. Ids of
+        # deleted streams may be reused, hence the creation time.
+        self._playlists: OrderedDict[
+            tuple[int, dt.datetime], tuple[int, Playlist, bytes]
+        ] = OrderedDict()
+
+    def render(self, session: Session, stream: db.Stream) -> bytes:
+        assert stream.id and stream.created_at
+        key = (stream.id, stream.created_at)
+        with self._lock:
+            cached = self._playlists.pop(key, None)
+        last_id, playlist, m3u8 = cached or (0, Playlist(), b"")
+        rows = session.execute(db.stream_segments(stream.id, after_id=last_id)).all()
+        for last_id, url, duration in rows:
+            playlist.append(url, duration)
+        if rows or not m3u8:
+            m3u8 = playlist.render()
+        with self._lock:
+            self._playlists[key] = (last_id, playlist, m3u8)
+            while len(self._playlists) > self.size:
+                self._playlists.popitem(last=False)
+        return m3u8
+
+
+_playlists = _PlaylistCache()
+
+
+class _Feed(NamedTuple):
+    xml: bytes
+    etag: str
+    last_modified: dt.datetime
+
+
+class _FeedCache:
+    """Rendered RSS feeds, dropped whenever a stream changes.
+
+    Changes are only noticed when they are committed in this process, so
+    feeds also expire after `ttl` seconds in case the recorder runs in a
+    process of its own.
+    """
+
+    ttl = 300
+
+    def __init__(self, size: int = 8) -> None:
+        self.size = size
+        self._feeds: OrderedDict[Any, tuple[float, _Feed]] = OrderedDict()
+        self._generation = 0
+        self._lock = Lock()
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def get(self, key: Any) -> Optional[_Feed]:
+        with self._lock:
+            if cached := self._feeds.get(key):
+                expires_at, feed = cached
+                if time.monotonic() < expires_at:
+                    self._feeds.move_to_end(key)
+                    return feed
+                del self._feeds[key]
+        return None
+
+    def put(self, key: Any, feed: _Feed, generation: int) -> None:
+        with self._lock:
+            # Streams changed while the feed was being rendered.
+            if generation != self._generation:
+                return
+            self._feeds[key] = (time.monotonic() + self.ttl, feed)
+            while len(self._feeds) > self.size:
+                self._feeds.popitem(last=False)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._feeds.clear()
+
+
+_feeds = _FeedCache()
+
+
+class _Page:
+    """Streams of a listing, fetched in chunks while they are iterated.
+
+    Once iterated, `cursor` points at the next page, if there may be one.
+    """
+
+    chunk_size = 100
+
+    def __init__(self, session: Session, query: Select, limit: int) -> None:
+        self.limit = limit
+        self._count = 0
+        self._last: Optional[db.Stream] = None
+        self._streams = session.scalars(
+            query.execution_options(yield_per=self.chunk_size)
+        )
+
+    def __iter__(self) -> Iterator[db.Stream]:
+        for stream in self._streams:
+            self._count += 1
+            self._last = stream
+            yield stream
+
+    @property
+    def cursor(self) -> Optional[str]:
+        if self._last is None or self._count < self.limit:
+            return None
+        assert self._last.created_at and self._last.id
+        key = f"{self._last.created_at.isoformat()},{self._last.id}"
+        return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def _page_args(
+    default_limit: int = 20, max_limit: int = 1000, clamp: bool = False
+) -> dict[str, Any]:
+    """Parses the `limit` and `before` query arguments of a listing.
+
+    With `clamp`, a limit out of range is moved into it rather than refused.
+    """
+    try:
+        limit = int(request.args.get("limit", default=default_limit))
+    except ValueError:
+        abort(400, "Invalid limit")
+    if clamp:
+        limit = min(max(limit, 1), max_limit)
+    elif not 0 < limit <= max_limit:
+        abort(400, f"Invalid limit, must be within 1-{max_limit}")
+    if (cursor := request.args.get("before")) is None:
+        return {"limit": limit, "before": None}
+    try:
+        created_at, stream_id = base64.urlsafe_b64decode(cursor).decode().split(",")
+        before = (dt.datetime.fromisoformat(created_at), int(stream_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400, "Invalid cursor")
+    return {"limit": limit, "before": before}
+
+
+class _CredentialCache:
+    """Credentials that passed check_password_hash() recently.
+
+    Passwords are kept as HMACs under a key of this process and compared in
+    constant time. Verifications are dropped when settings are committed in
+    this process, and expire after `ttl` seconds otherwise.
+    """
+
+    ttl = 60
+
+    def __init__(self) -> None:
+        self._generation = 0
+        self._key = secrets.token_bytes(32)
+        self._lock = Lock()
+        # Username -> expiry time and password HMAC.
+        self._verified: dict[str, tuple[float, bytes]] = {}
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def digest(self, password: str) -> bytes:
+        return hmac.new(self._key, password.encode(), hashlib.sha256).digest()
+
+    def check(self, username: str, digest: bytes) -> bool:
+        with self._lock:
+            cached = self._verified.get(username)
+        if cached is None:
+            return False
+        expires_at, verified = cached
+        return time.monotonic() < expires_at and hmac.compare_digest(digest, verified)
+
+    def add(self, username: str, digest: bytes, generation: int) -> None:
+        with self._lock:
+            # Settings changed while the password was being checked.
+            if generation != self._generation:
+                return
+            # There is only one account.
+            self._verified = {username: (time.monotonic() + self.ttl, digest)}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._verified = {}
+
+
+_credentials = _CredentialCache()
+
+
+def _stream_changed(_mapper: Any, _connection: Any, stream: db.Stream) -> None:
+    if session := object_session(stream):
+        session.info["streams_changed"] = True
+
+
+def _settings_changed(_mapper: Any, _connection: Any, settings: db.Settings) -> None:
+    if session := object_session(settings):
+        session.info["settings_changed"] = True
+
+
+def _invalidate_caches(session: Session) -> None:
+    if session.info.pop("streams_changed", False):
+        _feeds.invalidate()
+    if session.info.pop("settings_changed", False):
+        _credentials.invalidate()
+
+
+for _identifier in ("after_insert", "after_update", "after_delete"):
+    event.listen(db.Stream, _identifier, _stream_changed)
+    event.listen(db.Settings, _identifier, _settings_changed)
+event.listen(db.Session, "after_commit", _invalidate_caches)
+
+
+_request_seconds = metrics.registry.histogram(
+    "offstream_http_request_seconds",
+    "Seconds to answer API requests",
+    ["method", "endpoint", "status"],
+)
+
+
+@app.before_request
+def _start_request_timer() -> None:
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response: Response) -> Response:
+    if started := g.pop("request_started", None):
+        _request_seconds.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            # Endpoints rather than paths, there are only so many of them.
+            endpoint=request.endpoint or "none",
+            status=str(response.status_code),
+        )
+    return response
+
+
 @app.get("/")
 def root() -> ResponseReturnValue:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def show_metrics() -> ResponseReturnValue:
+    return metrics.registry.render(), {"Content-Type": metrics.CONTENT_TYPE}
+
+
+@app.get("/streams")
+def list_streams() -> ResponseReturnValue:
+    page_args = _page_args()
+    query = db.latest_streams(request.args.get("name"), **page_args)
+
+    def _generate() -> Iterator[str]:
+        with db.Session() as session:
+            page = _Page(session, query, page_args["limit"])
+            yield '{"streams": ['
+            for num, stream in enumerate(page):
+                if num:
+                    yield ", "
+                yield json.dumps(_serialize_stream(stream))
+            next_url = None
+            if page.cursor:
+                args = {**request.args, "before": page.cursor}
+                next_url = url_for("list_streams", **args, _external=True)
+            yield f'], "next": {json.dumps(next_url)}}}'
+
+    return Response(stream_with_context(_generate()), mimetype="application/json")
+
+
 @app.get("/latest/<name>")
 def latest_stream(name: str) -> ResponseReturnValue:
+    match = request.args.get("match", default="exact")
+    if match == "exact":
+        queries = [db.latest_stream(name), db.latest_stream_by_time(name)]
+    elif match == "contains":
+        queries = [db.latest_streams(name)]
+    else:
+        abort(400, "Invalid match")
     with db.Session() as session:
-        if stream := session.scalars(db.latest_streams(name)).first():
-            headers = {"location": stream.url, "access-control-allow-origin": "*"}
-            return {"url": stream.url}, 302, headers
+        for query in queries:
+            if stream := session.scalars(query).first():
+                url = playlist_url(stream)
+                headers = {"location": url, "access-control-allow-origin": "*"}
+                return {"url": url}, 302, headers
     abort(404, "No streams found")
 
 
+@app.get("/streams/<int:stream_id>/playlist.m3u8")
+def stream_playlist(stream_id: int) -> ResponseReturnValue:
+    with db.Session() as session:
+        stream = session.get(db.Stream, stream_id)
+        if not stream:
+            abort(404, "Stream not found")
+        m3u8 = _playlists.render(session, stream)
+        finished = bool(stream.url)
+    response = make_response(m3u8)
+    response.content_type = "application/vnd.apple.mpegurl"
+    response.access_control_allow_origin = "*"
+    if finished:
+        response.cache_control.public = True
+        response.cache_control.max_age = 86400
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
 @app.post("/streamers")
 def create_streamer() -> ResponseReturnValue:
     require_auth()
@@ -88,21 +414,30 @@ def update_settings() -> ResponseReturnValue:
 
 @app.get("/rss")
 def rss() -> ResponseReturnValue:
-    try:
-        limit = int(request.args.get("limit", default=20))
-    except ValueError:
-        abort(400, "Invalid limit")
-    with db.Session() as session:
-        streams = session.scalars(db.latest_streams(limit=limit)).all()
-    xml = render_template("rss.xml", streams=streams)
-    response = make_response(xml)
+    # Feed readers have any limit in their URLs, they page with `before`.
+    page_args = _page_args(max_limit=100, clamp=True)
+    # Links are absolute, so they depend on the host.
+    key = (page_args["limit"], page_args["before"], request.host_url)
+    if (feed := _feeds.get(key)) is None:
+        generation = _feeds.generation
+        # Pages are rendered whole for their ETag, they are small enough.
+        with db.Session() as session:
+            page = _Page(session, db.latest_streams(**page_args), page_args["limit"])
+            xml = render_template("rss.xml", streams=page).encode()
+        etag = hashlib.sha1(xml).hexdigest()  # nosec
+        now = dt.datetime.now(dt.timezone.utc).replace(microsecond=0)
+        feed = _Feed(xml, etag, now)
+        _feeds.put(key, feed, generation)
+    response = make_response(feed.xml)
     response.content_type = "application/rss+xml"
-    return response
+    response.set_etag(feed.etag)
+    response.last_modified = feed.last_modified
+    return response.make_conditional(request)
 
 
 @app.get("/welcome")
 def welcome() -> ResponseReturnValue:
-    db.Base.metadata.create_all(db.engine)
+    db.create_all(db.engine)
     with db.Session() as session:
         if session.query(db.Settings).scalar():
             abort(409, "This app has already been claimed.")
@@ -129,6 +464,39 @@ def handle_error(error: HTTPException) -> ResponseReturnValue:
     }, error.code
 
 
+@app.get("/live/<name>/playlist.m3u8")
+def live_playlist(name: str) -> ResponseReturnValue:
+    if not (recording := live.find(name.lower())):
+        abort(404, "Not recording")
+    response = make_response(recording.render())
+    response.content_type = "application/vnd.apple.mpegurl"
+    response.access_control_allow_origin = "*"
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.get("/live/<name>/<segment>")
+def live_segment(name: str, segment: str) -> ResponseReturnValue:
+    if recording := live.find(name.lower()):
+        if (data := recording.read(segment)) is not None:
+            response = make_response(data)
+            response.content_type = "video/mp2t"
+            response.access_control_allow_origin = "*"
+            return response
+        # It has been flushed since the playlist was loaded.
+        if url := recording.url(segment):
+            return redirect(url)
+    abort(404, "Segment not found")
+
+
+@app.template_global()
+def playlist_url(stream: db.Stream) -> str:
+    """Returns the IPFS playlist, or the one that is still being recorded."""
+    if stream.url:
+        return str(stream.url)
+    return url_for("stream_playlist", stream_id=stream.id, _external=True)
+
+
 @app.template_filter("rfc822")
 def rfc822(value: dt.datetime, timezone: dt.timezone = dt.timezone.utc) -> str:
     timetz = value.replace(tzinfo=timezone).astimezone()
@@ -140,18 +508,36 @@ def require_auth() -> None:
         abort(401, "Authentication failed")
     username = request.authorization.username
     password = request.authorization.password
+    if not username or not password:
+        abort(401, "Authentication failed")
+    digest = _credentials.digest(password)
+    if _credentials.check(username, digest):
+        return  # Pass
+    generation = _credentials.generation
     with db.Session() as session:
         settings = session.query(db.Settings).scalar()
         if (
             settings
             and username == settings.username
-            and password
             and check_password_hash(settings.password, password)
         ):
+            _credentials.add(username, digest, generation)
             return  # Pass
     abort(401, "Authentication failed")
 
 
+def _serialize_stream(stream: db.Stream) -> dict[str, Any]:
+    assert stream.created_at and stream.streamer
+    return {
+        "id": stream.id,
+        "streamer": stream.streamer.name,
+        "title": stream.title,
+        "category": stream.category,
+        "created_at": stream.created_at.isoformat(),
+        "url": playlist_url(stream),
+    }
+
+
 def _serialize_streamer(streamer: db.Streamer) -> dict[str, Any]:
     return {
         "id": streamer.id,
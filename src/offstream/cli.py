@@ -1,16 +1,17 @@
+import os
 import signal
 from datetime import datetime
 from threading import Thread
-from typing import Any, Callable
+from typing import Any, Callable, Optional
 from urllib.request import Request, urlopen
-from wsgiref.simple_server import make_server
 
 import click
 from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 
-from offstream import db
-from offstream.streaming import Recorder
+from offstream import db, metrics
+from offstream.server import make_server
+from offstream.streaming import AsyncRecorder, Recorder, tracing
 
 
 def _validate_within(
@@ -35,8 +36,34 @@ def _validate_within(
     show_default=True,
     callback=_validate_within(0, 63535),
 )
+@click.option(
+    "--server",
+    help="HTTP server  [env: OFFSTREAM_SERVER; default: threaded]",
+    type=click.Choice(["threaded", "simple"]),
+    default=lambda: os.getenv("OFFSTREAM_SERVER", "threaded"),
+)
+@click.option(
+    "--threads",
+    help="Threads of the threaded server  [env: OFFSTREAM_THREADS; default: 8]",
+    type=click.IntRange(min=1),
+    default=lambda: int(os.getenv("OFFSTREAM_THREADS", "8")),
+)
+@click.option(
+    "--keep-alive",
+    help="Seconds to keep idle connections open, 0 to disable  "
+    "[env: OFFSTREAM_KEEP_ALIVE; default: 5]",
+    type=click.FloatRange(min=0),
+    default=lambda: float(os.getenv("OFFSTREAM_KEEP_ALIVE", "5")),
+)
 @click.version_option(package_name="offstream")
-def main(ctx: click.core.Context, host: str, port: int) -> None:
+def main(
+    ctx: click.core.Context,
+    host: str,
+    port: int,
+    server: str,
+    threads: int,
+    keep_alive: float,
+) -> None:
     """Start offstream API and recorder"""
     ctx.invoke(init_db)
     if ctx.invoked_subcommand is not None:
@@ -45,37 +72,101 @@ def main(ctx: click.core.Context, host: str, port: int) -> None:
     from offstream.app import app
 
     try:
-        httpd = make_server(host, port, app)
+        httpd = make_server(
+            host, port, app, server=server, threads=threads, keep_alive=keep_alive
+        )
     except OSError as error:
         raise click.ClickException(f"Bind failed: {error}") from error
     bind_host, bind_port = httpd.server_address
     click.echo(f"Running on http://{bind_host}:{bind_port}/")
-    server = Thread(target=httpd.serve_forever)
-    server.start()
+    server_thread = Thread(target=httpd.serve_forever)
+    server_thread.start()
     try:
         ctx.invoke(record)
     finally:
         httpd.shutdown()
-        server.join()
+        server_thread.join()
+        httpd.server_close()
 
 
 @main.command("record")
-def record() -> None:
+@click.option(
+    "--engine",
+    help="Recording engine  [env: OFFSTREAM_ENGINE; default: thread]",
+    type=click.Choice(["thread", "async"]),
+    default=lambda: os.getenv("OFFSTREAM_ENGINE", "thread"),
+)
+@click.option(
+    "--metrics-host",
+    help="Bind host of the metrics server",
+    default="127.0.0.1",
+    show_default=True,
+)
+@click.option(
+    "--metrics-port",
+    help="Serve metrics on this port, the API serves them at /metrics  "
+    "[env: OFFSTREAM_METRICS_PORT]",
+    type=click.IntRange(0, 65535),
+    default=lambda: os.getenv("OFFSTREAM_METRICS_PORT"),
+)
+@click.option(
+    "--trace-file",
+    help="Append timings of reading, flushing, uploading and committing "
+    "segments to this JSON Lines file  [env: OFFSTREAM_TRACE_FILE]",
+    type=click.Path(dir_okay=False, writable=True),
+    default=lambda: os.getenv("OFFSTREAM_TRACE_FILE"),
+)
+def record(
+    engine: str,
+    metrics_host: str,
+    metrics_port: Optional[int],
+    trace_file: Optional[str],
+) -> None:
     """Start offstream recorder"""
+
     def close_recorder(*_args: Any) -> None:
         recorder.close()
 
-    recorder = Recorder()
+    recorder = AsyncRecorder() if engine == "async" else Recorder()
     signal.signal(signal.SIGINT, close_recorder)
     signal.signal(signal.SIGTERM, close_recorder)
-    recorder.start()
+    if trace_file is None:
+        _start(recorder, metrics_host, metrics_port)
+        return
+    sink = tracing.JSONLSink(trace_file)
+    tracing.add_sink(sink)
+    try:
+        _start(recorder, metrics_host, metrics_port)
+    finally:
+        tracing.remove_sink(sink)
+        sink.close()
+
+
+def _start(recorder: Recorder, metrics_host: str, metrics_port: Optional[int]) -> None:
+    if metrics_port is None:
+        recorder.start()
+        return
+    try:
+        httpd = make_server(metrics_host, metrics_port, metrics.wsgi_app, threads=2)
+    except OSError as error:
+        raise click.ClickException(f"Bind failed: {error}") from error
+    bind_host, bind_port = httpd.server_address
+    click.echo(f"Serving metrics on http://{bind_host}:{bind_port}/metrics")
+    server_thread = Thread(target=httpd.serve_forever)
+    server_thread.start()
+    try:
+        recorder.start()
+    finally:
+        httpd.shutdown()
+        server_thread.join()
+        httpd.server_close()
 
 
 @main.command("init-db")
 def init_db() -> None:
     """Create db tables"""
     try:
-        db.Base.metadata.create_all(db.engine)
+        db.create_all(db.engine)
     except SQLAlchemyError as error:
         msg = str(error).splitlines()[0]
         raise click.ClickException(msg) from error
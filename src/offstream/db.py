@@ -1,21 +1,31 @@
+import datetime as dt
 import os
 import re
 import secrets
 import string
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
 from click import get_app_dir
 from sqlalchemy import (
     Column,
     DateTime,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     String,
+    and_,
     create_engine,
+    delete,
+    event,
     func,
+    insert,
+    or_,
     select,
+    update,
 )
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import (
     backref,
@@ -25,7 +35,7 @@ from sqlalchemy.orm import (
     sessionmaker,
     validates,
 )
-from sqlalchemy.sql.expression import Select
+from sqlalchemy.sql.expression import Delete, Insert, Select
 from werkzeug.security import generate_password_hash
 
 
@@ -43,6 +53,18 @@ def _uri(app_name: str = "offstream") -> str:
 _echo = os.getenv("FLASK_ENV") == "development"
 engine = create_engine(_uri(), future=True, echo=_echo)
 
+
+def _enable_wal(dbapi_connection: Any, _connection_record: Any) -> None:
+    # Readers don't block the writer and vice versa. In-memory databases
+    # ignore it.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", _enable_wal)
+
 Session = sessionmaker(engine, future=True)
 
 Base = declarative_base()
@@ -77,12 +99,41 @@ class Streamer(Base):
         return self._uri_template.format(name=self.name)
 
 
+class StreamerChange(Base):
+    """Log of added, updated and deleted streamers.
+
+    The recorder loads the streamers that changed since the last entry it
+    has seen, rather than all of them on every check, and prunes entries
+    that it has read.
+    """
+
+    __tablename__ = "streamer_changes"
+
+    id = Column(Integer, primary_key=True)
+    # Not a foreign key, deleted streamers are logged too.
+    streamer_id = Column(Integer, nullable=False)
+
+
+def _log_streamer_change(
+    _mapper: Any, connection: Connection, streamer: Streamer
+) -> None:
+    connection.execute(insert(StreamerChange).values(streamer_id=streamer.id))
+
+
+for _event in ("after_insert", "after_update", "after_delete"):
+    event.listen(Streamer, _event, _log_streamer_change)
+
+
 class Stream(Base):
     __tablename__ = "streams"
+    __table_args__ = (
+        Index("ix_streams_streamer_id_created_at", "streamer_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     streamer_id = Column(Integer, ForeignKey("streamers.id"), nullable=False)
-    url = Column(String, nullable=False)
+    # Empty while the recording is in progress, see Segment.
+    url = Column(String, nullable=False, default="")
     title = Column(String, nullable=True)
     category = Column(String, nullable=True)
     created_at = Column(DateTime, nullable=False, server_default=func.now(), index=True)
@@ -92,6 +143,77 @@ class Stream(Base):
     )
 
 
+class LatestStream(Base):
+    """Points at the latest stream of each streamer.
+
+    It is a table of its own, rather than a column of streamers, so that
+    `create_all()` adds it to existing databases and fills it in.
+    """
+
+    __tablename__ = "latest_streams"
+
+    streamer_id = Column(Integer, ForeignKey("streamers.id"), primary_key=True)
+    stream_id = Column(Integer, ForeignKey("streams.id"), nullable=False)
+
+    streamer = relationship(
+        Streamer,
+        backref=backref("latest", cascade="all, delete-orphan", uselist=False),
+        uselist=False,
+    )
+    stream = relationship(
+        Stream,
+        backref=backref("latest_of", cascade="all", uselist=False),
+        uselist=False,
+    )
+
+
+def _update_latest_stream(_mapper: Any, connection: Connection, stream: Stream) -> None:
+    # New streams are the latest ones, there is one recorder per streamer.
+    latest = LatestStream.__table__
+    result = connection.execute(
+        update(latest)
+        .where(latest.c.streamer_id == stream.streamer_id)
+        .values(stream_id=stream.id)
+    )
+    if not result.rowcount:
+        connection.execute(
+            insert(latest).values(streamer_id=stream.streamer_id, stream_id=stream.id)
+        )
+
+
+event.listen(Stream, "after_insert", _update_latest_stream)
+
+
+class Segment(Base):
+    __tablename__ = "segments"
+    __table_args__ = (Index("ix_segments_stream_id_id", "stream_id", "id"),)
+
+    id = Column(Integer, primary_key=True)
+    stream_id = Column(Integer, ForeignKey("streams.id"), nullable=False)
+    url = Column(String, nullable=False)
+    duration = Column(Float, nullable=False)
+
+    # Segments are deleted in bulk with their stream, see _delete_segments.
+    stream = relationship(
+        Stream,
+        backref=backref(
+            "segments",
+            cascade="save-update, merge",
+            passive_deletes="all",
+            order_by="Segment.id",
+        ),
+        uselist=False,
+    )
+
+
+def _delete_segments(_mapper: Any, connection: Connection, stream: Stream) -> None:
+    # Rather than loading every segment to delete it.
+    connection.execute(delete(Segment).where(Segment.stream_id == stream.id))
+
+
+event.listen(Stream, "before_delete", _delete_segments)
+
+
 class Settings(Base):
     __tablename__ = "settings"
 
@@ -116,18 +238,115 @@ class Settings(Base):
         raise ValueError(f"Invalid hour: {value}")
 
 
-def latest_streams(name: Optional[str] = None, limit: Optional[int] = None) -> Select:
+def create_all(bind: Engine) -> None:
+    """Creates missing tables and indexes, and fills in LatestStream.
+
+    `Base.metadata.create_all()` skips the indexes of existing tables, so
+    they are created one by one.
+    """
+    Base.metadata.create_all(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        connection.execute(_backfill_latest_streams())
+
+
+def _backfill_latest_streams() -> Insert:
+    # The newest stream of every streamer that has no latest one yet.
+    newest = (
+        select(Stream.streamer_id, func.max(Stream.created_at).label("created_at"))
+        .group_by(Stream.streamer_id)
+        .subquery()
+    )
+    rows = (
+        select(Stream.streamer_id, func.max(Stream.id))
+        .join(
+            newest,
+            and_(
+                Stream.streamer_id == newest.c.streamer_id,
+                Stream.created_at == newest.c.created_at,
+            ),
+        )
+        .where(Stream.streamer_id.not_in(select(LatestStream.streamer_id)))
+        .group_by(Stream.streamer_id)
+    )
+    return insert(LatestStream).from_select(["streamer_id", "stream_id"], rows)
+
+
+def latest_streams(
+    name: Optional[str] = None,
+    limit: Optional[int] = None,
+    before: Optional[tuple[dt.datetime, int]] = None,
+) -> Select:
+    """Finds streams from newest to oldest.
+
+    `before` is the (created_at, id) of the last stream of the previous
+    page, so a page starts where the previous one ended without skipping
+    over the streams before it.
+    """
     streams = (
         select(Stream)
         .options(joinedload(Stream.streamer))
-        .order_by(Stream.created_at.desc())
+        .order_by(Stream.created_at.desc(), Stream.id.desc())
         .limit(limit)
     )
+    if before:
+        created_at, stream_id = before
+        streams = streams.where(
+            or_(
+                Stream.created_at < created_at,
+                and_(Stream.created_at == created_at, Stream.id < stream_id),
+            )
+        )
     if name:
         streams = streams.join(Streamer).where(Streamer.name.contains(name))
     return streams
 
 
+def latest_stream(name: str) -> Select:
+    """Finds the latest stream of a streamer by exact name."""
+    return (
+        select(Stream)
+        .options(joinedload(Stream.streamer))
+        .join(LatestStream, LatestStream.stream_id == Stream.id)
+        .join(Streamer, Streamer.id == LatestStream.streamer_id)
+        .where(Streamer.name == name.lower())
+    )
+
+
+def latest_stream_by_time(name: str) -> Select:
+    # For streamers whose latest stream predates LatestStream.
+    return (
+        select(Stream)
+        .options(joinedload(Stream.streamer))
+        .join(Streamer)
+        .where(Streamer.name == name.lower())
+        .order_by(Stream.created_at.desc())
+        .limit(1)
+    )
+
+
+def stream_segments(stream_id: int, after_id: int = 0) -> Select:
+    return (
+        select(Segment.id, Segment.url, Segment.duration)
+        .where(Segment.stream_id == stream_id, Segment.id > after_id)
+        .order_by(Segment.id)
+    )
+
+
+def streamer_changes(after_id: int = 0) -> Select:
+    return (
+        select(StreamerChange.id, StreamerChange.streamer_id)
+        .where(StreamerChange.id > after_id)
+        .order_by(StreamerChange.id)
+    )
+
+
+def prune_streamer_changes(up_to_id: int) -> Delete:
+    return delete(StreamerChange).where(StreamerChange.id <= up_to_id)
+
+
 def settings(
     username: str = "offstream",
     passowrd_alphabet: str = string.ascii_lowercase,
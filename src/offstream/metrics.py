@@ -0,0 +1,193 @@
+"""Process-wide metrics in the Prometheus text format.
+
+The app serves them at /metrics, `offstream record --metrics-port` serves
+them when the recorder runs on its own.
+"""
+
+import math
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from threading import Lock
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_Labels = tuple[str, ...]
+_M = TypeVar("_M", bound="_Metric")
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        with self._lock:
+            samples = list(self._samples())
+        for suffix, labels, value in samples:
+            yield f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+
+    def _key(self, labels: dict[str, str]) -> _Labels:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"{self.name} has labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> Iterator[tuple[str, list[tuple[str, str]], float]]:
+        """Yields the name suffix, labels and value of each sample."""
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        # Metrics without labels are reported from the start.
+        self._values: dict[_Labels, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[tuple[str, list[tuple[str, str]], float]]:
+        for key, value in self._values.items():
+            yield "", list(zip(self.labelnames, key)), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: Optional[Iterable[float]] = None,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets or self.default_buckets)) + (math.inf,)
+        # Per label set: count per bucket, sum.
+        self._values: dict[_Labels, tuple[list[int], list[float]]] = {}
+        if not self.labelnames:
+            self._values[()] = ([0] * len(self.buckets), [0.0])
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * len(self.buckets), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([], [0.0]))
+            return sum(counts)
+
+    def _samples(self) -> Iterator[tuple[str, list[tuple[str, str]], float]]:
+        for key, (counts, total) in self._values.items():
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _format_value(bound)
+                yield "_bucket", labels + [("le", le)], cumulative
+            yield "_sum", labels, total[0]
+            yield "_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._metrics: dict[str, _Metric] = {}
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: Optional[Iterable[float]] = None,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: _M) -> _M:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+
+registry = Registry()
+
+
+def wsgi_app(
+    environ: dict[str, Any], start_response: Callable[..., Any]
+) -> list[bytes]:
+    """Serves the metrics at any path."""
+    body = registry.render().encode()
+    start_response(
+        "200 OK",
+        [("Content-Type", CONTENT_TYPE), ("Content-Length", str(len(body)))],
+    )
+    return [body]
+
+
+def _format_labels(labels: list[tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return f"{{{pairs}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
@@ -0,0 +1,244 @@
+import selectors
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from typing import Any, Optional
+from wsgiref import simple_server
+
+from werkzeug.wsgi import LimitedStream
+
+
+class PooledWSGIServer(simple_server.WSGIServer):
+    """HTTP/1.1 server that handles requests on a fixed pool of threads.
+
+    A connection only takes a thread while one of its requests is read and
+    answered. In between, a watcher thread waits for it to become readable,
+    so idle clients don't keep others waiting. Idle connections are closed
+    after `keep_alive` seconds, zero disables keep-alive.
+    """
+
+    # Seconds to wait for the rest of a request once it started arriving.
+    request_timeout = 10
+
+    def __init__(
+        self, host: str, port: int, app: Any, threads: int = 8, keep_alive: float = 5
+    ) -> None:
+        self._connection_type: type[_Connection] = type(
+            "_Connection",
+            (_Connection,),
+            {
+                "protocol_version": "HTTP/1.1" if keep_alive else "HTTP/1.0",
+                "timeout": self.request_timeout,
+            },
+        )
+        self.keep_alive = keep_alive
+        self.threads = threads
+        self._closed = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="offstream-http"
+        )
+        self._lock = Lock()
+        self._returned: list[_Connection] = []
+        self._selector = selectors.DefaultSelector()
+        self._wakeup, self._wakeup_writer = socket.socketpair()
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        # Started first, server_close() stops it if binding fails.
+        self._watcher = Thread(target=self._watch, name="offstream-http-watcher")
+        self._watcher.start()
+        super().__init__((host, port), self._connection_type)
+        self.set_app(app)
+
+    @property
+    def port(self) -> int:
+        return int(self.server_address[1])
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        # New connections wait for their first request like idle ones.
+        self._return(self._connection_type(request, client_address, self))
+
+    def server_close(self) -> None:
+        super().server_close()
+        with self._lock:
+            self._closed = True
+        self._wake()
+        self._watcher.join()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._selector.close()
+        self._wakeup.close()
+        self._wakeup_writer.close()
+
+    def _serve(self, connection: "_Connection") -> None:
+        try:
+            connection.handle_one_request()
+        except ConnectionError:  # The client is gone
+            connection.close_connection = True
+        except Exception:
+            self.handle_error(connection.request, connection.client_address)
+            connection.close_connection = True
+        if connection.close_connection:
+            connection.close()
+        elif connection.has_buffered_request():
+            self._serve(connection)
+        else:
+            self._return(connection)
+
+    def _return(self, connection: "_Connection") -> None:
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                connection.idle_since = time.monotonic()
+                self._returned.append(connection)
+        if closed:
+            connection.close()
+        else:
+            self._wake()
+
+    def _wake(self) -> None:
+        try:
+            self._wakeup_writer.send(b"\0")
+        except BlockingIOError:  # Awake already
+            pass
+
+    def _watch(self) -> None:
+        selector = self._selector
+        returned: list[_Connection] = []
+        while True:
+            with self._lock:
+                if self._closed:
+                    break
+                returned, self._returned = self._returned, []
+            for connection in returned:
+                selector.register(connection, selectors.EVENT_READ, connection)
+            for key, _ in selector.select(timeout=1):
+                if key.data is None:
+                    self._wakeup.recv(4096)
+                    continue
+                selector.unregister(key.fileobj)
+                try:
+                    self._executor.submit(self._serve, key.data)
+                except RuntimeError:  # Closing time
+                    key.data.close()
+            idle_since = time.monotonic() - (self.keep_alive or self.request_timeout)
+            for key in list(selector.get_map().values()):
+                if key.data is not None and key.data.idle_since < idle_since:
+                    selector.unregister(key.fileobj)
+                    key.data.close()
+        for key in list(selector.get_map().values()):
+            if key.data is not None:
+                selector.unregister(key.fileobj)
+                key.data.close()
+        for connection in self._returned:
+            connection.close()
+
+
+class _ServerHandler(simple_server.ServerHandler):
+    keep_alive = False
+
+    def cleanup_headers(self) -> None:
+        super().cleanup_headers()
+        headers = self.headers  # type: ignore
+        # Without a length, the end of the response is when it is closed.
+        if "Content-Length" not in headers:
+            self.keep_alive = False
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+
+
+class _Connection(simple_server.WSGIRequestHandler):
+    """Serves a request of the connection per `handle_one_request()` call.
+
+    Unlike socketserver's handlers, it doesn't serve the connection when it
+    is created, the server calls it whenever a request arrives.
+    """
+
+    def __init__(self, request: Any, client_address: Any, server: Any) -> None:
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.close_connection = True
+        self.idle_since = 0.0
+        self.setup()
+
+    def fileno(self) -> int:
+        return int(self.connection.fileno())
+
+    def has_buffered_request(self) -> bool:
+        # Pipelined requests may already be in rfile, the socket won't tell.
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))  # type: ignore
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def close(self) -> None:
+        try:
+            self.finish()
+        except OSError:
+            pass
+        self.server.shutdown_request(self.request)
+
+    def log_error(self, format: str, *args: Any) -> None:
+        # Clients that stall halfway are closed, there is nothing to report.
+        if not format.startswith("Request timed out"):
+            super().log_error(format, *args)
+
+    def __getattr__(self, name: str) -> Any:
+        # All methods are handled by the app.
+        if name.startswith("do_"):
+            return self._run_wsgi
+        raise AttributeError(name)
+
+    def _run_wsgi(self) -> None:
+        chunked = "chunked" in self.headers.get("transfer-encoding", "").lower()
+        length = 0
+        if not chunked:
+            try:
+                length = int(self.headers.get("content-length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                # The body can't be found, nor the next request.
+                self.close_connection = True
+                self.send_error(400, "Bad Content-Length")
+                return
+        environ = self.get_environ()
+        rfile: Any = self.rfile
+        body: Optional[LimitedStream] = None
+        if chunked:
+            # The request body can't be skipped if the app doesn't read it.
+            self.close_connection = True
+        else:
+            body = environ["wsgi.input"] = LimitedStream(rfile, length)
+        handler = _ServerHandler(
+            environ["wsgi.input"],
+            self.wfile,  # type: ignore
+            self.get_stderr(),
+            environ,
+            multithread=True,
+        )
+        handler.http_version = self.protocol_version.split("/")[1]
+        handler.keep_alive = not self.close_connection
+        handler.request_handler = self  # type: ignore
+        handler.run(self.server.get_app())  # type: ignore
+        if not handler.keep_alive:
+            self.close_connection = True
+        elif body is not None:
+            body.exhaust()
+
+
+def make_server(
+    host: str,
+    port: int,
+    app: Any,
+    server: str = "threaded",
+    threads: int = 8,
+    keep_alive: float = 5,
+) -> Any:
+    if server == "simple":
+        # One request at a time, no keep-alive.
+        return simple_server.make_server(host, port, app)
+    return PooledWSGIServer(host, port, app, threads=threads, keep_alive=keep_alive)
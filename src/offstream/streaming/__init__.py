@@ -1,10 +1,12 @@
 import logging
 import sys
 
+from .aio import AsyncRecorder
+from .probe import Prober, TwitchProber
 from .recorder import Recorder
 
 logger = logging.getLogger("offstream")
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
-__all__ = ["Recorder"]
+__all__ = ["AsyncRecorder", "Prober", "Recorder", "TwitchProber"]
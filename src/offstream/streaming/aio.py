@@ -0,0 +1,430 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from types import TracebackType
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar
+
+from ipfshttpclient.http_common import multiaddr_to_url_data  # type: ignore
+from streamlink import Streamlink  # type: ignore
+from streamlink.plugins.twitch import TwitchM3U8, TwitchM3U8Parser  # type: ignore
+from streamlink.stream.hls_playlist import load as load_playlist  # type: ignore
+
+from offstream import db
+
+from . import live, tracing
+from .budget import MemoryBudget
+from .ipfs import IPFSPool
+from .probe import Prober
+from .recorder import (
+    Recorder,
+    _active_recordings,
+    _dirty_bytes,
+    _flush_seconds,
+    _pending_flushes,
+    _Segment,
+    _timed_upload,
+    _Worker,
+)
+from .spool import SpoolFile
+from .writer import DBWriter
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None  # type: ignore
+
+_logger = logging.getLogger("offstream")
+
+_T = TypeVar("_T")
+
+
+class AsyncRecorder(Recorder):
+    """Recorder that runs every recording as a coroutine on one event loop.
+
+    Segments are fetched, spooled and uploaded with aiohttp. Blocking work
+    (database access, live-status probing and stream discovery) is handed off
+    to a single helper thread and the default executor respectively.
+    """
+
+    def __init__(self, prober: Optional[Prober] = None) -> None:
+        if aiohttp is None:
+            raise RuntimeError(
+                "The asyncio engine requires aiohttp, run: pip install offstream[async]"
+            )
+        super().__init__(prober)
+        self._db_executor = ThreadPoolExecutor(max_workers=1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: dict[int, asyncio.Task[None]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self, _loop: bool = True) -> None:
+        if self._closed.is_set():
+            return
+        try:
+            asyncio.run(self._run(_loop))
+        finally:
+            self._shutdown()
+
+    def close(self) -> None:
+        _logger.info("\nClosing, please wait")
+        with self._lock:
+            self._closed.set()
+            loop = self._loop
+        if loop is None:
+            self._shutdown()
+            return
+        try:
+            loop.call_soon_threadsafe(self._cancel)
+        except RuntimeError:  # The loop is closed already
+            pass
+
+    async def _run(self, _loop: bool) -> None:
+        self._wakeup = asyncio.Event()
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self._loop = asyncio.get_running_loop()
+        headers = dict(self._streamlink.http.headers)
+        async with aiohttp.ClientSession(headers=headers) as http:
+            while not self._closed.is_set():
+                for streamer in await self._run_db(self._check, time.time()):
+                    assert streamer.id
+                    _logger.info("Checking %s", streamer.name)
+                    record = self._record_streamer_async(streamer, http)
+                    self._tasks[streamer.id] = asyncio.create_task(record)
+                if not _loop:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._wait_time())
+                except asyncio.TimeoutError:
+                    pass
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _record_streamer_async(
+        self, streamer: db.Streamer, http: "aiohttp.ClientSession"
+    ) -> None:
+        assert streamer.id
+        worker = _AsyncWorker(
+            self._streamlink,
+            streamer,
+            self._ipfs_pool,
+            self._budget,
+            self._writer,
+            http,
+            self._run_db,
+        )
+        try:
+            with self._lock:
+                if self._closed.is_set() or streamer.id not in self._streamers:
+                    return
+                self._recording[streamer.id] = worker
+            _active_recordings.inc()
+            try:
+                async with worker:
+                    await worker.record()
+            finally:
+                _active_recordings.dec()
+        except asyncio.CancelledError:  # Closing time
+            _logger.info("Canceled recording")
+        except Exception:
+            _logger.warning("Exception while recording", exc_info=True)
+        finally:
+            with self._lock:
+                del self._recording[streamer.id]
+            del self._tasks[streamer.id]
+
+    async def _run_db(self, func: Callable[..., _T], *args: Any) -> _T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, func, *args)
+
+    def _cancel(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _shutdown(self) -> None:
+        # The session belongs to the database thread.
+        self._db_executor.submit(self._session.close)
+        self._db_executor.shutdown()
+        self._executor.shutdown(cancel_futures=True)
+        self._ipfs_pool.close()
+        self._prober.close()
+        _logger.info("Database writer stats: %s", self.db_stats)
+        self._writer.close()
+
+
+class _AsyncWorker(_Worker):
+    chunk_size = 8192
+    max_reload_failures = 10
+
+    def __init__(
+        self,
+        streamlink: Streamlink,
+        streamer: db.Streamer,
+        ipfs_pool: IPFSPool,
+        budget: MemoryBudget,
+        writer: DBWriter,
+        http: "aiohttp.ClientSession",
+        run_db: Callable[..., Any],
+    ) -> None:
+        super().__init__(streamlink, streamer, ipfs_pool, budget, writer)
+        self._api_url = multiaddr_to_url_data(self.ipfs_api_addr, "api/v0")[0]
+        self._http = http
+        self._last_upload: Optional[asyncio.Task[None]] = None
+        self._run_db = run_db
+        self._upload_slots = asyncio.Semaphore(self.upload_concurrency)
+        self._uploads: set[asyncio.Task[Any]] = set()
+
+    async def record(self) -> None:
+        loop = asyncio.get_running_loop()
+        found = await loop.run_in_executor(None, self._find_stream_info)
+        if found is None or self._closed:
+            return
+        url, title, category, broadcast_id = found
+        _logger.info("Recording %s", self._streamer.name)
+        journal_state = self._load_journal(broadcast_id)
+        self._stream = await self._run_db(
+            self._journaled_stream, journal_state, title, category
+        )
+        self._replay(journal_state)
+        live.publish(str(self._streamer.name), self._live)
+        async for num, uri, duration in self._sequences(url):
+            if num <= self._resume_after:
+                continue
+            await self._wait_for_uploads()
+            try:
+                await self._fetch_segment(num, uri, duration)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                _logger.warning(
+                    "Exception while reading %s: %s", self._streamer.name, error
+                )
+
+    def _find_stream_info(self) -> Optional[tuple[str, Any, Any, Optional[str]]]:
+        if found := self._find_stream():
+            stream, plugin = found
+            title, category = plugin.get_title(), plugin.get_category()
+            return stream.url, title, category, plugin.get_id()
+        return None
+
+    async def _sequences(self, url: str) -> AsyncIterator[tuple[int, str, float]]:
+        last_num = -1
+        failures = 0
+        while not self._closed:
+            try:
+                async with self._http.get(url) as response:
+                    response.raise_for_status()
+                    text = await response.text()
+                playlist = load_playlist(
+                    text, str(response.url), parser=TwitchM3U8Parser, m3u8=TwitchM3U8
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as error:
+                failures += 1
+                if failures >= self.max_reload_failures:
+                    _logger.warning(
+                        "Exception while recording %s: %s", self._streamer.name, error
+                    )
+                    return
+                await asyncio.sleep(1)
+                continue
+            failures = 0
+            media_sequence = playlist.media_sequence or 0
+            for offset, segment in enumerate(playlist.segments):
+                num = media_sequence + offset
+                if num <= last_num:
+                    continue
+                last_num = num
+                if not getattr(segment, "ad", False):
+                    yield num, segment.uri, segment.duration
+            if playlist.is_endlist:
+                return
+            await asyncio.sleep(playlist.target_duration or 2)
+
+    async def _fetch_segment(self, num: int, uri: str, duration: float) -> None:
+        if not self._used:
+            self._used = True
+            self._count("used")
+        name = f"{num}.ts"
+        streamer = str(self._streamer.name)
+        segfile = self._spool.create(name)
+        with tracing.span("segment", streamer=streamer, segment=name) as span:
+            try:
+                async with self._http.get(uri) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        with span.timer("write_seconds"):
+                            segfile.write(chunk)
+            except BaseException:
+                segfile.release()
+                raise
+            finally:
+                segfile.close()
+            span.set(size=segfile.size)
+        self._append_segment(_Segment(segfile.name, segfile.size, duration, segfile))
+
+    async def _wait_for_uploads(self) -> None:
+        # Stop fetching segments while too many flushes are in flight.
+        while self._last_upload is not None:
+            pending = [task for task in self._uploads if task.get_name() == "commit"]
+            if len(pending) < self.max_pending_uploads:
+                return
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+    def _flush(self) -> None:
+        _logger.info("Flushing %s", self._streamer.name)
+        segments, self._dirty_segments = self._dirty_segments, []
+        size, self._dirty_size = self._dirty_size, 0
+        streamer = str(self._streamer.name)
+        _dirty_bytes.set(0, streamer=streamer)
+        flush_num = self._flush_count
+        self._flush_count += 1
+        if tracing.enabled():
+            # Uploads and commits happen in tasks, this one doesn't wait.
+            names = [segment.name for segment in segments]
+            with tracing.span("flush", streamer=streamer, flush=flush_num) as span:
+                span.set(size=size, segments=names)
+        upload = asyncio.create_task(self._upload_segments_async(segments, flush_num))
+        commit = asyncio.create_task(
+            self._commit_async(
+                flush_num, segments, upload, self._last_upload, time.monotonic()
+            ),
+            name="commit",
+        )
+        self._last_upload = commit
+        _pending_flushes.inc()
+        commit.add_done_callback(lambda _task: _pending_flushes.dec())
+        for task in (upload, commit):
+            self._uploads.add(task)
+            task.add_done_callback(self._uploads.discard)
+
+    async def _commit_async(
+        self,
+        flush_num: int,
+        segments: list[_Segment],
+        upload: "asyncio.Task[str]",
+        previous: Optional[asyncio.Task[None]],
+        flushed_at: float,
+    ) -> None:
+        # Uploads run concurrently, playlists are committed in order.
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            cid = await upload
+            if self._discarded:  # The streamer is gone
+                raise asyncio.CancelledError
+            self._journal_uploaded(cid, segments)
+            streamer = str(self._streamer.name)
+            with tracing.span("playlist", streamer=streamer, flush=flush_num):
+                self._append_playlist(cid, segments)
+            with tracing.span("commit", streamer=streamer, flush=flush_num):
+                self._saved(await asyncio.wrap_future(self._save()))
+            self._journal_committed()
+            _flush_seconds.observe(time.monotonic() - flushed_at)
+        except asyncio.CancelledError:  # Closing time
+            _logger.info("Canceled flushing %s", self._streamer.name)
+            self._live.discard(segment.name for segment in segments)
+            self._keep_pending(segments)
+            raise
+        except Exception:
+            # The recording will be playable, but it will miss a chunk.
+            _logger.warning(
+                "Exception while flushing %s", self._streamer.name, exc_info=True
+            )
+        else:
+            _logger.info("Flushed %s", self._streamer.name)
+        self._release(segments)
+
+    async def _finish_async(self) -> None:
+        if not self._saved_count:
+            return
+        try:
+            url = await self._upload_playlist_async()
+            await asyncio.wrap_future(self._writer.submit(partial(self._save_url, url)))
+        except Exception:
+            _logger.warning(
+                "Exception while finishing %s", self._streamer.name, exc_info=True
+            )
+
+    async def _upload_segments_async(
+        self, segments: list[_Segment], flush_num: int = -1
+    ) -> str:
+        files = [(segment.name, _chunks(segment.file)) for segment in segments]
+        streamer = str(self._streamer.name)
+        async with self._upload_slots:
+            with tracing.span("upload", streamer=streamer, flush=flush_num):
+                with _timed_upload():
+                    ipfs_files = await self._ipfs_add(files, wrap_with_directory=True)
+        return self._directory_cid(ipfs_files)
+
+    async def _upload_playlist_async(self) -> str:
+        m3u8 = self._workdir_path / f"{self._streamer.name}.m3u8"
+        self._playlist.write(m3u8)
+        with m3u8.open(mode="rb") as file:
+            ipfs_m3u8 = await self._ipfs_add([(m3u8.name, file)])
+        return self._ipfs_url(ipfs_m3u8[0]["Hash"])
+
+    async def _ipfs_add(
+        self, files: list[tuple[str, Any]], wrap_with_directory: bool = False
+    ) -> list[dict[str, Any]]:
+        params = {
+            "cid-version": "1",
+            "trickle": "true",
+            "wrap-with-directory": "true" if wrap_with_directory else "false",
+        }
+        form = aiohttp.FormData()
+        for name, value in files:
+            form.add_field(
+                "file", value, filename=name, content_type="application/octet-stream"
+            )
+        async with self._http.post(
+            f"{self._api_url}add", params=params, data=form
+        ) as response:
+            response.raise_for_status()
+            text = await response.text()
+        return [json.loads(line) for line in text.splitlines() if line]
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        if exc_type is not None:
+            self._closed = True
+        if not self._closed and self._dirty_size > 0:
+            self._flush()
+        uploads = list(self._uploads)
+        if self._closed:
+            for task in uploads:
+                task.cancel()
+        await asyncio.gather(*uploads, return_exceptions=True)
+        live.unpublish(str(self._streamer.name), self._live)
+        _dirty_bytes.remove(streamer=str(self._streamer.name))
+        if not self._closed:
+            await self._finish_async()
+        self._budget.remove(self)
+        if journal := self._acquired("_journal"):
+            # Closing time means the process is going away, not the stream.
+            if self._closed and not self._discarded:
+                self._keep_pending(self._dirty_segments)
+            else:
+                journal.remove()
+        if workdir := self._acquired("_workdir"):
+            workdir.cleanup()
+
+    async def __aenter__(self) -> "_AsyncWorker":
+        return self
+
+
+async def _chunks(file: Optional[SpoolFile]) -> AsyncIterator[Any]:
+    # aiohttp writes memoryviews as they are, so pooled pages are not copied.
+    assert file
+    for chunk in file.chunks():
+        yield chunk
@@ -0,0 +1,48 @@
+from threading import Lock
+from typing import Hashable
+
+
+class MemoryBudget:
+    """Splits memory between active recordings in proportion to their bitrate.
+
+    Recordings that have not reported any segments yet get an equal share
+    of what an average recording gets.
+    """
+
+    smoothing = 0.2
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self._lock = Lock()
+        self._rates: dict[Hashable, float] = {}
+
+    @property
+    def rates(self) -> dict[Hashable, float]:
+        with self._lock:
+            return dict(self._rates)
+
+    def update(self, key: Hashable, size: int, duration: float) -> None:
+        if duration <= 0:
+            return
+        rate = size / duration
+        with self._lock:
+            if (previous := self._rates.get(key)) is not None:
+                rate = previous + self.smoothing * (rate - previous)
+            self._rates[key] = rate
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            self._rates.pop(key, None)
+
+    def share(self, key: Hashable) -> int:
+        with self._lock:
+            rates = self._rates
+            if not rates:
+                return self.total
+            total_rate = sum(rates.values())
+            if key not in rates:
+                # As if it had the average rate.
+                return int(self.total / (len(rates) + 1))
+            if total_rate <= 0:
+                return int(self.total / len(rates))
+            return int(self.total * rates[key] / total_rate)
@@ -1,50 +1,143 @@
 import math
+import os
+import sys
+from array import array
+from itertools import islice
 from pathlib import Path
-from typing import List, NamedTuple, Optional
+from typing import Iterator, Optional
 
 # See rfc8216 and https://developer.apple.com/documentation/http_live_streaming
 
 
-class _Segment(NamedTuple):
-    url: str
-    duration: float
-    title: Optional[str]
+class Playlist:
+    """Append-only media playlist.
 
+    Segments are stored in columns: an index into the interned base URLs,
+    a sequence number and a duration. Segment URLs of one flush only differ
+    in their sequence number, e.g. https://{cid}.ipfs.../{num}.ts.
+
+    Writing to the same file again only appends the new segments and
+    rewrites the header in place, as long as its length did not change.
+    """
+
+    chunk_size = 1024  # segments
 
-class Playlist:
     def __init__(
         self,
         version: int = 3,
         playlist_type: Optional[str] = "vod",
+        endlist: bool = True,
     ) -> None:
         self.version = version
+        self.endlist = endlist
         self.playlist_type = playlist_type.upper() if playlist_type else None
-        self.segments: List[_Segment] = []
+        self.target_duration = 0
+        self._base_ids: dict[str, int] = {}
+        self._bases: list[str] = []
+        self._base_indexes = array("I")
+        self._durations = array("d")
+        # -1 means that the base is the whole URL.
+        self._nums = array("q")
+        self._titles: dict[int, str] = {}
+        # Path, header size, segment count and file size of the last write.
+        self._written: Optional[tuple[str, int, int, int]] = None
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._durations)
 
     def append(self, url: str, duration: float, title: str = "") -> None:
-        segment = _Segment(url, duration, title)
-        self.segments.append(segment)
+        head, sep, name = url.rpartition("/")
+        stem, dot, ext = name.partition(".")
+        # Only numbers that render back to the same name, e.g. not 007.
+        if (
+            stem.isascii()
+            and stem.isdigit()
+            and str(int(stem)) == stem
+            and dot
+            and ext == "ts"
+        ):
+            base, num = head + sep, int(stem)
+        else:
+            base, num = url, -1
+        if (base_index := self._base_ids.get(base)) is None:
+            base_index = self._base_ids[base] = len(self._bases)
+            self._bases.append(sys.intern(base))
+        if title:
+            self._titles[self.segment_count] = title
+        self._base_indexes.append(base_index)
+        self._nums.append(num)
+        self._durations.append(duration)
+        self.target_duration = max(self.target_duration, math.ceil(duration))
+
+    def segments(self, start: int = 0) -> Iterator[tuple[str, float]]:
+        """Yields the URL and duration of every segment from `start` on."""
+        bases = self._bases
+        for base_index, num, duration in zip(
+            self._base_indexes[start:], self._nums[start:], self._durations[start:]
+        ):
+            base = bases[base_index]
+            yield (base if num < 0 else f"{base}{num}.ts"), duration
+
+    def chunks(self) -> Iterator[bytes]:
+        yield self.header()
+        yield from self.segment_chunks(0)
+
+    def render(self) -> bytes:
+        return b"".join(self.chunks())
 
     def write(self, path: Path) -> None:
-        target_duration = max(
-            map(lambda s: math.ceil(s.duration), self.segments), default=10
+        header = self.header()
+        written = self._written
+        if (
+            written is not None
+            and written[:2] == (os.fspath(path), len(header))
+            and os.path.getsize(path) == written[3]
+        ):
+            with path.open(mode="r+b") as m3u8:
+                m3u8.write(header)
+                m3u8.seek(0, os.SEEK_END)
+                m3u8.writelines(self.segment_chunks(written[2]))
+                size = m3u8.tell()
+        else:
+            with path.open(mode="wb") as m3u8:
+                m3u8.write(header)
+                m3u8.writelines(self.segment_chunks(0))
+                size = m3u8.tell()
+        self._written = (os.fspath(path), len(header), self.segment_count, size)
+
+    def segment_chunks(self, start: int = 0) -> Iterator[bytes]:
+        """Yields the lines of the segments from `start` on."""
+        segments = zip(
+            self._base_indexes[start:], self._nums[start:], self._durations[start:]
         )
-        with path.open(mode="w", encoding="utf-8") as m3u8:
-            m3u8.write("#EXTM3U\n")
-            if self.playlist_type is not None:
-                m3u8.write(f"#EXT-X-PLAYLIST-TYPE:{self.playlist_type}\n")
-            m3u8.write(f"#EXT-X-TARGETDURATION:{target_duration}\n")
-            m3u8.write(f"#EXT-X-VERSION:{self.version}\n")
-            m3u8.write("#EXT-X-MEDIA-SEQUENCE:0\n")
-            # XXX: Ideally, we want the video player to reload the
-            # playlist periodically:
-            #   #EXT-X-PLAYLIST-TYPE:EVENT
-            #   #EXT-X-START:TIME-OFFSET=0
-            # But FFmpeg doesn't support the EXT-X-START tag, so I had
-            # to change the above to:
-            #   #EXT-X-PLAYLIST-TYPE:VOD
-            #   #EXT-X-ENDLIST
-            m3u8.write("#EXT-X-ENDLIST\n")
-            for segment in self.segments:
-                m3u8.write(f"#EXTINF:{segment.duration:.3f},{segment.title}\n")
-                m3u8.write(f"{segment.url}\n")
+        bases, titles = self._bases, self._titles
+        for start in range(start, self.segment_count, self.chunk_size):
+            lines = []
+            for index, (base_index, num, duration) in enumerate(
+                islice(segments, self.chunk_size), start
+            ):
+                title = titles.get(index, "") if titles else ""
+                url = bases[base_index] if num < 0 else f"{bases[base_index]}{num}.ts"
+                lines.append(f"#EXTINF:{duration:.3f},{title}\n{url}\n")
+            yield "".join(lines).encode()
+
+    def header(self) -> bytes:
+        lines = ["#EXTM3U"]
+        if self.playlist_type is not None:
+            lines.append(f"#EXT-X-PLAYLIST-TYPE:{self.playlist_type}")
+        lines.append(f"#EXT-X-TARGETDURATION:{self.target_duration or 10}")
+        lines.append(f"#EXT-X-VERSION:{self.version}")
+        lines.append("#EXT-X-MEDIA-SEQUENCE:0")
+        # XXX: Ideally, we want the video player to reload the
+        # playlist periodically:
+        #   #EXT-X-PLAYLIST-TYPE:EVENT
+        #   #EXT-X-START:TIME-OFFSET=0
+        # But FFmpeg doesn't support the EXT-X-START tag, so I had
+        # to change the above to:
+        #   #EXT-X-PLAYLIST-TYPE:VOD
+        #   #EXT-X-ENDLIST
+        # Live playlists are only for players that do reload them.
+        if self.endlist:
+            lines.append("#EXT-X-ENDLIST")
+        return "".join(f"{line}\n" for line in lines).encode()
@@ -0,0 +1,214 @@
+import json
+import logging
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from functools import cached_property
+from queue import Empty, Full, Queue
+from threading import BoundedSemaphore, Event, Lock
+from typing import Any, Callable, Iterator, Optional
+
+import ipfshttpclient  # type: ignore
+import requests
+from ipfshttpclient.exceptions import Error as IPFSError  # type: ignore
+from ipfshttpclient.http_common import multiaddr_to_url_data  # type: ignore
+
+# HACK: Suppress a version mismatch warning.
+# This can be removed once ipfshttpclient is updated.
+# We can't use warnings.catch_warnings() because it is not thread-safe.
+ipfshttpclient.client.assert_version = lambda *args: True
+
+_logger = logging.getLogger("offstream")
+
+
+class IPFSPool:
+    """Lends IPFS API clients, each with its own keep-alive HTTP session.
+
+    At most `size` clients are lent out at a time. A client that has been
+    idle for longer than `health_check_interval` is checked before it is
+    lent out again, and a client that failed is discarded.
+    """
+
+    def __init__(
+        self,
+        addr: str,
+        size: int,
+        health_check_interval: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.addr = addr
+        self.health_check_interval = health_check_interval
+        self.size = size
+        self._clock = clock
+        self._closed = False
+        self._idle: list[tuple[float, Any]] = []
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(size)
+        self._stats: Counter[str] = Counter()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["reused"] = stats.get("borrowed", 0) - stats.get("connected", 0)
+        return stats
+
+    @cached_property
+    def api_url(self) -> str:
+        return str(multiaddr_to_url_data(self.addr, "api/v0")[0])
+
+    @cached_property
+    def http(self) -> requests.Session:
+        """Session for requests that ipfshttpclient can't make, e.g. streaming."""
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @contextmanager
+    def client(self) -> Iterator[Any]:
+        with self._slots:
+            client = self._take()
+            try:
+                yield client
+            except IPFSError:
+                self._discard(client)
+                raise
+            except BaseException:
+                self._give_back(client)
+                raise
+            else:
+                self._give_back(client)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for _, client in idle:
+            client.close()
+        if http := self.__dict__.get("http"):
+            http.close()
+
+    def _take(self) -> Any:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                returned_at, client = self._idle.pop()
+            if self._clock() - returned_at <= self.health_check_interval:
+                self._count("borrowed")
+                return client
+            self._count("health_checks")
+            try:
+                client.version()
+            except IPFSError as error:
+                _logger.info("Discarding IPFS client: %s", error)
+                self._discard(client)
+            else:
+                self._count("borrowed")
+                return client
+        client = ipfshttpclient.connect(addr=self.addr, session=True)
+        self._count("connected")
+        self._count("borrowed")
+        return client
+
+    def _give_back(self, client: Any) -> None:
+        with self._lock:
+            if not self._closed:
+                self._idle.append((self._clock(), client))
+                return
+        client.close()
+
+    def _discard(self, client: Any) -> None:
+        self._count("discarded")
+        client.close()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+
+class MultipartUpload:
+    """Streams files into a single /api/v0/add request while they are written.
+
+    `send()` makes the request and blocks until `close()` is called, so it
+    has to run in a thread of its own. Writers block while `queue_size`
+    chunks are waiting to be sent.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session,
+        api_url: str,
+        wrap_with_directory: bool = False,
+        queue_size: int = 4,
+    ) -> None:
+        self.api_url = api_url
+        self.wrap_with_directory = wrap_with_directory
+        self._boundary = uuid.uuid4().hex
+        self._done = Event()
+        self._file_count = 0
+        self._queue: Queue[Optional[bytes]] = Queue(maxsize=queue_size)
+        self._session = session
+
+    def add_file(self, name: str) -> None:
+        self._put(
+            f"{self._delimiter()}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n".encode()
+        )
+        self._file_count += 1
+
+    def write(self, data: bytes) -> None:
+        if data:
+            self._put(data)
+
+    def close(self) -> None:
+        self._put(f"{self._delimiter()}--\r\n".encode())
+        self._put(None)
+
+    def abort(self) -> None:
+        """Stops sending, use it when `send()` won't run."""
+        self._done.set()
+
+    def send(self) -> list[dict[str, Any]]:
+        params = {
+            "cid-version": "1",
+            "trickle": "true",
+            "wrap-with-directory": "true" if self.wrap_with_directory else "false",
+        }
+        headers = {"Content-Type": f"multipart/form-data; boundary={self._boundary}"}
+        try:
+            response = self._session.post(
+                f"{self.api_url}add", params=params, headers=headers, data=self._body()
+            )
+            response.raise_for_status()
+        finally:
+            self._done.set()
+        return [json.loads(line) for line in response.text.splitlines() if line]
+
+    def _delimiter(self) -> str:
+        # The CRLF before a delimiter belongs to it, not to the file before.
+        prefix = "\r\n" if self._file_count else ""
+        return f"{prefix}--{self._boundary}"
+
+    def _body(self) -> Iterator[bytes]:
+        while not self._done.is_set():
+            try:
+                chunk = self._queue.get(timeout=1)
+            except Empty:
+                continue
+            if chunk is None:
+                return
+            yield chunk
+
+    def _put(self, chunk: Optional[bytes]) -> None:
+        # Once the request failed, nobody is reading the queue anymore.
+        while not self._done.is_set():
+            try:
+                self._queue.put(chunk, timeout=1)
+            except Full:
+                continue
+            return
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+
+_logger = logging.getLogger("offstream")
+
+
+class JournalState(NamedTuple):
+    broadcast_id: Optional[str]
+    # When the journal was last written to.
+    updated: float
+    stream_id: Optional[int]
+    # (cid, name, duration) of every uploaded segment, in playlist order.
+    uploaded: list[tuple[str, str, float]]
+    # (name, duration) of segments that are waiting in the spool directory.
+    pending: list[tuple[str, float]]
+
+
+class Journal:
+    """Write-ahead log of a recording, so that it can be resumed after a crash.
+
+    Every record is a JSON object on a line of its own and is synced to disk
+    before the action it describes takes effect. A torn last line is ignored
+    when the journal is loaded. Pending segments are kept in `spool_dir`.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.spool_dir = path.with_suffix(".spool")
+
+    def load(self) -> Optional[JournalState]:
+        try:
+            with self.path.open(encoding="utf-8") as journal:
+                records = [_parse(line) for line in journal]
+                updated = os.fstat(journal.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+        if not records or records[0] is None or "broadcast" not in records[0]:
+            return None
+        header = records[0]
+        stream_id = None
+        uploaded: list[tuple[str, str, float]] = []
+        pending: dict[str, float] = {}
+        for record in records[1:]:
+            if record is None:
+                continue
+            if "stream" in record:
+                stream_id = record["stream"]
+            elif "pending" in record:
+                pending[record["pending"]] = record["duration"]
+            elif "uploaded" in record:
+                for name, duration in record["segments"]:
+                    uploaded.append((record["uploaded"], name, duration))
+                    pending.pop(name, None)
+        return JournalState(
+            header["broadcast"],
+            updated,
+            stream_id,
+            uploaded,
+            list(pending.items()),
+        )
+
+    def reset(self, broadcast_id: Optional[str]) -> None:
+        self.remove()
+        self.spool_dir.mkdir(parents=True)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open(mode="w", encoding="utf-8") as journal:
+            self._write(journal, {"broadcast": broadcast_id, "started": time.time()})
+
+    def stream_committed(self, stream_id: int) -> None:
+        self._append({"stream": stream_id})
+
+    def segment_pending(self, name: str, duration: float) -> None:
+        self._append({"pending": name, "duration": duration})
+
+    def segments_uploaded(self, cid: str, segments: list[tuple[str, float]]) -> None:
+        self._append({"uploaded": cid, "segments": segments})
+
+    def remove(self) -> None:
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _append(self, record: dict[str, Any]) -> None:
+        with self.path.open(mode="a", encoding="utf-8") as journal:
+            self._write(journal, record)
+
+    def _write(self, journal: Any, record: dict[str, Any]) -> None:
+        journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def _parse(line: str) -> Optional[dict[str, Any]]:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        _logger.warning("Skipping a torn journal record")
+        return None
+    return record if isinstance(record, dict) else None
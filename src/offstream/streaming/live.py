@@ -0,0 +1,118 @@
+from threading import Lock
+from typing import Iterable, Optional
+
+from .hls import Playlist
+from .spool import SpoolFile
+
+
+class LiveRecording:
+    """Playlist of a recording in progress that reaches the live edge.
+
+    It lists the committed segments of `playlist` followed by the spooled
+    segments that have not been flushed yet, which the app serves from
+    memory or the spill directory. Segments of the last commit can still
+    be looked up by name, so that players with an older playlist are
+    redirected to IPFS instead of failing.
+
+    Committed segments are rendered once, as they are added to the
+    playlist. Rendering happens outside of the lock that the recording
+    takes, only the new segments are copied under it.
+    """
+
+    def __init__(self, playlist: Playlist) -> None:
+        self._committed: dict[str, str] = {}
+        self._lock = Lock()
+        self._m3u8: Optional[bytes] = None
+        self._pending: dict[str, tuple[float, SpoolFile]] = {}
+        self._playlist = playlist
+        # The rendered part of the playlist, see _render().
+        self._event = Playlist(playlist_type="event", endlist=False)
+        self._event_chunks: list[bytes] = []
+        self._render_lock = Lock()
+        self._version = 0
+
+    def add(self, name: str, duration: float, file: SpoolFile) -> None:
+        with self._lock:
+            self._pending[name] = (duration, file)
+            self._changed()
+
+    def commit(self, segments: Iterable[tuple[str, str, float]]) -> None:
+        """Moves the (name, url, duration) segments to the playlist."""
+        with self._lock:
+            self._committed = {}
+            for name, url, duration in segments:
+                self._playlist.append(url, duration)
+                self._pending.pop(name, None)
+                self._committed[name] = url
+            self._changed()
+
+    def discard(self, names: Iterable[str]) -> None:
+        """Forgets the segments, call it before their files are released."""
+        with self._lock:
+            for name in names:
+                self._pending.pop(name, None)
+            self._changed()
+
+    def render(self) -> bytes:
+        with self._render_lock:
+            with self._lock:
+                if self._m3u8 is not None:
+                    return self._m3u8
+                version = self._version
+                committed = list(self._playlist.segments(self._event.segment_count))
+                pending = [(name, info[0]) for name, info in self._pending.items()]
+            m3u8 = self._render(committed, pending)
+            with self._lock:
+                if version == self._version:
+                    self._m3u8 = m3u8
+            return m3u8
+
+    def read(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            if (pending := self._pending.get(name)) is None:
+                return None
+            # Copied, the pages go back to the spool once it is released.
+            return b"".join(pending[1].chunks())
+
+    def url(self, name: str) -> Optional[str]:
+        with self._lock:
+            return self._committed.get(name)
+
+    def _changed(self) -> None:
+        self._m3u8 = None
+        self._version += 1
+
+    def _render(
+        self, committed: list[tuple[str, float]], pending: list[tuple[str, float]]
+    ) -> bytes:
+        start = self._event.segment_count
+        for url, duration in committed:
+            self._event.append(url, duration)
+        self._event_chunks.extend(self._event.segment_chunks(start))
+        tail = Playlist(playlist_type="event", endlist=False)
+        tail.target_duration = self._event.target_duration
+        # Relative to the URL of the live playlist.
+        for name, duration in pending:
+            tail.append(name, duration)
+        return b"".join([tail.header(), *self._event_chunks, *tail.segment_chunks()])
+
+
+_lock = Lock()
+_recordings: dict[str, LiveRecording] = {}
+
+
+def publish(name: str, recording: LiveRecording) -> None:
+    with _lock:
+        _recordings[name] = recording
+
+
+def unpublish(name: str, recording: LiveRecording) -> None:
+    with _lock:
+        if _recordings.get(name) is recording:
+            del _recordings[name]
+
+
+def find(name: str) -> Optional[LiveRecording]:
+    """Returns the recording of a streamer, if it runs in this process."""
+    with _lock:
+        return _recordings.get(name)
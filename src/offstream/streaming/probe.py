@@ -0,0 +1,90 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+import requests
+
+
+class Prober(ABC):
+    """Tells which of the given channels are live right now.
+
+    Probing raises RequestException or ValueError when it cannot tell, so
+    that the recorder checks each channel on its own instead.
+    """
+
+    batch_size = 1
+
+    def probe(self, names: Sequence[str]) -> set[str]:
+        live: set[str] = set()
+        for batch in self._batches(names):
+            live.update(self.probe_batch(batch))
+        return live
+
+    @abstractmethod
+    def probe_batch(self, names: Sequence[str]) -> Iterable[str]:
+        """Returns the live channels of at most `batch_size` names."""
+
+    def close(self) -> None:
+        pass
+
+    def _batches(self, names: Sequence[str]) -> Iterator[Sequence[str]]:
+        for i in range(0, len(names), self.batch_size):
+            yield names[i : i + self.batch_size]
+
+
+class TwitchProber(Prober):
+    # Twitch rejects GQL batches with more than 35 operations.
+    batch_size = 35
+    client_id = "kimne78kx3ncx6brgo4mv6wki5h1ko"
+    gql_url = os.getenv("OFFSTREAM_TWITCH_GQL_URL", "https://gql.twitch.tv/gql")
+    stream_metadata_hash = (
+        "1c719a40e481453e5c48d9bb585d971b8b372f8ebb105b17076722264dfa5b3e"
+    )
+    timeout = 10
+
+    def __init__(
+        self, session: Optional[requests.Session] = None, url: Optional[str] = None
+    ) -> None:
+        self._session = session or requests.Session()
+        self._url = url or self.gql_url
+
+    def probe_batch(self, names: Sequence[str]) -> Iterable[str]:
+        response = self._session.post(
+            self._url,
+            data=json.dumps([self._query(name) for name in names]),
+            headers={"Client-ID": self.client_id},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        results = response.json()
+        if not isinstance(results, list) or len(results) != len(names):
+            raise ValueError("Unexpected GQL response")
+        return [name for name, result in zip(names, results) if _is_live(result)]
+
+    def _query(self, name: str) -> dict[str, Any]:
+        return {
+            "operationName": "StreamMetadata",
+            "extensions": {
+                "persistedQuery": {
+                    "version": 1,
+                    "sha256Hash": self.stream_metadata_hash,
+                }
+            },
+            "variables": {"channelLogin": name},
+        }
+
+    def close(self) -> None:
+        self._session.close()
+
+
+def _is_live(result: Any) -> bool:
+    # E.g. PersistedQueryNotFound once the query hash goes stale.
+    if not isinstance(result, dict) or result.get("errors"):
+        errors = result.get("errors") if isinstance(result, dict) else result
+        raise ValueError(f"GQL error: {errors}")
+    if not isinstance(data := result.get("data"), dict):
+        raise ValueError("GQL result without data")
+    user = data.get("user")
+    stream = user.get("stream") if isinstance(user, dict) else None
+    return isinstance(stream, dict) and stream.get("type") == "live"
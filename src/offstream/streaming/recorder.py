@@ -1,68 +1,152 @@
 import logging
 import os
+import time
+from collections import Counter
 from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import cached_property, partial
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from threading import Event, Lock
+from threading import BoundedSemaphore, Event, Lock
 from types import TracebackType
-from typing import IO, Any, NamedTuple, Optional
+from typing import IO, Any, Iterable, Iterator, NamedTuple, Optional
 
-import ipfshttpclient  # type: ignore
 from requests.exceptions import RequestException
-from sqlalchemy import select
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
 from streamlink import Streamlink  # type: ignore
 from streamlink.exceptions import PluginError  # type: ignore
 
 from offstream import db
+from offstream.metrics import registry
 
+from . import live, tracing
+from .budget import MemoryBudget
 from .hls import Playlist
-
-# HACK: Suppress a version mismatch warning.
-# This can be removed once ipfshttpclient is updated.
-# We can't use warnings.catch_warnings() because it is not thread-safe.
-ipfshttpclient.client.assert_version = lambda *args: True
+from .ipfs import IPFSPool, MultipartUpload
+from .journal import Journal, JournalState
+from .live import LiveRecording
+from .probe import Prober, TwitchProber
+from .scheduler import Scheduler
+from .spool import Spool, SpoolFile
+from .writer import DBWriter
 
 MAX_CONCURRENT_RECORDERS = int(os.getenv("OFFSTREAM_MAX_CONCURRENT_RECORDERS", "5"))
 
 _logger = logging.getLogger("offstream")
 
+_ingest_bytes = registry.counter(
+    "offstream_ingest_bytes_total", "Bytes of segments recorded", ["streamer"]
+)
+_ingest_segments = registry.counter(
+    "offstream_ingest_segments_total", "Segments recorded", ["streamer"]
+)
+_dirty_bytes = registry.gauge(
+    "offstream_dirty_bytes", "Bytes of segments waiting to be flushed", ["streamer"]
+)
+_pending_flushes = registry.gauge(
+    "offstream_pending_flushes", "Flushes being uploaded or waiting to be committed"
+)
+_flush_seconds = registry.histogram(
+    "offstream_flush_seconds",
+    "Seconds from flushing segments to committing them",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+_upload_seconds = registry.histogram(
+    "offstream_ipfs_upload_seconds",
+    "Seconds to upload a flush of segments to IPFS",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+_upload_failures = registry.counter(
+    "offstream_ipfs_upload_failures_total", "Failed uploads of segments to IPFS"
+)
+_queued_recordings = registry.gauge(
+    "offstream_queued_recordings", "Live streams waiting for a free recorder"
+)
+_active_recordings = registry.gauge(
+    "offstream_active_recordings", "Streams being recorded"
+)
+
+
+@contextmanager
+def _timed_upload() -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        _upload_failures.inc()
+        raise
+    _upload_seconds.observe(time.perf_counter() - started)
+
 
 class Recorder:
     check_interval = int(os.getenv("OFFSTREAM_CHECK_INTERVAL", "120"))
+    max_check_interval = int(os.getenv("OFFSTREAM_MAX_CHECK_INTERVAL", "900"))
+    # Seconds within which added and deleted streamers are noticed.
+    change_check_interval = 10
+    # Changes are read again this many ids back, because concurrent
+    # transactions may commit their ids out of order.
+    change_window = 100
+    history_size = 30
+    ipfs_pool_size = int(os.getenv("OFFSTREAM_IPFS_POOL_SIZE", "4"))
+    # Memory for segments of all recordings, half of the dyno's RAM by default.
+    dyno_ram_size = int(os.getenv("DYNO_RAM", "512")) * 10 ** 6
+    memory_budget = int(os.getenv("OFFSTREAM_MEMORY_BUDGET", dyno_ram_size // 2))
 
-    def __init__(self) -> None:
+    def __init__(self, prober: Optional[Prober] = None) -> None:
+        self._budget = MemoryBudget(self.memory_budget)
+        # Streamers that the recorder knows of, up to this change.
+        self._change_id = -1
+        # Changes within the window that have been applied.
+        self._seen_changes: set[int] = set()
         self._closed = Event()
         self._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_RECORDERS)
+        self._ipfs_pool = IPFSPool(_Worker.ipfs_api_addr, self.ipfs_pool_size)
         self._lock = Lock()
+        self._prober = prober or TwitchProber()
         self._recording: dict[int, Optional[_Worker]] = {}
+        self._scheduler = Scheduler(self.check_interval, self.max_check_interval)
         self._session = db.Session()
+        self._streamers: dict[int, db.Streamer] = {}
         self._streamlink = self._create_streamlink()
+        self._writer = DBWriter()
 
     def start(self, _loop: bool = True) -> None:
         def _recording_complete(future: Future[None]) -> None:
             try:
                 future.result()
             except CancelledError:  # Closing time
+                _queued_recordings.dec()
                 _logger.info("Canceled recording")
             except Exception:
                 _logger.warning("Exception while recording", exc_info=True)
 
         while not self._closed.is_set():
-            for streamer in self._session.scalars(select(db.Streamer)):
-                with self._lock:
-                    if streamer.id in self._recording:
-                        continue
-                    self._recording[streamer.id] = None
+            for streamer in self._check(time.time()):
                 _logger.info("Checking %s", streamer.name)
                 try:
                     future = self._executor.submit(self._record_streamer, streamer)
                 except RuntimeError:  # Closing time
                     break
                 else:
+                    _queued_recordings.inc()
                     future.add_done_callback(_recording_complete)
             if not _loop:
                 break
-            self._closed.wait(self.check_interval)
+            self._closed.wait(self._wait_time())
+
+    @property
+    def worker_stats(self) -> dict[str, int]:
+        with _Worker.stats_lock:
+            return dict(_Worker.stats)
+
+    @property
+    def ipfs_stats(self) -> dict[str, int]:
+        return self._ipfs_pool.stats
+
+    @property
+    def db_stats(self) -> dict[str, float]:
+        return self._writer.stats
 
     def close(self) -> None:
         _logger.info("\nClosing, please wait")
@@ -74,8 +158,129 @@ class Recorder:
                     worker.close()
         _logger.info("Shutting down executor")
         self._executor.shutdown(cancel_futures=True)
+        _logger.info("IPFS client stats: %s", self.ipfs_stats)
+        self._ipfs_pool.close()
+        _logger.info("Database writer stats: %s", self.db_stats)
+        self._writer.close()
+        self._prober.close()
         self._session.close()
 
+    def _check(self, now: float) -> list[db.Streamer]:
+        streamers = self._due_streamers(now)
+        live = self._probe(streamers)
+        checked = []
+        for streamer in streamers:
+            assert streamer.id
+            if live is None:
+                # Every streamer is checked, but nothing is learned.
+                self._scheduler.checked(streamer.id, now, live=None)
+            elif streamer.name in live:
+                self._scheduler.checked(streamer.id, now, live=True)
+            else:
+                self._scheduler.checked(streamer.id, now, live=False)
+                continue
+            with self._lock:
+                if streamer.id in self._recording:
+                    continue
+                self._recording[streamer.id] = None
+            checked.append(streamer)
+        return checked
+
+    def _due_streamers(self, now: float) -> list[db.Streamer]:
+        self._update_streamers(now)
+        due = []
+        for key in self._scheduler.due(now):
+            with self._lock:
+                recording = key in self._recording
+            if recording:
+                self._scheduler.checked(key, now, live=True)
+            else:
+                due.append(self._streamers[key])
+        return due
+
+    def _update_streamers(self, now: float) -> None:
+        if self._change_id < 0:
+            query = (
+                select(db.StreamerChange.id)
+                .order_by(db.StreamerChange.id.desc())
+                .limit(self.change_window)
+            )
+            seen = set(self._session.scalars(query))
+            change_id = max(seen, default=0)
+            changed = None
+        else:
+            query = db.streamer_changes(self._change_id - self.change_window)
+            changes = [
+                change
+                for change in self._session.execute(query)
+                if change.id not in self._seen_changes
+            ]
+            if not changes:
+                return
+            seen = self._seen_changes | {change.id for change in changes}
+            change_id = max(self._change_id, changes[-1].id)
+            changed = {change.streamer_id for change in changes}
+        # Updated streamers are loaded again, even if they are in the session.
+        query = select(db.Streamer).execution_options(populate_existing=True)
+        if changed is not None:
+            query = query.where(db.Streamer.id.in_(changed))
+        streamers = {streamer.id: streamer for streamer in self._session.scalars(query)}
+        for key in streamers.keys() if changed is None else changed:
+            if streamer := streamers.get(key):
+                self._streamers[key] = streamer
+                if key not in self._scheduler:
+                    self._scheduler.add(key, now, hours=self._go_live_hours(key))
+            elif streamer := self._streamers.pop(key, None):
+                self._scheduler.remove(key)
+                self._discard_recording(streamer)
+        floor = change_id - self.change_window
+        self._seen_changes = {key for key in seen if key > floor}
+        self._change_id = change_id
+        if changed is not None and floor > 0:
+            try:
+                # Best effort, failures are counted in the writer's stats.
+                self._writer.submit(
+                    lambda session: session.execute(db.prune_streamer_changes(floor))
+                )
+            except RuntimeError:  # Closing time
+                pass
+
+    def _discard_recording(self, streamer: db.Streamer) -> None:
+        assert streamer.id
+        with self._lock:
+            worker = self._recording.get(streamer.id)
+        if worker is not None:
+            _logger.info("Stopping %s, it was deleted", streamer.name)
+            worker.discard()
+
+    def _go_live_hours(self, streamer_id: int) -> set[int]:
+        query = (
+            select(db.Stream.created_at)
+            .where(db.Stream.streamer_id == streamer_id)
+            .order_by(db.Stream.created_at.desc())
+            .limit(self.history_size)
+        )
+        return {created_at.hour for created_at in self._session.scalars(query)}
+
+    def _wait_time(self) -> float:
+        next_due = self._scheduler.next_due()
+        interval = min(self.check_interval, self.change_check_interval)
+        if next_due is None:
+            return interval
+        return min(max(next_due - time.time(), 0), interval)
+
+    def _probe(self, streamers: list[db.Streamer]) -> Optional[set[str]]:
+        """Returns the live streamers, or None when probing failed."""
+        names = [str(streamer.name) for streamer in streamers]
+        if not names:
+            return set()
+        try:
+            return self._prober.probe(names)
+        except (RequestException, ValueError) as error:
+            # Fall back to checking each streamer individually.
+            _logger.warning("Exception while probing streamers: %s", error)
+            return None
+
     def _create_streamlink(self) -> Streamlink:
         streamlink = Streamlink()
         # This option is on so that we can access segment chunks.
@@ -87,23 +292,35 @@ class Recorder:
 
     def _record_streamer(self, streamer: db.Streamer) -> None:
         assert streamer.id
-        with _Worker(self._streamlink, streamer) as worker:
+        _queued_recordings.dec()
+        worker = _Worker(
+            self._streamlink, streamer, self._ipfs_pool, self._budget, self._writer
+        )
+        with worker:
             with self._lock:
                 if self._closed.is_set():
                     return
                 assert self._recording[streamer.id] is None
+                if streamer.id not in self._streamers:
+                    # Deleted while the recording was queued.
+                    del self._recording[streamer.id]
+                    return
                 self._recording[streamer.id] = worker
+            _active_recordings.inc()
             try:
                 worker.start()
             finally:
+                _active_recordings.dec()
                 with self._lock:
                     del self._recording[streamer.id]
 
 
 class _Segment(NamedTuple):
-    file: str
+    name: str
     size: int
     duration: float
+    # Streamed segments have been sent to IPFS already.
+    file: Optional[SpoolFile] = None
 
 
 class _Worker:
@@ -116,50 +333,247 @@ class _Worker:
         "OFFSTREAM_IPFS_GATEWAY_URI_TEMPLATE",
         "https://{cid}.ipfs.infura-ipfs.io/{path}",
     )
+    # By default, both are derived from the worker's share of the memory budget.
+    flush_threshold = os.getenv("OFFSTREAM_FLUSH_THRESHOLD")
+    # Memory for dirty segments, anything beyond it is spilled to the workdir.
+    spool_memory = os.getenv("OFFSTREAM_SPOOL_MEMORY")
+    # Seconds after which dirty segments are flushed, however few there are.
+    max_flush_interval = int(os.getenv("OFFSTREAM_MAX_FLUSH_INTERVAL", "600"))
+    # "spool" uploads segments on flush, "stream" sends them while they arrive.
+    upload_mode = os.getenv("OFFSTREAM_UPLOAD_MODE", "spool")
+    # Flushes that are uploaded at the same time. Playlists are still
+    # committed in order.
+    upload_concurrency = int(os.getenv("OFFSTREAM_UPLOAD_CONCURRENCY", "2"))
+    # Flushes in flight before reading new segments has to wait.
+    max_pending_uploads = int(os.getenv("OFFSTREAM_MAX_PENDING_UPLOADS", "4"))
+    # Recordings are journaled here, so that they can be resumed after a crash.
+    journal_dir = os.getenv("OFFSTREAM_JOURNAL_DIR")
+    # Seconds within which a journal without a broadcast id is resumed.
+    resume_window = 600
+    # Number of workers created vs. resources they actually acquired.
+    stats: Counter[str] = Counter()
+    stats_lock = Lock()
 
-    def __init__(self, streamlink: Streamlink, streamer: db.Streamer) -> None:
+    def __init__(
+        self,
+        streamlink: Streamlink,
+        streamer: db.Streamer,
+        ipfs_pool: IPFSPool,
+        budget: MemoryBudget,
+        writer: DBWriter,
+    ) -> None:
+        self._budget = budget
         self._closed = False
+        self._commit_count = 0
+        self._commit_lock = Lock()
+        self._discarded = False
         self._dirty_segments: list[_Segment] = []
+        self._dirty_since = 0.0
         self._dirty_size = 0
-        self._executor = ThreadPoolExecutor(max_workers=1)
-        self._flush_threshold = self._calculate_flush_threshold()
-        self._ipfs = ipfshttpclient.connect(addr=self.ipfs_api_addr, session=True)
+        self._flush_count = 0
+        # Monotonic times of flushes that are not committed yet.
+        self._flushed_at: dict[int, float] = {}
+        self._ipfs_pool = ipfs_pool
         self._lock = Lock()
+        self._pending_uploads = BoundedSemaphore(self.max_pending_uploads)
         self._playlist = Playlist()
+        self._live = LiveRecording(self._playlist)
         self._reader: Optional[IO[bytes]] = None
-        self._session = db.Session()
+        self._resume_after = -1
+        # Segments of the playlist that are in the database.
+        self._saved_count = 0
+        # The stream belongs to the writer's session, its id is read from
+        # the results of the writer.
         self._stream: Optional[db.Stream] = None
+        self._stream_id: Optional[int] = None
+        self._stream_journaled = False
         self._streamer = streamer
         self._streamlink = streamlink
-        self._workdir = TemporaryDirectory(prefix="offstream-")
-        self._workdir_path = Path(self._workdir.name)
+        self._upload: Optional[MultipartUpload] = None
+        self._uploaded: dict[int, tuple[list[_Segment], Future[str]]] = {}
+        self._used = False
+        self._writer = writer
+        self._count("created")
 
-    def _calculate_flush_threshold(self) -> int:
-        dyno_ram_size = int(os.getenv("DYNO_RAM", "512")) * 10 ** 6
-        default_size = min(
-            self.ipfs_request_size_limit, dyno_ram_size // MAX_CONCURRENT_RECORDERS
-        )
-        return int(os.getenv("OFFSTREAM_FLUSH_THRESHOLD", default_size))
+    # The resources below are acquired once the first segment arrives, so
+    # that checking an offline channel does not churn them.
+
+    @cached_property
+    def _executor(self) -> ThreadPoolExecutor:
+        self._count("executors")
+        return ThreadPoolExecutor(max_workers=self.upload_concurrency)
+
+    @cached_property
+    def _journal(self) -> Optional[Journal]:
+        if not self.journal_dir:
+            return None
+        return Journal(Path(self.journal_dir) / f"{self._streamer.id}.jsonl")
+
+    @cached_property
+    def _spool(self) -> Spool:
+        # Spilled segments outlive the process when they are journaled.
+        spill_dir = self._journal.spool_dir if self._journal else self._workdir_path
+        return Spool(self._spool_budget, spill_dir=spill_dir)
+
+    @cached_property
+    def _workdir(self) -> TemporaryDirectory[str]:
+        self._count("workdirs")
+        return TemporaryDirectory(prefix="offstream-")
+
+    @cached_property
+    def _workdir_path(self) -> Path:
+        return Path(self._workdir.name)
+
+    def _acquired(self, name: str) -> Any:
+        return self.__dict__.get(name)
+
+    @classmethod
+    def _count(cls, key: str) -> None:
+        with cls.stats_lock:
+            cls.stats[key] += 1
+
+    @property
+    def _flush_threshold(self) -> int:
+        if self.flush_threshold:
+            return int(self.flush_threshold)
+        # Half of the share, so that the next flush fits while the previous
+        # one is being uploaded.
+        share = self._budget.share(self)
+        return max(1, min(self.ipfs_request_size_limit, share // 2))
+
+    @property
+    def _spool_budget(self) -> int:
+        if self.spool_memory:
+            return int(self.spool_memory)
+        return self._budget.share(self)
 
     def start(self) -> None:
         def _process_sequence(
             sequence: Any, response: Any, *_args: Any, **_kwargs: Any
         ) -> None:
-            size = 0
-            segfile = self._workdir_path / f"{sequence.num}.ts"
-            with segfile.open(mode="wb") as seg:
+            # Segments that arrive while the recording is set up wait for it.
+            ready.wait()
+            if not recording:  # Closing time, or setting up failed
+                return
+            if not self._used:
+                self._used = True
+                self._count("used")
+            if self._resume_after >= 0 and sequence.num <= self._resume_after:
+                return
+            name = f"{sequence.num}.ts"
+            duration = sequence.segment.duration
+            streamer = str(self._streamer.name)
+            with tracing.span("segment", streamer=streamer, segment=name) as span:
                 try:
-                    for chunk in response.iter_content(reader.writer.WRITE_CHUNK_SIZE):
-                        reader.buffer.write(chunk)
-                        size += seg.write(chunk)
+                    chunks = response.iter_content(reader.writer.WRITE_CHUNK_SIZE)
+                    if self.upload_mode == "stream":
+                        segment = self._stream_segment(name, chunks, duration, span)
+                    else:
+                        segment = self._spool_segment(name, chunks, duration, span)
                 except RequestException as error:
                     _logger.warning(
                         "Exception while reading %s: %s", self._streamer.name, error
                     )
+                    span.set(error=type(error).__name__)
                     reader.close()
                     return
-            self._append_segment(segfile.name, size, sequence.segment.duration)
+                if segment is not None:
+                    span.set(size=segment.size)
+            if segment is not None:
+                self._append_segment(segment)
+
+        ready = Event()
+        recording = False
+        if found := self._find_stream():
+            stream, plugin = found
+            with stream.open() as reader:
+                # HACK: Segments go straight to the spool, bypassing the
+                # reader's ring buffer, so there is nothing to read here.
+                # The writer thread is running already.
+                reader.writer._write = _process_sequence
+                try:
+                    with self._lock:
+                        if self._closed:
+                            return
+                        self._reader = reader
+                    _logger.info("Recording %s", self._streamer.name)
+                    journal_state = self._load_journal(plugin.get_id())
+                    self._stream = self._journaled_stream(
+                        journal_state, plugin.get_title(), plugin.get_category()
+                    )
+                    self._replay(journal_state)
+                    live.publish(str(self._streamer.name), self._live)
+                    recording = True
+                finally:
+                    ready.set()
+                # The writer thread exits when the stream ends or is closed.
+                reader.writer.join()
+
+    def _load_journal(self, broadcast_id: Optional[str]) -> Optional[JournalState]:
+        if self._journal is None:
+            return None
+        state = self._journal.load()
+        if (
+            state is None
+            or state.broadcast_id != broadcast_id
+            or broadcast_id is None
+            and time.time() - state.updated > self.resume_window
+        ):
+            self._journal.reset(broadcast_id)
+            return None
+        _logger.info("Resuming %s", self._streamer.name)
+        return state
+
+    def _journaled_stream(
+        self, state: Optional[JournalState], title: Any, category: Any
+    ) -> db.Stream:
+        if state is not None and state.stream_id is not None:
+            resume = partial(self._resume_stream, state.stream_id)
+            if resumed := self._writer.submit(resume).result():
+                self._stream_journaled = True
+                self._stream_id = state.stream_id
+                stream, self._saved_count = resumed
+                return stream
+        return db.Stream(streamer_id=self._streamer.id, category=category, title=title)
+
+    def _resume_stream(
+        self, stream_id: int, session: Session
+    ) -> Optional[tuple[db.Stream, int]]:
+        if stream := session.get(db.Stream, stream_id):
+            query = select(func.count()).where(db.Segment.stream_id == stream.id)
+            # It is in progress again.
+            stream.url = ""
+            return stream, session.scalar(query)
+        return None
+
+    def _replay(self, state: Optional[JournalState]) -> None:
+        if state is None:
+            return
+        assert self._journal
+        for cid, name, duration in state.uploaded:
+            self._playlist.append(self._ipfs_url(cid, path=name), duration)
+        for name, duration in state.pending:
+            if (self._journal.spool_dir / name).exists():
+                file = self._spool.restore(name)
+                self._append_segment(_Segment(name, file.size, duration, file))
+        names = [name for _, name, _ in state.uploaded]
+        names += [name for name, _ in state.pending]
+        # Segments that are still in the live window are not recorded twice.
+        nums = [int(name.split(".")[0]) for name in names]
+        self._resume_after = max(nums, default=-1)
+        if self.upload_mode == "stream" and self._dirty_segments:
+            # Streamed uploads only carry the segments that are streamed.
+            self._flush()
 
+    def _keep_pending(self, segments: list[_Segment]) -> None:
+        # Segments that could not be uploaded are left for the next process.
+        if self._journal is None or self._discarded:
+            return
+        for segment in segments:
+            if segment.file is not None and segment.file.persist():
+                self._journal.segment_pending(segment.name, segment.duration)
+
+    def _find_stream(self) -> Optional[tuple[Any, Any]]:
         plugin_class, url = self._streamlink.resolve_url(self._streamer.url)
         plugin = plugin_class(url)
         try:
@@ -170,99 +584,315 @@ class _Worker:
             _logger.warning(
                 "Exception while getting streams of %s: %s", self._streamer.name, error
             )
-            return
-        if streams:
-            try:
-                stream = streams["best"]
-            except KeyError:
-                _logger.warning(
-                    "No %s streams with max quality %s found",
-                    self._streamer.name,
-                    self._streamer.max_quality,
-                )
-                return
-            stream.force_restart = True
-            with stream.open() as reader:
-                with self._lock:
-                    if self._closed:
-                        return
-                    self._reader = reader
-                _logger.info("Recording %s", self._streamer.name)
-                self._stream = db.Stream(
-                    streamer_id=self._streamer.id,
-                    category=plugin.get_category(),
-                    title=plugin.get_title(),
-                )
-                self._session.add(self._stream)
-                reader.writer._write = _process_sequence  # HACK
-                try:
-                    while reader.read(-1):
-                        pass
-                except OSError as error:
-                    _logger.warning(
-                        "Exception while recording %s: %s", self._streamer.name, error
-                    )
+            return None
+        if not streams:
+            return None
+        try:
+            stream = streams["best"]
+        except KeyError:
+            _logger.warning(
+                "No %s streams with max quality %s found",
+                self._streamer.name,
+                self._streamer.max_quality,
+            )
+            return None
+        stream.force_restart = True
+        return stream, plugin
+
+    def _spool_segment(
+        self,
+        name: str,
+        chunks: Iterable[bytes],
+        duration: float,
+        span: tracing.AnySpan = tracing.NO_SPAN,
+    ) -> _Segment:
+        file = self._spool.create(name)
+        try:
+            for chunk in chunks:
+                with span.timer("write_seconds"):
+                    file.write(chunk)
+        except BaseException:
+            file.release()
+            raise
+        finally:
+            file.close()
+        return _Segment(name, file.size, duration, file)
+
+    def _stream_segment(
+        self,
+        name: str,
+        chunks: Iterable[bytes],
+        duration: float,
+        span: tracing.AnySpan = tracing.NO_SPAN,
+    ) -> Optional[_Segment]:
+        upload = self._upload or self._start_upload()
+        if upload is None:  # Closing time
+            return None
+        upload.add_file(name)
+        size = 0
+        # A segment that fails halfway is uploaded, but left out of the playlist.
+        for chunk in chunks:
+            with span.timer("write_seconds"):
+                upload.write(chunk)
+            size += len(chunk)
+        return _Segment(name, size, duration)
+
+    def _start_upload(self) -> Optional[MultipartUpload]:
+        flush_num = self._reserve_flush()
+        if flush_num is None:
+            return None
+        upload = MultipartUpload(
+            self._ipfs_pool.http, self._ipfs_pool.api_url, wrap_with_directory=True
+        )
+        try:
+            future = self._executor.submit(self._send_upload, upload, flush_num)
+        except RuntimeError:  # Closing time
+            upload.abort()
+            self._release_flush(flush_num)
+            return None
+        # The segments of this flush are appended to this very list.
+        callback = partial(self._upload_complete, flush_num, self._dirty_segments)
+        future.add_done_callback(callback)
+        self._upload = upload
+        return upload
 
-    def _append_segment(self, file: str, size: int, duration: float) -> None:
-        # When the threshold is large enough we do not want to exceed it.
-        if self._dirty_size > 0 and self._dirty_size + size > self._flush_threshold:
+    def _send_upload(self, upload: MultipartUpload, flush_num: int = -1) -> str:
+        streamer = str(self._streamer.name)
+        with tracing.span("upload", streamer=streamer, flush=flush_num):
+            with _timed_upload():
+                return self._directory_cid(upload.send())
+
+    def _append_segment(self, segment: _Segment) -> None:
+        if segment.file is not None:
+            self._live.add(segment.name, segment.duration, segment.file)
+        name = str(self._streamer.name)
+        _ingest_bytes.inc(segment.size, streamer=name)
+        _ingest_segments.inc(streamer=name)
+        self._budget.update(self, segment.size, segment.duration)
+        if self._journal and segment.file and segment.file.spilled:
+            self._journal.segment_pending(segment.name, segment.duration)
+        if spool := self._acquired("_spool"):
+            spool.budget = self._spool_budget
+        # When the threshold is large enough we do not want to exceed it,
+        # unless the segment has been streamed already.
+        if (
+            segment.file is not None
+            and self._dirty_size > 0
+            and self._dirty_size + segment.size > self._flush_threshold
+        ):
             self._flush()
-        segment = _Segment(file, size, duration)
-        self._dirty_size += size
+        if not self._dirty_segments:
+            self._dirty_since = time.monotonic()
+        self._dirty_size += segment.size
         self._dirty_segments.append(segment)
         # When the threshold is too small we will exceed it.
         if self._dirty_size > self._flush_threshold:
             self._flush()
+        elif time.monotonic() - self._dirty_since >= self.max_flush_interval:
+            self._flush()
+        _dirty_bytes.set(self._dirty_size, streamer=name)
 
     def _flush(self) -> None:
-        def _upload_complete(future: Future[str]) -> None:
+        _logger.info("Flushing %s", self._streamer.name)
+        segments, self._dirty_segments = self._dirty_segments, []
+        size, self._dirty_size = self._dirty_size, 0
+        streamer = str(self._streamer.name)
+        _dirty_bytes.set(0, streamer=streamer)
+        with tracing.span("flush", streamer=streamer, size=size) as span:
+            if tracing.enabled():
+                span.set(segments=[segment.name for segment in segments])
+            if self._upload is not None:
+                # Streamed segments were reserved a flush by _start_upload.
+                span.set(flush=self._flush_count - 1)
+                self._upload.close()
+                self._upload = None
+                return
+            flush_num = self._reserve_flush()
+            if flush_num is None:  # Closing time
+                self._unflush(segments, size)
+                return
+            span.set(flush=flush_num)
             try:
-                assert self._stream
-                self._stream.url = future.result()
-                self._session.commit()
-            except CancelledError:  # Closing time
-                _logger.info("Canceled flushing %s", self._streamer.name)
-            except Exception:
-                # The recording will be playable, but it will miss a chunk.
-                _logger.warning(
-                    "Exception while flushing %s", self._streamer.name, exc_info=True
+                upload = self._executor.submit(
+                    self._upload_segments, segments, flush_num
                 )
+            except RuntimeError:  # Closing time
+                self._release_flush(flush_num)
+                self._unflush(segments, size)
             else:
-                _logger.info("Flushed %s", self._streamer.name)
+                upload.add_done_callback(
+                    partial(self._upload_complete, flush_num, segments)
+                )
 
-        _logger.info("Flushing %s", self._streamer.name)
-        segments, self._dirty_segments = self._dirty_segments, []
-        self._dirty_size = 0
+    def _unflush(self, segments: list[_Segment], size: int) -> None:
+        # So that __exit__ keeps them for the next process.
+        self._dirty_segments[:0] = segments
+        self._dirty_size += size
+
+    def _reserve_flush(self) -> Optional[int]:
+        # Blocking the writer thread here stops reading new segments until
+        # an upload completes.
+        with tracing.span("flush_wait", streamer=str(self._streamer.name)):
+            while not self._pending_uploads.acquire(timeout=1):
+                if self._closed:
+                    return None
+        flush_num = self._flush_count
+        self._flush_count += 1
+        self._flushed_at[flush_num] = time.monotonic()
+        _pending_flushes.inc()
+        return flush_num
+
+    def _release_flush(self, flush_num: int) -> None:
+        self._flushed_at.pop(flush_num, None)
+        self._pending_uploads.release()
+        _pending_flushes.dec()
+
+    def _upload_complete(
+        self, flush_num: int, segments: list[_Segment], upload: Future[str]
+    ) -> None:
+        # Uploads may complete out of order, playlists are committed in order.
+        with self._commit_lock:
+            self._uploaded[flush_num] = (segments, upload)
+            while uploaded := self._uploaded.pop(self._commit_count, None):
+                flush_num = self._commit_count
+                self._commit_count += 1
+                self._commit_playlist(flush_num, *uploaded)
+                self._release_flush(flush_num)
+
+    def _commit_playlist(
+        self, flush_num: int, segments: list[_Segment], upload: Future[str]
+    ) -> None:
+        streamer = str(self._streamer.name)
         try:
-            upload = self._executor.submit(self._upload_segments, segments)
-        except RuntimeError:  # Closing time
-            pass
+            cid = upload.result()
+            if self._discarded:  # The streamer is gone
+                raise CancelledError
+            self._journal_uploaded(cid, segments)
+            with tracing.span("playlist", streamer=streamer, flush=flush_num):
+                self._append_playlist(cid, segments)
+            with tracing.span("commit", streamer=streamer, flush=flush_num):
+                self._commit()
+            self._journal_committed()
+            if (flushed_at := self._flushed_at.get(flush_num)) is not None:
+                _flush_seconds.observe(time.monotonic() - flushed_at)
+        except CancelledError:  # Closing time
+            _logger.info("Canceled flushing %s", self._streamer.name)
+            self._live.discard(segment.name for segment in segments)
+            self._keep_pending(segments)
+            return
+        except Exception:
+            # The recording will be playable, but it will miss a chunk.
+            _logger.warning(
+                "Exception while flushing %s", self._streamer.name, exc_info=True
+            )
         else:
-            upload.add_done_callback(_upload_complete)
+            _logger.info("Flushed %s", self._streamer.name)
+        self._release(segments)
+
+    def _append_playlist(self, cid: str, segments: list[_Segment]) -> None:
+        self._live.commit(
+            (segment.name, self._ipfs_url(cid, path=segment.name), segment.duration)
+            for segment in segments
+        )
+
+    def _release(self, segments: list[_Segment]) -> None:
+        # Segments are served live until they are in the playlist.
+        self._live.discard(segment.name for segment in segments)
+        for segment in segments:
+            if segment.file is not None:
+                segment.file.release()
+
+    def _commit(self) -> None:
+        self._saved(self._save().result())
+
+    def _save(self) -> "Future[tuple[int, int]]":
+        # Segments that failed to be saved before are saved with these.
+        segments = list(self._playlist.segments(self._saved_count))
+        return self._writer.submit(partial(self._save_segments, segments))
 
-    def _upload_segments(self, segments: list[_Segment]) -> str:
-        files = [self._workdir_path / segment.file for segment in segments]
+    def _saved(self, result: tuple[int, int]) -> None:
+        self._stream_id, count = result
+        self._saved_count += count
+
+    def _save_segments(
+        self, segments: list[tuple[str, float]], session: Session
+    ) -> tuple[int, int]:
+        """Returns the stream id and the number of saved segments."""
+        assert self._stream
+        session.add(self._stream)
+        session.flush()
+        assert self._stream.id
+        rows = [
+            {"stream_id": self._stream.id, "url": url, "duration": duration}
+            for url, duration in segments
+        ]
+        if rows:
+            session.execute(insert(db.Segment), rows)
+        return self._stream.id, len(rows)
+
+    def _save_url(self, url: str, session: Session) -> None:
+        assert self._stream
+        session.add(self._stream)
+        self._stream.url = url
+
+    def _finish(self) -> None:
+        # The playlist is only uploaded once, until then the app serves it
+        # from the segments table.
+        if not self._saved_count:
+            return
         try:
-            ipfs_files = self._ipfs.add(
-                *files, trickle=True, wrap_with_directory=True, cid_version=1
+            url = self._upload_playlist()
+            self._writer.submit(partial(self._save_url, url)).result()
+        except Exception:
+            _logger.warning(
+                "Exception while finishing %s", self._streamer.name, exc_info=True
             )
+
+    def _journal_uploaded(self, cid: str, segments: list[_Segment]) -> None:
+        if self._journal:
+            names = [(segment.name, segment.duration) for segment in segments]
+            self._journal.segments_uploaded(cid, names)
+
+    def _journal_committed(self) -> None:
+        if self._journal and not self._stream_journaled:
+            assert self._stream_id
+            self._journal.stream_committed(self._stream_id)
+            self._stream_journaled = True
+
+    def _upload_segments(self, segments: list[_Segment], flush_num: int = -1) -> str:
+        files = [segment.file.reader() for segment in segments if segment.file]
+        streamer = str(self._streamer.name)
+        try:
+            with tracing.span("upload", streamer=streamer, flush=flush_num):
+                with _timed_upload(), self._ipfs_pool.client() as ipfs:
+                    ipfs_files = ipfs.add(
+                        *files, trickle=True, wrap_with_directory=True, cid_version=1
+                    )
         finally:
             for file in files:
-                os.remove(file)
+                file.close()
+        return self._directory_cid(ipfs_files)
+
+    def _directory_cid(self, ipfs_files: list[dict[str, Any]]) -> str:
         ipfs_dir = next(file for file in ipfs_files if not file["Name"])
-        for segment in segments:
-            url = self._ipfs_url(ipfs_dir["Hash"], path=segment.file)
-            self._playlist.append(url, segment.duration)
+        return str(ipfs_dir["Hash"])
+
+    def _upload_playlist(self) -> str:
         m3u8 = self._workdir_path / f"{self._streamer.name}.m3u8"
         self._playlist.write(m3u8)
-        ipfs_m3u8 = self._ipfs.add(m3u8, cid_version=1)
+        with self._ipfs_pool.client() as ipfs:
+            ipfs_m3u8 = ipfs.add(m3u8, cid_version=1)
         return self._ipfs_url(ipfs_m3u8["Hash"])
 
     def _ipfs_url(self, cid: str, path: str = "") -> str:
         return self.ipfs_gateway_uri_template.format(cid=cid, path=path)
 
+    def discard(self) -> None:
+        """Stops recording without keeping anything for a next process."""
+        self._discarded = True
+        self.close()
+
     def close(self) -> None:
-        self._ipfs.close()
         with self._lock:
             self._closed = True
             if self._reader:
@@ -278,11 +908,25 @@ class _Worker:
     ) -> None:
         if not self._closed and self._dirty_size > 0:
             self._flush()
+        if self._upload is not None:
+            # Nothing more will be sent, so don't wait for it.
+            self._upload.abort()
         cancel_futures = self._closed
         self.close()
-        self._executor.shutdown(cancel_futures=cancel_futures)
-        self._session.close()
-        self._workdir.cleanup()
+        live.unpublish(str(self._streamer.name), self._live)
+        _dirty_bytes.remove(streamer=str(self._streamer.name))
+        self._budget.remove(self)
+        self._keep_pending(self._dirty_segments)
+        if executor := self._acquired("_executor"):
+            executor.shutdown(cancel_futures=cancel_futures)
+        if not cancel_futures:
+            self._finish()
+        if journal := self._acquired("_journal"):
+            # Closing time means the process is going away, not the stream.
+            if self._discarded or not cancel_futures and exc_type is None:
+                journal.remove()
+        if workdir := self._acquired("_workdir"):
+            workdir.cleanup()
 
     def __enter__(self) -> "_Worker":
         return self
@@ -0,0 +1,105 @@
+import heapq
+import random
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Iterable, Optional
+
+
+class _Entry:
+    __slots__ = ("due", "hours", "misses")
+
+    def __init__(self, due: float, hours: Iterable[int]) -> None:
+        self.due = due
+        self.hours = set(hours)
+        self.misses = 0
+
+
+class Scheduler:
+    """Decides when each streamer should be checked next.
+
+    Streamers that stay offline are checked less and less often, up to
+    `max_interval`, except around the hours (UTC) they usually go live.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        max_interval: float,
+        jitter: float = 0.1,
+        window: int = 1,
+        rand: Callable[[], float] = random.random,
+    ) -> None:
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.jitter = jitter
+        self.window = window
+        self._entries: dict[int, _Entry] = {}
+        self._heap: list[tuple[float, int]] = []
+        self._lock = Lock()
+        self._rand = rand
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._entries
+
+    def keys(self) -> list[int]:
+        with self._lock:
+            return list(self._entries)
+
+    def add(self, key: int, now: float, hours: Iterable[int] = ()) -> None:
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = _Entry(now, hours)
+                heapq.heappush(self._heap, (now, key))
+
+    def remove(self, key: int) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def due(self, now: float) -> list[int]:
+        keys = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                # Skip entries that were removed or rescheduled.
+                if entry is not None and entry.due == due:
+                    keys.append(key)
+        return keys
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            while self._heap:
+                due, key = self._heap[0]
+                entry = self._entries.get(key)
+                if entry is not None and entry.due == due:
+                    return due
+                heapq.heappop(self._heap)
+        return None
+
+    def checked(self, key: int, now: float, live: Optional[bool]) -> float:
+        """Schedules the next check, `live` is None when it is unknown."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return now
+            hour = datetime.utcfromtimestamp(now).hour
+            if live:
+                entry.misses = 0
+                entry.hours.add(hour)
+            elif live is not None:
+                entry.misses += 1
+            delay = self._delay(entry, hour)
+            entry.due = now + delay + delay * self.jitter * self._rand()
+            heapq.heappush(self._heap, (entry.due, key))
+            return entry.due
+
+    def _delay(self, entry: _Entry, hour: int) -> float:
+        if entry.misses == 0 or self._usual_hour(entry, hour):
+            return self.interval
+        return min(self.interval * 2.0 ** (entry.misses - 1), self.max_interval)
+
+    def _usual_hour(self, entry: _Entry, hour: int) -> bool:
+        return any(
+            (hour + offset) % 24 in entry.hours
+            for offset in range(-self.window, self.window + 1)
+        )
@@ -0,0 +1,185 @@
+import os
+from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, Iterator, Optional, Union
+
+_Bytes = Union[bytes, bytearray, memoryview]
+
+
+class Spool:
+    """Holds segments in pooled memory pages up to `budget` bytes.
+
+    Segments that do not fit are spilled to files in `spill_dir`. Released
+    pages go back to the pool and are reused by later segments, as long as
+    the pool stays within the budget.
+    """
+
+    page_size = 1 << 20  # 1M
+
+    def __init__(self, budget: int, spill_dir: Path) -> None:
+        self.spill_dir = spill_dir
+        self.spilled = 0
+        self._budget = budget
+        self._free: list[bytearray] = []
+        self._lock = Lock()
+        self._used = 0
+
+    @property
+    def budget(self) -> int:
+        return self._budget
+
+    @budget.setter
+    def budget(self, budget: int) -> None:
+        with self._lock:
+            self._budget = budget
+            self._trim()
+
+    @property
+    def memory_size(self) -> int:
+        with self._lock:
+            return self._used
+
+    def create(self, name: str) -> "SpoolFile":
+        return SpoolFile(self, name)
+
+    def restore(self, name: str) -> "SpoolFile":
+        """Returns a spilled file that a previous process left behind."""
+        file = SpoolFile(self, name)
+        file._file = file.path.open(mode="ab")
+        file.size = file._file.tell()
+        file.close()
+        return file
+
+    def _take_page(self) -> Optional[bytearray]:
+        with self._lock:
+            if self._used + self.page_size > self._budget:
+                return None
+            self._used += self.page_size
+            return self._free.pop() if self._free else bytearray(self.page_size)
+
+    def _give_back(self, pages: list[bytearray]) -> None:
+        with self._lock:
+            self._used -= len(pages) * self.page_size
+            self._free.extend(pages)
+            self._trim()
+
+    def _trim(self) -> None:
+        # Free pages that no longer fit in the budget are dropped.
+        keep = max(self._budget - self._used, 0) // self.page_size
+        del self._free[keep:]
+
+    def _spilled(self) -> None:
+        with self._lock:
+            self.spilled += 1
+
+
+class SpoolFile:
+    def __init__(self, spool: Spool, name: str) -> None:
+        self.name = name
+        self.size = 0
+        self._file: Optional[BinaryIO] = None
+        self._pages: list[bytearray] = []
+        self._released = False
+        self._spool = spool
+
+    @property
+    def path(self) -> Path:
+        return self._spool.spill_dir / self.name
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def write(self, data: _Bytes) -> int:
+        view = memoryview(data)
+        written = 0
+        page_size = self._spool.page_size
+        while written < len(view) and self._file is None:
+            offset = self.size % page_size
+            if offset == 0:
+                page = self._spool._take_page()
+                if page is None:
+                    self._spill()
+                    break
+                self._pages.append(page)
+            count = min(len(view) - written, page_size - offset)
+            self._pages[-1][offset : offset + count] = view[written : written + count]
+            written += count
+            self.size += count
+        if written < len(view):
+            assert self._file
+            self.size += self._file.write(view[written:])
+            written = len(view)
+        return written
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+    def persist(self) -> bool:
+        """Moves the contents to the spill directory, unless released."""
+        if self._released:
+            return False
+        if self._file is None:
+            self._spill()
+        self.close()
+        return True
+
+    def chunks(self, size: int = 1 << 16) -> Iterator[_Bytes]:
+        """Yields the contents without copying what is held in memory."""
+        if self._file is not None:
+            with self.path.open(mode="rb") as file:
+                while chunk := file.read(size):
+                    yield chunk
+            return
+        remaining = self.size
+        for page in self._pages:
+            view = memoryview(page)[: min(remaining, len(page))]
+            for offset in range(0, len(view), size):
+                yield view[offset : offset + size]
+            remaining -= len(view)
+
+    def reader(self) -> BinaryIO:
+        """Returns a file object, which is what ipfshttpclient accepts."""
+        if self._file is not None:
+            return self.path.open(mode="rb")
+        return _SpoolReader(self)  # type: ignore
+
+    def release(self) -> None:
+        self._released = True
+        self._spool._give_back(self._pages)
+        self._pages = []
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.path)
+
+    def _spill(self) -> None:
+        # The pages are read before the file is set, chunks() prefers it.
+        chunks = list(self.chunks())
+        self._file = self.path.open(mode="wb")
+        for chunk in chunks:
+            self._file.write(chunk)
+        self._spool._give_back(self._pages)
+        self._pages = []
+        self._spool._spilled()
+
+
+class _SpoolReader:
+    def __init__(self, file: SpoolFile) -> None:
+        self.name = file.name
+        self._chunks = file.chunks()
+        self._pending = memoryview(b"")
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            return b"".join([bytes(self._pending), *map(bytes, self._chunks)])
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return b""
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return bytes(chunk)
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,130 @@
+"""Timing hooks around the hot path of a recording.
+
+Recordings wrap reading a segment, flushing, uploading and committing in
+spans. When a span ends, it is passed to every sink as a record, e.g.
+
+    {"span": "upload", "streamer": "name", "flush": 3, "start": 1.6e9,
+     "seconds": 0.42}
+
+Spans of a flush carry its number; the "flush" span also lists the
+segments in it, so per-segment timings can be joined offline. Reading a
+segment reports the time spent writing it in "write_seconds", the rest is
+spent on HTTP. Without sinks, `span()` returns the shared `NO_SPAN`.
+"""
+
+import json
+import time
+from pathlib import Path
+from threading import Lock
+from types import TracebackType
+from typing import Any, Callable, Optional, Union
+
+Sink = Callable[[dict[str, Any]], None]
+
+_sinks: list[Sink] = []
+
+
+class Span:
+    __slots__ = ("_fields", "_started", "_start_time")
+
+    def __init__(self, name: str, fields: dict[str, Any]) -> None:
+        self._fields = {"span": name, **fields}
+        self._started = 0.0
+        self._start_time = 0.0
+
+    def set(self, **fields: Any) -> None:
+        self._fields.update(fields)
+
+    def timer(self, field: str) -> "_Timer":
+        """Adds up the time spent in the `with` block to `field`."""
+        return _Timer(self._fields, field)
+
+    def __enter__(self) -> "Span":
+        self._start_time = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        record = self._fields
+        record["start"] = self._start_time
+        record["seconds"] = time.perf_counter() - self._started
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        for sink in list(_sinks):
+            sink(record)
+
+
+class _Timer:
+    __slots__ = ("_fields", "_field", "_started")
+
+    def __init__(self, fields: dict[str, Any], field: str) -> None:
+        self._fields = fields
+        self._field = field
+        self._started = 0.0
+
+    def __enter__(self) -> None:
+        self._started = time.perf_counter()
+
+    def __exit__(self, *_exc_info: Any) -> None:
+        elapsed = time.perf_counter() - self._started
+        self._fields[self._field] = self._fields.get(self._field, 0.0) + elapsed
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def set(self, **fields: Any) -> None:
+        pass
+
+    def timer(self, field: str) -> "_NoSpan":
+        return self
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *_exc_info: Any) -> None:
+        pass
+
+
+NO_SPAN = _NoSpan()
+AnySpan = Union[Span, _NoSpan]
+
+
+def span(name: str, **fields: Any) -> AnySpan:
+    if not _sinks:
+        return NO_SPAN
+    return Span(name, fields)
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+def add_sink(sink: Sink) -> None:
+    _sinks.append(sink)
+
+
+def remove_sink(sink: Sink) -> None:
+    _sinks.remove(sink)
+
+
+class JSONLSink:
+    """Appends records to a JSON Lines file, one line per span."""
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = Lock()
+
+    def __call__(self, record: dict[str, Any]) -> None:
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
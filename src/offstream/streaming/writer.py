@@ -0,0 +1,126 @@
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cached_property
+from threading import Lock
+from typing import Any, Callable, TypeVar
+
+from sqlalchemy.orm import Session
+
+from offstream import db
+
+_logger = logging.getLogger("offstream")
+
+_T = TypeVar("_T")
+
+
+class DBWriter:
+    """Commits the database changes of all recordings on a single thread.
+
+    A change is a function that is called with the writer's session.
+    Changes that are submitted while a transaction is being committed are
+    batched into the next one, so concurrent flushes don't fight over the
+    database's write lock. Objects stay loaded after commit, so that the
+    submitting thread can read them.
+    """
+
+    max_batch_size = int(os.getenv("OFFSTREAM_DB_BATCH_SIZE", "50"))
+
+    def __init__(self) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="offstream-db"
+        )
+        self._changes: list[tuple[Callable[[Session], Any], Future[Any]]] = []
+        self._lock = Lock()
+        self._scheduled = False
+        self._stats: Counter[str] = Counter()
+        self._commit_time = 0.0
+        self._max_commit_time = 0.0
+
+    @cached_property
+    def _session(self) -> Session:
+        return db.Session(expire_on_commit=False)
+
+    @property
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            stats: dict[str, float] = dict(self._stats)
+            commits = self._stats["commits"]
+            stats["avg_batch_size"] = self._stats["changes"] / commits if commits else 0
+            stats["avg_commit_time"] = self._commit_time / commits if commits else 0
+            stats["max_commit_time"] = self._max_commit_time
+        return stats
+
+    def submit(self, change: Callable[[Session], _T]) -> "Future[_T]":
+        future: Future[_T] = Future()
+        with self._lock:
+            self._changes.append((change, future))
+            if self._scheduled:
+                return future
+            self._scheduled = True
+        try:
+            self._executor.submit(self._write)
+        except RuntimeError:  # Closing time
+            with self._lock:
+                self._changes.remove((change, future))
+            raise
+        return future
+
+    def close(self) -> None:
+        try:
+            # The session belongs to the writer thread.
+            self._executor.submit(self._close_session)
+        except RuntimeError:  # Closed already
+            return
+        self._executor.shutdown()
+
+    def _close_session(self) -> None:
+        if session := self.__dict__.get("_session"):
+            session.close()
+
+    def _write(self) -> None:
+        while True:
+            with self._lock:
+                batch = self._changes[: self.max_batch_size]
+                del self._changes[: len(batch)]
+                if not batch:
+                    self._scheduled = False
+                    return
+            self._commit(
+                [item for item in batch if item[1].set_running_or_notify_cancel()]
+            )
+
+    def _commit(
+        self, batch: list[tuple[Callable[[Session], Any], Future[Any]]]
+    ) -> None:
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            results = [change(self._session) for change, _ in batch]
+            self._session.commit()
+        except Exception as error:
+            self._session.rollback()
+            with self._lock:
+                self._stats["failed"] += 1
+            if len(batch) == 1:
+                batch[0][1].set_exception(error)
+                return
+            # So that one bad change doesn't fail the others.
+            for item in batch:
+                self._commit([item])
+            return
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["commits"] += 1
+            self._stats["changes"] += len(batch)
+            self._stats["max_batch_size"] = max(
+                self._stats["max_batch_size"], len(batch)
+            )
+            self._commit_time += elapsed
+            self._max_commit_time = max(self._max_commit_time, elapsed)
+        _logger.debug("Committed %d change(s) in %.3fs", len(batch), elapsed)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -1,4 +1,8 @@
+import json
 import os
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
 
 import flask
 
@@ -74,3 +78,112 @@ def bad_auth(request):
 @pytest.fixture
 def m3u8(tmpdir):
     return tmpdir / "playlist.m3u8"
+
+
+class _LocalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+
+@pytest.fixture
+def local_server():
+    servers = []
+
+    def _local_server(handler):
+        server = _LocalServer(("127.0.0.1", 0), handler)
+        thread = Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append((server, thread))
+        return server
+
+    yield _local_server
+    for server, thread in servers:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_body(self, body, content_type="application/octet-stream"):
+        self.send_response(200)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        pass
+
+
+@pytest.fixture
+def hls_origin(local_server):
+    """Serves a finished HLS stream at /<name>.m3u8."""
+
+    class _Handler(_QuietHandler):
+        def do_GET(self):
+            path = self.path.lstrip("/")
+            if path.endswith(".m3u8"):
+                lines = [
+                    "#EXTM3U",
+                    "#EXT-X-TARGETDURATION:1",
+                    "#EXT-X-MEDIA-SEQUENCE:0",
+                ]
+                for num in range(origin.segments):
+                    lines += ["#EXTINF:1.000,", f"{num}.ts"]
+                lines.append("#EXT-X-ENDLIST")
+                body = "\n".join(lines).encode() + b"\n"
+                self.send_body(body, "application/vnd.apple.mpegurl")
+            elif path.endswith(".ts"):
+                self.send_body(b"\x47" * origin.segment_size, "video/mp2t")
+            else:
+                self.send_error(404)
+
+    origin = local_server(_Handler)
+    origin.segments = 3
+    origin.segment_size = 188
+    return origin
+
+
+@pytest.fixture
+def ipfs_api(local_server):
+    """Fake IPFS HTTP API that answers /api/v0/add."""
+
+    class _Handler(_QuietHandler):
+        def do_POST(self):
+            if not self.path.startswith("/api/v0/add"):
+                self.send_error(404)
+                return
+            if "chunked" in self.headers.get("transfer-encoding", ""):
+                body = self._read_chunked()
+            else:
+                body = self.rfile.read(int(self.headers["content-length"]))
+            names = re.findall(rb'filename="([^"]+)"', body)
+            api.requests.append((self.path, body))
+            entries = [
+                {"Name": name.decode(), "Hash": f"cid{i}"}
+                for i, name in enumerate(names)
+            ]
+            if "wrap-with-directory=true" in self.path.lower():
+                entries.append({"Name": "", "Hash": "dircid"})
+            lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+            self.send_body(lines.encode(), "application/json")
+
+        def _read_chunked(self):
+            body = b""
+            while size := int(self.rfile.readline().strip(), 16):
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            self.rfile.readline()
+            return body
+
+    api = local_server(_Handler)
+    api.requests = []
+    host, port = api.server_address
+    api.multiaddr = f"/ip4/{host}/tcp/{port}/http"
+    return api
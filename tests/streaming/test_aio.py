@@ -0,0 +1,82 @@
+from concurrent.futures import Future
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import select
+
+from offstream import db
+from offstream.streaming.aio import AsyncRecorder
+from offstream.streaming.recorder import _Worker
+
+
+@pytest.fixture(autouse=True)
+def inline_db_executors():
+    def _execute_inline(func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    with patch(
+        "offstream.streaming.aio.ThreadPoolExecutor", autospec=True
+    ) as tpe, patch(
+        "offstream.streaming.writer.ThreadPoolExecutor", autospec=True
+    ) as wtpe:
+        tpe.return_value.submit.side_effect = _execute_inline
+        wtpe.return_value.submit.side_effect = _execute_inline
+        yield
+
+
+@pytest.fixture(autouse=True)
+def probe():
+    with patch("offstream.streaming.recorder.TwitchProber", autospec=True) as prober:
+        prober.return_value.probe.side_effect = set
+        yield prober.return_value.probe
+
+
+@pytest.fixture
+def hls_streamer(streamer, hls_origin, ipfs_api, monkeypatch):
+    monkeypatch.setattr(
+        db.Streamer, "_uri_template", f"hls://{hls_origin.url}/{{name}}.m3u8"
+    )
+    monkeypatch.setattr(_Worker, "ipfs_api_addr", ipfs_api.multiaddr)
+    monkeypatch.setattr(
+        _Worker, "ipfs_gateway_uri_template", "https://{cid}.ipfs.test/{path}"
+    )
+    return streamer
+
+
+def test_start_records_stream(hls_streamer, hls_origin, ipfs_api, session):
+    recorder = AsyncRecorder()
+    recorder.start(_loop=False)
+
+    stream = session.scalars(select(db.Stream)).one()
+    assert stream.streamer_id == hls_streamer.id
+    assert stream.url == "https://cid0.ipfs.test/"
+    segment_upload, playlist_upload = ipfs_api.requests
+    assert "wrap-with-directory=true" in segment_upload[0]
+    for num in range(hls_origin.segments):
+        assert f'filename="{num}.ts"'.encode() in segment_upload[1]
+    assert segment_upload[1].count(b"\x47" * hls_origin.segment_size) == 3
+    assert b"https://dircid.ipfs.test/2.ts" in playlist_upload[1]
+
+
+def test_start_with_offline_streamer(hls_streamer, probe, ipfs_api, session):
+    probe.side_effect = None
+    probe.return_value = set()
+
+    recorder = AsyncRecorder()
+    recorder.start(_loop=False)
+
+    assert not ipfs_api.requests
+    assert not session.scalars(select(db.Stream)).all()
+
+
+def test_start_after_close(hls_streamer, ipfs_api):
+    recorder = AsyncRecorder()
+    recorder.close()
+    recorder.start()
+
+    assert not ipfs_api.requests
@@ -0,0 +1,39 @@
+import pytest
+
+from offstream.streaming.budget import MemoryBudget
+
+
+@pytest.fixture
+def budget():
+    return MemoryBudget(total=1000)
+
+
+def test_share_is_proportional_to_bitrate(budget):
+    budget.update("hd", size=300, duration=1.0)
+    budget.update("sd", size=100, duration=1.0)
+
+    assert budget.share("hd") == 750
+    assert budget.share("sd") == 250
+
+
+def test_new_recording_gets_average_share(budget):
+    assert budget.share("new") == 1000
+
+    budget.update("hd", size=300, duration=1.0)
+
+    assert budget.share("new") == 500
+
+
+def test_rate_is_smoothed(budget):
+    budget.update("a", size=100, duration=1.0)
+    budget.update("a", size=200, duration=1.0)
+
+    assert budget.rates["a"] == pytest.approx(120)
+
+
+def test_remove_frees_share(budget):
+    budget.update("a", size=100, duration=1.0)
+    budget.update("b", size=100, duration=1.0)
+    budget.remove("b")
+
+    assert budget.share("a") == 1000
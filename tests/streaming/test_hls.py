@@ -1,3 +1,5 @@
+import pytest
+
 import offstream.streaming.hls as hls
 
 
@@ -28,3 +30,92 @@ def test_empty_playlist(m3u8):
         "#EXT-X-MEDIA-SEQUENCE:0\n"
         "#EXT-X-ENDLIST\n"
     )
+
+
+def test_playlist_without_endlist():
+    playlist = hls.Playlist(playlist_type="event", endlist=False)
+    playlist.append(url="0.ts", duration=2.0)
+    assert playlist.render() == (
+        b"#EXTM3U\n"
+        b"#EXT-X-PLAYLIST-TYPE:EVENT\n"
+        b"#EXT-X-TARGETDURATION:2\n"
+        b"#EXT-X-VERSION:3\n"
+        b"#EXT-X-MEDIA-SEQUENCE:0\n"
+        b"#EXTINF:2.000,\n"
+        b"0.ts\n"
+    )
+
+
+def test_playlist_appends_incrementally(m3u8):
+    playlist = hls.Playlist()
+    playlist.append(url="0.ts", duration=2.0)
+    playlist.write(m3u8)
+    playlist.append(url="1.ts", duration=6.5, title="ad")
+    playlist.append(url="2.ts", duration=2.0)
+    playlist.write(m3u8)
+    assert playlist.segment_count == 3
+    assert playlist.target_duration == 7
+    assert (
+        m3u8.read()
+        == playlist.render().decode()
+        == (
+            "#EXTM3U\n"
+            "#EXT-X-PLAYLIST-TYPE:VOD\n"
+            "#EXT-X-TARGETDURATION:7\n"
+            "#EXT-X-VERSION:3\n"
+            "#EXT-X-MEDIA-SEQUENCE:0\n"
+            "#EXT-X-ENDLIST\n"
+            "#EXTINF:2.000,\n"
+            "0.ts\n"
+            "#EXTINF:6.500,ad\n"
+            "1.ts\n"
+            "#EXTINF:2.000,\n"
+            "2.ts\n"
+        )
+    )
+
+
+def test_playlist_stores_segments_in_columns():
+    playlist = hls.Playlist()
+    for num in range(3):
+        playlist.append(url=f"https://cid.ipfs.test/{num}.ts", duration=2.0)
+    playlist.append(url="https://example.org/video", duration=2.0)
+    assert playlist._bases == ["https://cid.ipfs.test/", "https://example.org/video"]
+    assert list(playlist._base_indexes) == [0, 0, 0, 1]
+    assert list(playlist._nums) == [0, 1, 2, -1]
+    assert playlist.render().endswith(
+        b"https://cid.ipfs.test/2.ts\n#EXTINF:2.000,\nhttps://example.org/video\n"
+    )
+    assert list(playlist.segments(start=2)) == [
+        ("https://cid.ipfs.test/2.ts", 2.0),
+        ("https://example.org/video", 2.0),
+    ]
+
+
+@pytest.mark.parametrize("name", ["007.ts", "00.ts", "\u00b2.ts", "\u0661.ts"])
+def test_playlist_keeps_names_that_are_not_plain_numbers(name):
+    playlist = hls.Playlist()
+    playlist.append(url=f"https://cid.ipfs.test/{name}", duration=2.0)
+
+    assert list(playlist.segments()) == [(f"https://cid.ipfs.test/{name}", 2.0)]
+    assert playlist.render().endswith(f"https://cid.ipfs.test/{name}\n".encode())
+
+
+def test_playlist_rewrites_when_header_grows(m3u8):
+    playlist = hls.Playlist()
+    playlist.append(url="0.ts", duration=9.0)
+    playlist.write(m3u8)
+    playlist.append(url="1.ts", duration=10.0)
+    playlist.write(m3u8)
+    assert m3u8.read() == playlist.render().decode()
+    assert "#EXT-X-TARGETDURATION:10\n" in m3u8.read()
+
+
+def test_playlist_rewrites_modified_file(m3u8):
+    playlist = hls.Playlist()
+    playlist.append(url="0.ts", duration=1.0)
+    playlist.write(m3u8)
+    m3u8.write("")
+    playlist.append(url="1.ts", duration=1.0)
+    playlist.write(m3u8)
+    assert m3u8.read() == playlist.render().decode()
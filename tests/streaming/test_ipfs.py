@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from unittest.mock import patch
+
+import pytest
+import requests
+from ipfshttpclient.exceptions import ConnectionError
+
+from offstream.streaming.ipfs import IPFSPool, MultipartUpload
+
+
+@pytest.fixture
+def connect():
+    with patch("offstream.streaming.ipfs.ipfshttpclient.connect") as connect_:
+        connect_.side_effect = lambda **_kwargs: object.__new__(_Client)
+        yield connect_
+
+
+class _Client:
+    version_error = None
+
+    def version(self):
+        if self.version_error:
+            raise self.version_error
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def clock():
+    return [0.0]
+
+
+@pytest.fixture
+def pool(connect, clock):
+    return IPFSPool("/ip4/127.0.0.1/tcp/5001/http", size=2, clock=lambda: clock[0])
+
+
+def test_client_is_reused(pool, connect):
+    with pool.client() as first:
+        pass
+    with pool.client() as second:
+        pass
+
+    assert first is second
+    connect.assert_called_once_with(addr=pool.addr, session=True)
+    assert pool.stats == {"borrowed": 2, "connected": 1, "reused": 1}
+
+
+def test_concurrent_borrowers_get_different_clients(pool):
+    with pool.client() as first, pool.client() as second:
+        assert first is not second
+
+    assert pool.stats["connected"] == 2
+
+
+def test_failed_client_is_discarded(pool):
+    with pytest.raises(ConnectionError):
+        with pool.client() as first:
+            raise ConnectionError("testing")
+    with pool.client() as second:
+        pass
+
+    assert first.closed
+    assert first is not second
+    assert pool.stats["discarded"] == 1
+
+
+def test_idle_client_is_health_checked(pool, clock):
+    with pool.client() as first:
+        pass
+    clock[0] += pool.health_check_interval + 1
+    with pool.client() as second:
+        pass
+    first.version_error = ConnectionError("testing")
+    clock[0] += pool.health_check_interval + 1
+    with pool.client() as third:
+        pass
+
+    assert first is second
+    assert first is not third
+    assert pool.stats["health_checks"] == 2
+    assert pool.stats["discarded"] == 1
+
+
+def test_close(pool):
+    with pool.client() as borrowed:
+        with pool.client() as idle:
+            pass
+        pool.close()
+        assert idle.closed
+        assert not hasattr(borrowed, "closed")
+
+    assert borrowed.closed
+
+
+def test_multipart_upload(ipfs_api):
+    upload = MultipartUpload(
+        requests.Session(), f"{ipfs_api.url}/api/v0/", wrap_with_directory=True
+    )
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        sent = executor.submit(upload.send)
+        for num in range(3):
+            upload.add_file(f"{num}.ts")
+            upload.write(b"\x47" * 100)
+            upload.write(b"\x47" * 88)
+        upload.close()
+        ipfs_files = sent.result()
+
+    assert ipfs_files[-1] == {"Name": "", "Hash": "dircid"}
+    path, body = ipfs_api.requests[0]
+    assert "wrap-with-directory=true" in path
+    boundary = body.split(b"\r\n", 1)[0][2:].decode()
+    message = BytesParser().parsebytes(
+        f"Content-Type: multipart/form-data; boundary={boundary}\r\n\r\n".encode()
+        + body
+    )
+    parts = message.get_payload()
+    assert [part.get_filename() for part in parts] == ["0.ts", "1.ts", "2.ts"]
+    assert all(part.get_payload(decode=True) == b"\x47" * 188 for part in parts)
+
+
+def test_multipart_upload_abort(ipfs_api):
+    upload = MultipartUpload(requests.Session(), f"{ipfs_api.url}/api/v0/")
+    upload.abort()
+    for _ in range(10):
+        upload.write(b"x")
+
+    assert not ipfs_api.requests
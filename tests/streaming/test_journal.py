@@ -0,0 +1,56 @@
+import pytest
+
+from offstream.streaming.journal import Journal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal_ = Journal(tmp_path / "1.jsonl")
+    journal_.reset("broadcast")
+    return journal_
+
+
+def test_load_missing_journal(tmp_path):
+    assert Journal(tmp_path / "1.jsonl").load() is None
+
+
+def test_load(journal):
+    journal.segment_pending("0.ts", 2.0)
+    journal.segment_pending("1.ts", 2.0)
+    journal.segments_uploaded("cid", [("0.ts", 2.0)])
+    journal.stream_committed(7)
+    journal.segment_pending("2.ts", 1.5)
+
+    state = journal.load()
+
+    assert state.broadcast_id == "broadcast"
+    assert state.stream_id == 7
+    assert state.uploaded == [("cid", "0.ts", 2.0)]
+    assert state.pending == [("1.ts", 2.0), ("2.ts", 1.5)]
+
+
+def test_load_skips_torn_record(journal):
+    journal.segments_uploaded("cid", [("0.ts", 2.0)])
+    with journal.path.open(mode="a") as file:
+        file.write('{"uploaded": "cid2", "segm')
+
+    assert journal.load().uploaded == [("cid", "0.ts", 2.0)]
+
+
+def test_reset_clears_spool_dir(journal):
+    (journal.spool_dir / "0.ts").write_bytes(b"x")
+    journal.segment_pending("0.ts", 2.0)
+    journal.reset("other")
+
+    state = journal.load()
+
+    assert state.broadcast_id == "other"
+    assert not state.pending
+    assert not list(journal.spool_dir.iterdir())
+
+
+def test_remove(journal):
+    journal.remove()
+
+    assert not journal.path.exists()
+    assert not journal.spool_dir.exists()
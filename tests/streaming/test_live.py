@@ -0,0 +1,88 @@
+import pytest
+
+from offstream.streaming import live
+from offstream.streaming.hls import Playlist
+from offstream.streaming.live import LiveRecording
+from offstream.streaming.spool import Spool
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(budget=1 << 20, spill_dir=tmp_path)
+
+
+@pytest.fixture
+def recording():
+    playlist = Playlist()
+    playlist.append("https://cid.ipfs.test/0.ts", 2.0)
+    return LiveRecording(playlist)
+
+
+def _spool_segment(spool, name, data):
+    file = spool.create(name)
+    file.write(data)
+    file.close()
+    return file
+
+
+def test_render_lists_pending_segments_after_playlist(recording, spool):
+    recording.add("1.ts", 2.0, _spool_segment(spool, "1.ts", b"x"))
+    m3u8 = recording.render()
+
+    assert b"#EXT-X-PLAYLIST-TYPE:EVENT\n" in m3u8
+    assert b"#EXT-X-ENDLIST" not in m3u8
+    assert m3u8.endswith(b"https://cid.ipfs.test/0.ts\n#EXTINF:2.000,\n1.ts\n")
+    assert recording.read("1.ts") == b"x"
+
+
+def test_commit_moves_segments_to_playlist(recording, spool):
+    recording.add("1.ts", 2.0, _spool_segment(spool, "1.ts", b"x"))
+    recording.render()
+    recording.commit([("1.ts", "https://cid.ipfs.test/1.ts", 2.0)])
+
+    assert recording.render().endswith(b"\nhttps://cid.ipfs.test/1.ts\n")
+    assert recording.read("1.ts") is None
+    assert recording.url("1.ts") == "https://cid.ipfs.test/1.ts"
+
+
+def test_render_only_adds_new_segments(recording, spool, monkeypatch):
+    recording.render()
+    recording.commit([("1.ts", "https://cid.ipfs.test/1.ts", 2.0)])
+    recording.add("2.ts", 5.0, _spool_segment(spool, "2.ts", b"x"))
+    appended = []
+    append = Playlist.append
+    monkeypatch.setattr(
+        Playlist,
+        "append",
+        lambda self, *args: appended.append(args[0]) or append(self, *args),
+    )
+
+    m3u8 = recording.render()
+
+    assert appended == ["https://cid.ipfs.test/1.ts", "2.ts"]
+    assert b"#EXT-X-TARGETDURATION:5\n" in m3u8
+    assert m3u8.endswith(
+        b"https://cid.ipfs.test/0.ts\n#EXTINF:2.000,\nhttps://cid.ipfs.test/1.ts\n"
+        b"#EXTINF:5.000,\n2.ts\n"
+    )
+
+
+def test_discard(recording, spool):
+    recording.add("1.ts", 2.0, _spool_segment(spool, "1.ts", b"x"))
+    recording.discard(["1.ts"])
+
+    assert recording.read("1.ts") is None
+    assert recording.url("1.ts") is None
+    assert recording.render().endswith(b"https://cid.ipfs.test/0.ts\n")
+
+
+def test_publish(recording):
+    live.publish("x", recording)
+    try:
+        assert live.find("x") is recording
+        live.unpublish("x", LiveRecording(Playlist()))
+        assert live.find("x") is recording
+    finally:
+        live.unpublish("x", recording)
+
+    assert live.find("x") is None
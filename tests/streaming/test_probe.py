@@ -0,0 +1,99 @@
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+import pytest
+from requests.exceptions import HTTPError
+
+from offstream.streaming.probe import Prober, TwitchProber
+
+
+@pytest.fixture
+def gql_server():
+    class _Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers["content-length"])
+            queries = json.loads(self.rfile.read(length))
+            requests.append(queries)
+            if server.status != 200:
+                self.send_error(server.status)
+                return
+            results = []
+            for query in queries:
+                name = query["variables"]["channelLogin"]
+                if name in server.errors:
+                    results.append({"errors": [{"message": server.errors[name]}]})
+                    continue
+                stream = {"type": server.live[name]} if name in server.live else None
+                results.append({"data": {"user": {"stream": stream}}})
+            body = json.dumps(results).encode()
+            self.send_response(200)
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_args):
+            pass
+
+    requests = []
+    server = HTTPServer(("127.0.0.1", 0), _Handler)
+    server.errors = {}
+    server.live = {}
+    server.requests = requests
+    server.status = 200
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+@pytest.fixture
+def prober(gql_server):
+    host, port = gql_server.server_address
+    prober_ = TwitchProber(url=f"http://{host}:{port}/gql")
+    yield prober_
+    prober_.close()
+
+
+def test_probe(prober, gql_server):
+    gql_server.live = {"a": "live", "c": "rerun"}
+
+    assert prober.probe(["a", "b", "c"]) == {"a"}
+    assert len(gql_server.requests) == 1
+
+
+def test_probe_in_batches(prober, gql_server):
+    names = [f"s{i}" for i in range(TwitchProber.batch_size + 1)]
+    gql_server.live = {names[-1]: "live"}
+
+    assert prober.probe(names) == {names[-1]}
+    assert [len(batch) for batch in gql_server.requests] == [
+        TwitchProber.batch_size,
+        1,
+    ]
+
+
+def test_probe_with_server_error(prober, gql_server):
+    gql_server.status = 500
+
+    with pytest.raises(HTTPError):
+        prober.probe(["a"])
+
+
+def test_probe_with_gql_error(prober, gql_server):
+    gql_server.live = {"a": "live"}
+    gql_server.errors = {"b": "PersistedQueryNotFound"}
+
+    with pytest.raises(ValueError, match="PersistedQueryNotFound"):
+        prober.probe(["a", "b"])
+
+
+def test_probe_of_unknown_channel(prober, gql_server):
+    assert prober.probe(["nobody"]) == set()
+
+
+def test_prober_is_abstract():
+    with pytest.raises(TypeError):
+        Prober()
@@ -1,15 +1,22 @@
-from concurrent.futures import Future
-from unittest.mock import MagicMock, create_autospec, patch
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Thread
+from unittest.mock import ANY, MagicMock, create_autospec, patch
 
 import pytest
+from requests.exceptions import RequestException
 from requests.models import Response
-from sqlalchemy import select
+from sqlalchemy import event, select
 from streamlink.exceptions import PluginError
 from streamlink.plugins.twitch import Twitch, TwitchHLSStream, TwitchHLSStreamReader
 from streamlink.stream.hls import Sequence
 
 from offstream import db
-from offstream.streaming import Recorder
+from offstream.streaming import Recorder, live, tracing
+from offstream.streaming.budget import MemoryBudget
+from offstream.streaming.ipfs import IPFSPool
+from offstream.streaming.journal import Journal
+from offstream.streaming.recorder import _Segment, _Worker
+from offstream.streaming.writer import DBWriter
 
 
 @pytest.fixture(autouse=True, scope="module")
@@ -20,11 +27,30 @@ def inline_thread_pool_executor():
         future.set_result(result)
         return future
 
-    with patch("offstream.streaming.recorder.ThreadPoolExecutor", autospec=True) as tpe:
+    with patch(
+        "offstream.streaming.recorder.ThreadPoolExecutor", autospec=True
+    ) as tpe, patch(
+        "offstream.streaming.writer.ThreadPoolExecutor", autospec=True
+    ) as wtpe:
         tpe.return_value.submit.side_effect = _execute_inline
+        wtpe.return_value.submit.side_effect = _execute_inline
         yield
 
 
+@pytest.fixture
+def writer():
+    writer_ = DBWriter()
+    yield writer_
+    writer_.close()
+
+
+@pytest.fixture(autouse=True)
+def probe():
+    with patch("offstream.streaming.recorder.TwitchProber", autospec=True) as prober:
+        prober.return_value.probe.side_effect = set
+        yield prober.return_value.probe
+
+
 @pytest.fixture(scope="module")
 def ipfs_add():
     def _ipfs_add(*files, wrap_with_directory=False, **_kwargs):
@@ -32,7 +58,7 @@ def ipfs_add():
         return [res] * num if num > 1 else res
 
     res = {"Hash": "fakecid", "Name": ""}
-    with patch("offstream.streaming.recorder.ipfshttpclient") as ipfshttpclient:
+    with patch("offstream.streaming.ipfs.ipfshttpclient") as ipfshttpclient:
         ipfshttpclient.connect.return_value.add.side_effect = _ipfs_add
         yield res
 
@@ -45,7 +71,9 @@ def twitch():
         response = create_autospec(Response, instance=True, spec_set=True)
         response.iter_content.return_value = [b"x"]
         reader = MagicMock()
-        reader.read.side_effect = lambda *args: reader.writer._write(sequence, response)
+        reader.writer.join.side_effect = lambda *args: reader.writer._write(
+            sequence, response
+        )
         stream = create_autospec(TwitchHLSStream, instance=True)
         stream.open.return_value.__enter__.return_value = reader
         twitch_class = create_autospec(Twitch, spec_set=True)
@@ -65,13 +93,314 @@ def test_start_with_one_streamer(streamer, twitch, ipfs_add):
 
     assert stream.url.startswith("https://")
     assert ipfs_add["Hash"] in stream.url
+    assert [segment.duration for segment in stream.segments] == [1.0]
+    assert live.find(streamer.name) is None
     assert stream.title == twitch.get_title()
     assert stream.category == twitch.get_category()
+    reader = twitch.streams()["best"].open().__enter__()
+    reader.buffer.write.assert_not_called()
+    reader.read.assert_not_called()
+
+
+def test_start_removes_journal_of_finished_stream(
+    streamer, twitch, ipfs_add, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(_Worker, "journal_dir", str(tmp_path))
+    twitch.get_id.return_value = "broadcast"
+
+    recorder = Recorder()
+    recorder.start(_loop=False)
+
+    assert streamer.streams
+    assert not list(tmp_path.iterdir())
+
+
+def test_start_acquires_resources_on_first_segment(streamer, twitch, ipfs_add):
+    recorder = Recorder()
+    before = recorder.worker_stats
+    recorder.start(_loop=False)
+    after = recorder.worker_stats
+
+    for key in ("created", "used", "workdirs"):
+        assert after[key] == before.get(key, 0) + 1
+
+
+def test_start_traces_segments(streamer, twitch, ipfs_add):
+    records = []
+    tracing.add_sink(records.append)
+    try:
+        Recorder().start(_loop=False)
+    finally:
+        tracing.remove_sink(records.append)
+
+    spans = {record["span"]: record for record in records}
+    assert spans.keys() == {
+        "segment",
+        "flush",
+        "flush_wait",
+        "upload",
+        "playlist",
+        "commit",
+    }
+    segment = spans["segment"]["segment"]
+    assert spans["flush"]["segments"] == [segment]
+    assert spans["upload"]["flush"] == spans["flush"]["flush"]
+    assert spans["commit"]["flush"] == spans["flush"]["flush"]
+
+
+def test_segments_wait_for_setup(streamer, twitch, ipfs_add):
+    reader = twitch.streams()["best"].open().__enter__()
+    # The writer thread delivers a segment while the recording is set up.
+    early = Thread(target=reader.writer.join.side_effect)
+    blocked = []
+    load_journal = _Worker._load_journal
+
+    def _load_journal(self, broadcast_id):
+        early.start()
+        early.join(timeout=0.1)
+        blocked.append(early.is_alive())
+        return load_journal(self, broadcast_id)
+
+    with patch.object(_Worker, "_load_journal", _load_journal), patch.object(
+        reader.writer, "join", side_effect=lambda *_args: early.join()
+    ):
+        Recorder().start(_loop=False)
+
+    assert blocked == [True]
+    assert [segment.duration for segment in streamer.streams[0].segments] == [1.0]
+
+
+def test_uploads_are_committed_in_order(streamer):
+    writer = MagicMock()
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    worker._stream = db.Stream(streamer_id=streamer.id)
+    uploads = [Future() for _ in range(3)]
+    for _ in uploads:
+        worker._pending_uploads.acquire()
+    committed = []
+    with patch.object(worker, "_append_playlist") as append_playlist:
+        append_playlist.side_effect = lambda cid, _segments: committed.append(cid)
+        for flush_num in (2, 1, 0):
+            uploads[flush_num].set_result(f"cid{flush_num}")
+            worker._upload_complete(flush_num, [], uploads[flush_num])
+
+    assert committed == ["cid0", "cid1", "cid2"]
+    assert writer.submit.call_count == 3
+
+
+def test_commit_saves_new_segments(streamer, session, writer):
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    worker._stream = db.Stream(streamer_id=streamer.id)
+    worker._append_playlist("cid", [_Segment("0.ts", 1, 1.0)])
+    worker._commit()
+    worker._append_playlist("cid", [_Segment("1.ts", 1, 2.0)])
+    worker._commit()
+
+    rows = session.execute(db.stream_segments(worker._stream_id)).all()
+    assert [(url, duration) for _, url, duration in rows] == [
+        (worker._ipfs_url("cid", path="0.ts"), 1.0),
+        (worker._ipfs_url("cid", path="1.ts"), 2.0),
+    ]
+    assert worker._stream.url == ""
+
+
+def test_journal_committed_reads_no_orm_state(streamer, tmp_path, writer):
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    worker.journal_dir = str(tmp_path)
+    worker._load_journal("broadcast")
+    worker._stream = db.Stream(streamer_id=streamer.id)
+    worker._commit()
+    # A rollback in the writer expires every object in its session.
+    writer.submit(lambda session: session.rollback()).result()
+
+    with patch.object(db.Stream, "id", property(lambda self: pytest.fail())):
+        worker._journal_committed()
+
+    assert worker._journal.load().stream_id == worker._stream_id
+
+
+def test_flush_waits_for_pending_uploads(streamer, writer):
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    worker.__dict__["_executor"] = MagicMock()
+    worker._pending_uploads = MagicMock()
+    worker._pending_uploads.acquire.side_effect = [False, False, True]
+    worker._flush()
+
+    assert worker._pending_uploads.acquire.call_count == 3
+    worker._executor.submit.assert_called_once()
+
+    worker._pending_uploads.acquire.side_effect = None
+    worker._pending_uploads.acquire.return_value = False
+    worker._closed = True
+    worker._flush()
+
+    worker._executor.submit.assert_called_once()
+
+
+def test_flush_while_closing_keeps_segments(streamer, tmp_path, writer):
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    worker.journal_dir = str(tmp_path)
+    worker.spool_memory = str(10**7)
+    worker._load_journal("broadcast")
+    segment = worker._spool_segment("0.ts", [b"\x47"], 1.0)
+    worker._append_segment(segment)
+    worker._pending_uploads = MagicMock()
+    worker._pending_uploads.acquire.return_value = False
+
+    with worker:
+        worker.close()
+        worker._flush()
+
+    assert worker._journal.load().pending == [("0.ts", 1.0)]
+    assert (worker._journal.spool_dir / "0.ts").read_bytes() == b"\x47"
+
+
+def test_flush_threshold_follows_budget_share(streamer, writer):
+    budget = MemoryBudget(10**6)
+    worker = _Worker(MagicMock(), streamer, MagicMock(), budget, writer)
+    worker.flush_threshold = None
+    budget.update("other", size=300_000, duration=1.0)
+    with patch.object(worker, "_flush") as flush:
+        worker._append_segment(_Segment("0.ts", 100_000, 1.0))
+
+        assert worker._flush_threshold == 125_000
+        flush.assert_not_called()
+
+        worker._append_segment(_Segment("1.ts", 100_000, 1.0))
+
+        flush.assert_called_once()
+
+
+def test_flush_after_max_interval(streamer, writer):
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    with patch.object(worker, "_flush") as flush, patch("time.monotonic") as clock:
+        clock.return_value = 0
+        worker._append_segment(_Segment("0.ts", 1, 1.0))
+        clock.return_value = worker.max_flush_interval - 1
+        worker._append_segment(_Segment("1.ts", 1, 1.0))
+
+        flush.assert_not_called()
+
+        clock.return_value = worker.max_flush_interval
+        worker._append_segment(_Segment("2.ts", 1, 1.0))
+
+        flush.assert_called_once()
+
+
+def test_resume_from_journal(streamer, stream, session, tmp_path, writer):
+    journal = Journal(tmp_path / f"{streamer.id}.jsonl")
+    journal.reset("broadcast")
+    journal.segments_uploaded("cid", [("7.ts", 2.0), ("8.ts", 2.0)])
+    journal.stream_committed(stream.id)
+    (journal.spool_dir / "9.ts").write_bytes(b"\x47" * 188)
+    journal.segment_pending("9.ts", 2.0)
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    worker.journal_dir = str(tmp_path)
+
+    state = worker._load_journal("broadcast")
+    resumed = worker._journaled_stream(state, "title", "category")
+    worker._replay(state)
+
+    assert resumed.id == stream.id
+    assert resumed.url == ""
+    assert worker._playlist.segment_count == 2
+    assert worker._resume_after == 9
+    (segment,) = worker._dirty_segments
+    assert segment.name == "9.ts"
+    assert b"".join(segment.file.chunks()) == b"\x47" * 188
+
+
+def test_resume_in_stream_mode_flushes_pending(streamer, tmp_path, writer):
+    journal = Journal(tmp_path / f"{streamer.id}.jsonl")
+    journal.reset("broadcast")
+    (journal.spool_dir / "9.ts").write_bytes(b"\x47" * 188)
+    journal.segment_pending("9.ts", 2.0)
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    worker.journal_dir = str(tmp_path)
+    worker.upload_mode = "stream"
+
+    with patch.object(
+        worker, "_upload_segments", return_value="cid"
+    ) as upload_segments, patch.object(worker, "_append_playlist"), patch.object(
+        worker, "_commit"
+    ):
+        worker._replay(worker._load_journal("broadcast"))
+
+    (segments, _flush_num), _ = upload_segments.call_args
+    assert [segment.name for segment in segments] == ["9.ts"]
+    assert not worker._dirty_segments
+    assert worker._upload is None
+
+
+def test_journal_of_other_broadcast_is_reset(streamer, tmp_path, writer):
+    journal = Journal(tmp_path / f"{streamer.id}.jsonl")
+    journal.reset("broadcast")
+    journal.segments_uploaded("cid", [("7.ts", 2.0)])
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    worker.journal_dir = str(tmp_path)
+
+    assert worker._load_journal("other") is None
+    assert journal.load().broadcast_id == "other"
+    assert not journal.load().uploaded
+
+
+def test_streaming_upload(streamer, ipfs_api):
+    worker = _Worker(
+        MagicMock(),
+        streamer,
+        IPFSPool(ipfs_api.multiaddr, size=1),
+        MemoryBudget(10**6),
+        MagicMock(),
+    )
+    worker.upload_mode = "stream"
+    worker._stream = db.Stream(streamer_id=streamer.id)
+    worker.__dict__["_executor"] = ThreadPoolExecutor(max_workers=1)
+    with patch.object(worker, "_append_playlist") as append_playlist:
+        for num in range(2):
+            segment = worker._stream_segment(f"{num}.ts", [b"\x47" * 188], 1.0)
+            worker._append_segment(segment)
+        worker._flush()
+        worker._executor.shutdown()
+
+    segments = append_playlist.call_args.args[1]
+    append_playlist.assert_called_once_with("dircid", segments)
+    assert [segment.name for segment in segments] == ["0.ts", "1.ts"]
+    ((_path, body),) = ipfs_api.requests
+    assert body.count(b"\x47" * 188) == 2
+
+
+def test_start_with_probe_error(streamer, twitch, probe, ipfs_add):
+    probe.side_effect = RequestException("testing")
+
+    recorder = Recorder()
+    with patch.object(recorder._scheduler, "checked") as checked:
+        recorder.start(_loop=False)
+
+    assert streamer.streams
+    checked.assert_called_once_with(streamer.id, ANY, live=None)
+
+
+def test_start_with_offline_streamer(streamer, twitch, probe, session):
+    probe.side_effect = None
+    probe.return_value = set()
+    twitch.streams.reset_mock()
+
+    recorder = Recorder()
+    recorder.start(_loop=False)
+
+    probe.assert_called_once_with([streamer.name])
+    twitch.streams.assert_not_called()
+    assert not session.scalars(select(db.Stream)).all()
 
 
 def test_start_with_abrupt_end(streamer, twitch, session):
     reader = twitch.streams()["best"].open().__enter__()
-    reader.read.side_effect = OSError("testing")
+    sequence = create_autospec(Sequence, instance=True, spec_set=True)
+    response = create_autospec(Response, instance=True, spec_set=True)
+    response.iter_content.side_effect = RequestException("testing")
+    reader.writer.join.side_effect = lambda *args: reader.writer._write(
+        sequence, response
+    )
 
     recorder = Recorder()
     recorder.start(_loop=False)
@@ -121,3 +450,117 @@ def test_start_after_close(streamer):
     recorder.start()
 
     assert not streamer.streams
+
+
+def test_start_with_offline_stream_acquires_nothing(streamer, twitch):
+    twitch.streams.return_value = {}
+
+    recorder = Recorder()
+    before = recorder.worker_stats
+    recorder.start(_loop=False)
+    after = recorder.worker_stats
+
+    assert after["created"] == before["created"] + 1
+    for key in ("used", "workdirs", "executors"):
+        assert after.get(key) == before.get(key)
+
+
+def test_update_streamers_applies_changes(streamer, session):
+    recorder = Recorder()
+    recorder._update_streamers(0)
+    other = db.Streamer(name="other")
+    session.add(other)
+    session.delete(streamer)
+    session.commit()
+    worker = MagicMock()
+    recorder._recording[streamer.id] = worker
+
+    recorder._update_streamers(0)
+
+    assert list(recorder._streamers) == [other.id]
+    assert list(recorder._scheduler.keys()) == [other.id]
+    worker.discard.assert_called_once()
+
+
+def test_update_streamers_without_changes_runs_one_query(streamer):
+    recorder = Recorder()
+    recorder._update_streamers(0)
+    statements = []
+
+    def _listener(_connection, _cursor, statement, *_args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", _listener)
+    try:
+        recorder._update_streamers(0)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _listener)
+
+    assert len(statements) == 1
+    assert "streamer_changes" in statements[0]
+    assert list(recorder._streamers) == [streamer.id]
+
+
+def test_update_streamers_applies_late_changes(streamer, session):
+    recorder = Recorder()
+    recorder._update_streamers(0)
+    late = db.Streamer(name="late")
+    session.add(late)
+    session.commit()
+    # The change of "late" is committed after the one of "other".
+    late_change = session.scalars(select(db.StreamerChange)).all()[-1]
+    late_change_id = late_change.id
+    session.delete(late_change)
+    other = db.Streamer(name="other")
+    session.add(other)
+    session.commit()
+
+    recorder._update_streamers(0)
+
+    assert late.id not in recorder._streamers
+    assert other.id in recorder._streamers
+
+    session.add(db.StreamerChange(id=late_change_id, streamer_id=late.id))
+    session.commit()
+    recorder._update_streamers(0)
+
+    assert late.id in recorder._streamers
+
+
+def test_update_streamers_prunes_changes(streamer, session):
+    recorder = Recorder()
+    recorder.change_window = 1
+    recorder._update_streamers(0)
+    session.add_all([db.Streamer(name="other"), db.Streamer(name="third")])
+    session.commit()
+
+    recorder._update_streamers(0)
+
+    changes = session.scalars(select(db.StreamerChange.id)).all()
+    assert changes == [recorder._change_id]
+
+
+def test_record_deleted_streamer(streamer):
+    recorder = Recorder()
+    recorder._update_streamers(0)
+    recorder._recording[streamer.id] = None
+    del recorder._streamers[streamer.id]
+
+    with patch.object(_Worker, "start") as start:
+        recorder._record_streamer(streamer)
+
+    start.assert_not_called()
+    assert not recorder._recording
+
+
+def test_discard_removes_journal(streamer, tmp_path, writer):
+    worker = _Worker(MagicMock(), streamer, MagicMock(), MemoryBudget(10**6), writer)
+    worker.journal_dir = str(tmp_path)
+    worker._load_journal("broadcast")
+    (worker._journal.spool_dir / "0.ts").write_bytes(b"\x47")
+    worker._append_segment(_Segment("0.ts", 1, 1.0, worker._spool.restore("0.ts")))
+
+    with worker:
+        worker.discard()
+
+    assert not list(tmp_path.iterdir())
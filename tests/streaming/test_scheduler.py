@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from offstream.streaming.scheduler import Scheduler
+
+# Thursday, 00:00 UTC
+MIDNIGHT = datetime(2021, 1, 7, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.fixture
+def scheduler():
+    return Scheduler(interval=10, max_interval=80, jitter=0.1, rand=lambda: 0.0)
+
+
+def test_new_streamers_are_due_immediately(scheduler):
+    scheduler.add(1, MIDNIGHT)
+    scheduler.add(2, MIDNIGHT + 5)
+
+    assert scheduler.next_due() == MIDNIGHT
+    assert scheduler.due(MIDNIGHT) == [1]
+    assert scheduler.due(MIDNIGHT + 5) == [2]
+    assert scheduler.next_due() is None
+
+
+def test_offline_backoff(scheduler):
+    scheduler.add(1, MIDNIGHT)
+    delays = []
+    now = MIDNIGHT
+    for _ in range(6):
+        due = scheduler.checked(1, now, live=False)
+        delays.append(due - now)
+        now = due
+
+    assert delays == [10, 20, 40, 80, 80, 80]
+
+
+def test_live_resets_backoff(scheduler):
+    scheduler.add(1, MIDNIGHT)
+    for _ in range(3):
+        scheduler.checked(1, MIDNIGHT, live=False)
+
+    assert scheduler.checked(1, MIDNIGHT, live=True) == MIDNIGHT + 10
+
+
+def test_unknown_status_keeps_backoff_and_hours(scheduler):
+    scheduler.add(1, MIDNIGHT)
+    for _ in range(3):
+        scheduler.checked(1, MIDNIGHT, live=False)
+
+    assert scheduler.checked(1, MIDNIGHT, live=None) == MIDNIGHT + 40
+    assert scheduler.checked(1, MIDNIGHT + 3600, live=False) == MIDNIGHT + 3680
+
+
+def test_usual_go_live_hours(scheduler):
+    scheduler.add(1, MIDNIGHT, hours=[2])
+    now = MIDNIGHT
+    for _ in range(5):
+        now = scheduler.checked(1, now, live=False)
+
+    assert scheduler.checked(1, MIDNIGHT + 3600, live=False) == MIDNIGHT + 3610
+
+
+def test_jitter():
+    scheduler = Scheduler(interval=10, max_interval=10, jitter=0.5, rand=lambda: 1.0)
+    scheduler.add(1, MIDNIGHT)
+
+    assert scheduler.checked(1, MIDNIGHT, live=True) == MIDNIGHT + 15
+
+
+def test_rescheduled_and_removed_entries_are_skipped(scheduler):
+    scheduler.add(1, MIDNIGHT)
+    scheduler.add(2, MIDNIGHT)
+    scheduler.checked(1, MIDNIGHT, live=True)
+    scheduler.remove(2)
+
+    assert 2 not in scheduler
+    assert scheduler.due(MIDNIGHT) == []
+    assert scheduler.due(MIDNIGHT + 10) == [1]
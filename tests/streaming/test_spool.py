@@ -0,0 +1,97 @@
+import pytest
+
+from offstream.streaming.spool import Spool
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    monkeypatch.setattr(Spool, "page_size", 4)
+    return Spool(budget=8, spill_dir=tmp_path)
+
+
+def test_write_within_budget(spool, tmp_path):
+    file = spool.create("0.ts")
+    file.write(b"abc")
+    file.write(b"defg")
+
+    assert file.size == 7
+    assert not file.spilled
+    assert not list(tmp_path.iterdir())
+    assert spool.memory_size == 8
+    assert b"".join(file.chunks(size=3)) == b"abcdefg"
+
+
+def test_write_beyond_budget_spills(spool, tmp_path):
+    first = spool.create("0.ts")
+    first.write(b"abcde")
+    second = spool.create("1.ts")
+    second.write(b"fghij")
+    second.close()
+
+    assert not first.spilled
+    assert second.spilled
+    assert spool.spilled == 1
+    assert (tmp_path / "1.ts").read_bytes() == b"fghij"
+    assert b"".join(second.chunks()) == b"fghij"
+
+
+def test_persist_keeps_contents(spool, tmp_path):
+    file = spool.create("0.ts")
+    file.write(b"abcde")
+
+    assert file.persist()
+    assert spool.memory_size == 0
+    assert (tmp_path / "0.ts").read_bytes() == b"abcde"
+
+
+def test_release_reuses_pages(spool, tmp_path):
+    first = spool.create("0.ts")
+    first.write(b"abcdefgh")
+    pages = list(first._pages)
+    first.release()
+    second = spool.create("1.ts")
+    second.write(b"ijklmnop")
+
+    assert spool.memory_size == 8
+    assert not second.spilled
+    assert all(a is b for a, b in zip(second._pages, reversed(pages)))
+
+
+def test_lower_budget_drops_free_pages(spool):
+    first = spool.create("0.ts")
+    first.write(b"abcdefgh")
+    first.release()
+    spool.budget = 4
+
+    assert len(spool._free) == 1
+
+    second = spool.create("1.ts")
+    second.write(b"ijkl")
+    spool.budget = 0
+
+    assert not spool._free
+
+    second.release()
+
+    assert not spool._free
+
+
+def test_release_removes_spilled_file(spool, tmp_path):
+    file = spool.create("0.ts")
+    file.write(b"x" * 9)
+    file.release()
+
+    assert spool.memory_size == 0
+    assert not list(tmp_path.iterdir())
+
+
+def test_reader(spool):
+    file = spool.create("0.ts")
+    file.write(b"abcdefg")
+    reader = file.reader()
+
+    assert reader.name == "0.ts"
+    assert reader.read(3) == b"abc"
+    assert reader.read(3) == b"d"
+    assert reader.read() == b"efg"
+    assert reader.read(3) == b""
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from offstream.streaming import tracing
+
+
+@pytest.fixture
+def records():
+    records_ = []
+    tracing.add_sink(records_.append)
+    yield records_
+    tracing.remove_sink(records_.append)
+
+
+def test_span_without_sinks():
+    with tracing.span("segment", segment="0.ts") as span:
+        with span.timer("write_seconds"):
+            span.set(size=1)
+
+    assert span is tracing.NO_SPAN
+    assert not tracing.enabled()
+
+
+def test_span(records):
+    with tracing.span("segment", segment="0.ts") as span:
+        for _ in range(2):
+            with span.timer("write_seconds"):
+                pass
+        span.set(size=1)
+
+    (record,) = records
+    assert record["span"] == "segment"
+    assert record["segment"] == "0.ts"
+    assert record["size"] == 1
+    assert record["start"] > 0
+    assert 0 <= record["write_seconds"] <= record["seconds"]
+
+
+def test_span_with_error(records):
+    with pytest.raises(ValueError):
+        with tracing.span("upload", flush=0):
+            raise ValueError("testing")
+
+    assert records[0]["error"] == "ValueError"
+
+
+def test_jsonl_sink(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    sink = tracing.JSONLSink(path)
+    tracing.add_sink(sink)
+    try:
+        with tracing.span("flush", flush=0, segments=["0.ts"]):
+            pass
+        with tracing.span("commit", flush=0):
+            pass
+    finally:
+        tracing.remove_sink(sink)
+        sink.close()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["span"] for line in lines] == ["flush", "commit"]
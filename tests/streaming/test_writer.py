@@ -0,0 +1,69 @@
+from threading import Event
+
+import pytest
+from sqlalchemy import text
+
+from offstream.streaming.writer import DBWriter
+
+
+@pytest.fixture
+def writer():
+    writer_ = DBWriter()
+    yield writer_
+    writer_.close()
+
+
+def _select(value):
+    return lambda session: session.scalar(text(f"SELECT {value}"))
+
+
+def test_changes_are_committed_in_batches(writer):
+    started, release = Event(), Event()
+
+    def _blocking(session):
+        started.set()
+        release.wait(timeout=5)
+        return 0
+
+    first = writer.submit(_blocking)
+    started.wait(timeout=5)
+    futures = [writer.submit(_select(num)) for num in range(1, 4)]
+    release.set()
+
+    assert first.result(timeout=5) == 0
+    assert [future.result(timeout=5) for future in futures] == [1, 2, 3]
+    stats = writer.stats
+    assert stats["commits"] == 2
+    assert stats["changes"] == 4
+    assert stats["max_batch_size"] == 3
+    assert stats["max_commit_time"] > 0
+
+
+def test_failed_change_does_not_fail_others(writer, monkeypatch):
+    monkeypatch.setattr(writer, "max_batch_size", 2)
+    started, release = Event(), Event()
+
+    def _blocking(session):
+        started.set()
+        release.wait(timeout=5)
+
+    def _failing(session):
+        raise ValueError("testing")
+
+    writer.submit(_blocking)
+    started.wait(timeout=5)
+    failing = writer.submit(_failing)
+    ok = writer.submit(_select(1))
+    release.set()
+
+    with pytest.raises(ValueError):
+        failing.result(timeout=5)
+    assert ok.result(timeout=5) == 1
+    assert writer.stats["failed"] == 2
+
+
+def test_submit_after_close(writer):
+    writer.close()
+
+    with pytest.raises(RuntimeError):
+        writer.submit(_select(1))
@@ -1,7 +1,25 @@
+import datetime as dt
+import html
+import re
+from unittest.mock import patch
+
 import pytest
-from sqlalchemy import inspect
+from sqlalchemy import event, inspect, select
+from werkzeug.security import generate_password_hash
 
+from offstream import app as app_module
 from offstream import db
+from offstream.streaming import live
+from offstream.streaming.hls import Playlist
+from offstream.streaming.live import LiveRecording
+from offstream.streaming.spool import Spool
+
+
+@pytest.fixture(autouse=True)
+def caches():
+    # The tables are dropped after every test, which does not invalidate them.
+    app_module._feeds.invalidate()
+    app_module._credentials.invalidate()
 
 
 def test_root(client):
@@ -11,6 +29,20 @@ def test_root(client):
     assert response.json["status"] == "ok"
 
 
+def test_metrics(client):
+    client.get("/")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert 'endpoint="root",method="GET",status="200"' not in text
+    assert 'method="GET",endpoint="root",status="200",le="+Inf"' in text
+    assert "# TYPE offstream_flush_seconds histogram" in text
+    assert "offstream_pending_flushes" in text
+
+
 def test_not_found(client):
     response = client.get("/x")
 
@@ -36,6 +68,122 @@ def test_latest_stream(client, stream):
     assert response.json["url"] == response.location
 
 
+def test_latest_stream_follows_pointer(client, stream, session):
+    newer = db.Stream(url="https://example.org/newer", streamer=stream.streamer)
+    session.add(newer)
+    session.commit()
+
+    assert session.get(db.LatestStream, stream.streamer.id).stream_id == newer.id
+    assert client.get("/latest/X").location == newer.url
+
+
+def test_latest_stream_without_pointer(client, stream, session):
+    session.delete(session.get(db.LatestStream, stream.streamer.id))
+    session.commit()
+
+    response = client.get(f"/latest/{stream.streamer.name}")
+
+    assert response.status_code == 302
+    assert response.location == stream.url
+
+
+def test_latest_stream_substring_match_is_opt_in(client, stream, session):
+    stream.streamer.name = "abc"
+    session.commit()
+
+    assert client.get("/latest/b").status_code == 404
+    assert client.get("/latest/b?match=contains").location == stream.url
+    assert client.get("/latest/b?match=x").status_code == 400
+
+
+def test_latest_stream_in_progress(client, stream, session):
+    stream.url = ""
+    session.commit()
+
+    response = client.get(f"/latest/{stream.streamer.name}")
+
+    assert response.status_code == 302
+    assert response.location == (f"http://localhost/streams/{stream.id}/playlist.m3u8")
+
+
+def test_stream_playlist(client, stream, session):
+    stream.url = ""
+    session.add(db.Segment(stream=stream, url="https://cid.ipfs.test/0.ts", duration=2))
+    session.commit()
+
+    response = client.get(f"/streams/{stream.id}/playlist.m3u8")
+
+    assert response.status_code == 200
+    assert response.content_type == "application/vnd.apple.mpegurl"
+    assert response.cache_control.no_cache
+    assert response.data.endswith(b"#EXTINF:2.000,\nhttps://cid.ipfs.test/0.ts\n")
+
+    session.add(db.Segment(stream=stream, url="https://cid.ipfs.test/1.ts", duration=2))
+    session.commit()
+    response = client.get(f"/streams/{stream.id}/playlist.m3u8")
+
+    assert response.data.count(b"#EXTINF") == 2
+    assert response.data.endswith(b"https://cid.ipfs.test/1.ts\n")
+
+
+def test_finished_stream_playlist(client, stream):
+    response = client.get(f"/streams/{stream.id}/playlist.m3u8")
+
+    assert response.status_code == 200
+    assert response.cache_control.public
+    assert response.cache_control.max_age
+
+
+def test_stream_playlist_not_found(client):
+    response = client.get("/streams/1/playlist.m3u8")
+
+    assert response.status_code == 404
+    assert response.json["error"]["description"] == "Stream not found"
+
+
+@pytest.fixture
+def live_recording(tmp_path):
+    playlist = Playlist()
+    playlist.append("https://cid.ipfs.test/0.ts", 2.0)
+    recording = LiveRecording(playlist)
+    file = Spool(budget=1 << 20, spill_dir=tmp_path).create("1.ts")
+    file.write(b"\x47" * 188)
+    recording.add("1.ts", 2.0, file)
+    live.publish("x", recording)
+    yield recording
+    live.unpublish("x", recording)
+
+
+def test_live_playlist(client, live_recording):
+    response = client.get("/live/X/playlist.m3u8")
+
+    assert response.status_code == 200
+    assert response.content_type == "application/vnd.apple.mpegurl"
+    assert response.cache_control.no_cache
+    assert b"#EXT-X-PLAYLIST-TYPE:EVENT" in response.data
+    assert response.data.endswith(b"\n1.ts\n")
+
+    response = client.get("/live/x/1.ts")
+
+    assert response.status_code == 200
+    assert response.content_type == "video/mp2t"
+    assert response.data == b"\x47" * 188
+
+
+def test_live_segment_that_has_been_flushed(client, live_recording):
+    live_recording.commit([("1.ts", "https://cid.ipfs.test/1.ts", 2.0)])
+
+    response = client.get("/live/x/1.ts")
+
+    assert response.status_code == 302
+    assert response.location == "https://cid.ipfs.test/1.ts"
+
+
+def test_live_not_recording(client):
+    assert client.get("/live/x/playlist.m3u8").status_code == 404
+    assert client.get("/live/x/1.ts").status_code == 404
+
+
 def test_latest_stream_for_non_existent_streamer(client):
     response = client.get("/latest/nonexistent")
 
@@ -102,6 +250,29 @@ def test_delete_streamer(client, stream, session, auth):
     assert response.json["url"] == streamer.url
 
 
+def test_delete_streamer_deletes_segments_in_bulk(client, stream, session, auth):
+    session.add_all(
+        db.Segment(stream_id=stream.id, url=f"{num}.ts", duration=1.0)
+        for num in range(3)
+    )
+    session.commit()
+    statements = []
+
+    def _listener(_connection, _cursor, statement, *_args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", _listener)
+    try:
+        response = client.delete(f"/streamers/{stream.streamer.name}", auth=auth)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _listener)
+
+    assert response.status_code == 200
+    selects = [s for s in statements if s.startswith("SELECT") and "segments" in s]
+    assert not selects
+    assert not session.scalars(select(db.Segment)).all()
+
+
 def test_delete_not_found(client, auth):
     response = client.delete("/streamers/nonexistent", auth=auth)
 
@@ -129,6 +300,30 @@ def test_update_ping_hours_with_invalid_values(client, auth, param, value):
     assert "Invalid hour" in response.json["error"]["description"]
 
 
+def test_auth_is_cached(client, auth):
+    with patch.object(
+        app_module, "check_password_hash", wraps=app_module.check_password_hash
+    ) as check:
+        for _ in range(2):
+            assert client.post("/settings", auth=auth).status_code == 200
+        assert check.call_count == 1
+
+        username, password = auth
+        wrong = (username, password + "x")
+        assert client.post("/settings", auth=wrong).status_code == 401
+        assert check.call_count == 2
+
+
+def test_auth_cache_is_invalidated_by_settings(client, auth, settings, session):
+    assert client.post("/settings", auth=auth).status_code == 200
+
+    settings_, _ = settings
+    settings_.password = generate_password_hash("changed")
+    session.commit()
+
+    assert client.post("/settings", auth=auth).status_code == 401
+
+
 @pytest.mark.parametrize(
     "endpoint",
     [
@@ -162,6 +357,33 @@ def test_rss(client, fixture, limit, request):
     assert response.data
 
 
+def test_rss_not_modified(client, stream):
+    response = client.get("/rss")
+
+    assert response.headers["etag"]
+    assert response.last_modified
+
+    response = client.get("/rss", headers={"if-none-match": response.headers["etag"]})
+
+    assert response.status_code == 304
+    assert not response.data
+
+
+def test_rss_is_cached_until_streams_change(client, stream, session):
+    with patch.object(db, "latest_streams", wraps=db.latest_streams) as query:
+        etag = client.get("/rss").headers["etag"]
+        assert client.get("/rss").headers["etag"] == etag
+        assert query.call_count == 1
+
+        stream.url = "https://example.org/finished"
+        session.commit()
+        response = client.get("/rss")
+
+        assert query.call_count == 2
+        assert response.headers["etag"] != etag
+        assert b"https://example.org/finished" in response.data
+
+
 @pytest.mark.parametrize("limit", ["", "x"])
 def test_invalid_rss_limit(client, limit):
     response = client.get("/rss", query_string={"limit": limit})
@@ -170,6 +392,93 @@ def test_invalid_rss_limit(client, limit):
     assert b"Invalid limit" in response.data
 
 
+@pytest.fixture
+def streams(streamer, session):
+    # Two of them share a creation time, pages are split by id too.
+    created = [dt.datetime(2022, 1, day) for day in (1, 2, 2, 3)]
+    streams_ = [
+        db.Stream(url=f"https://example.org/{num}", streamer=streamer, created_at=at)
+        for num, at in enumerate(created)
+    ]
+    session.add_all(streams_)
+    session.commit()
+    return [stream.id for stream in reversed(streams_)]
+
+
+def test_list_streams(client, streams):
+    response = client.get("/streams", query_string={"limit": 3})
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.content_type == "application/json"
+    assert [stream["id"] for stream in response.json["streams"]] == streams[:3]
+    assert response.json["streams"][0]["created_at"] == "2022-01-03T00:00:00"
+
+    response = client.get(response.json["next"])
+
+    assert [stream["id"] for stream in response.json["streams"]] == streams[3:]
+    assert response.json["next"] is None
+
+
+def test_list_streams_by_page(client, streams):
+    ids = []
+    url = "/streams?limit=1"
+    while url:
+        response = client.get(url)
+        ids.extend(stream["id"] for stream in response.json["streams"])
+        url = response.json["next"]
+
+    assert ids == streams
+
+
+def test_list_streams_by_name(client, streams):
+    response = client.get("/streams", query_string={"name": "nobody"})
+
+    assert response.json == {"streams": [], "next": None}
+
+
+@pytest.mark.parametrize(
+    "query, description",
+    [
+        ({"limit": "0"}, "Invalid limit"),
+        ({"limit": "1001"}, "Invalid limit"),
+        ({"before": "x"}, "Invalid cursor"),
+        ({"before": "eA=="}, "Invalid cursor"),
+    ],
+)
+def test_list_streams_with_invalid_args(client, query, description):
+    response = client.get("/streams", query_string=query)
+
+    assert response.status_code == 400
+    assert response.json["error"]["description"].startswith(description)
+
+
+def test_rss_pages(client, streams):
+    response = client.get("/rss", query_string={"limit": 2})
+
+    assert response.data.count(b"<item>") == 2
+    next_url = re.search(rb'href="([^"]+)" rel="next"', response.data)[1]
+    response = client.get(html.unescape(next_url.decode()))
+
+    assert response.data.count(b"<item>") == 2
+    assert f"offstream:{streams[-1]}".encode() in response.data
+    assert b'rel="next"' in response.data
+
+    response = client.get("/rss", query_string={"limit": 500})
+
+    assert response.status_code == 200
+    assert response.data.count(b"<item>") == len(streams)
+
+
+@pytest.mark.parametrize("limit, count", [("0", 1), ("-5", 1), ("101", 100)])
+def test_rss_limit_is_clamped(client, limit, count):
+    with patch.object(db, "latest_streams", wraps=db.latest_streams) as query:
+        response = client.get("/rss", query_string={"limit": limit})
+
+    assert response.status_code == 200
+    assert query.call_args.kwargs["limit"] == count
+
+
 def test_welcome(client):
     response = client.get("/welcome")
 
@@ -1,10 +1,15 @@
+import datetime as dt
+import json
 from unittest.mock import patch
+from urllib.request import urlopen
 
 import pytest
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, inspect, text
 
 import offstream
 from offstream import db
+from offstream.server import make_server
+from offstream.streaming import tracing
 
 
 @pytest.mark.parametrize("command", ["offstream", "offstream record"])
@@ -118,6 +123,23 @@ def test_init_db_success(runner):
     assert not result.output
 
 
+def test_init_db_upgrades_existing_database(runner, streamer, session):
+    created = [dt.datetime(2022, 1, day) for day in (1, 3, 2)]
+    session.add_all(db.Stream(streamer=streamer, created_at=at) for at in created)
+    session.commit()
+    with db.engine.begin() as connection:
+        connection.execute(db.LatestStream.__table__.delete())
+        connection.execute(text("DROP INDEX ix_streams_streamer_id_created_at"))
+
+    result = runner.invoke(args=["offstream", "init-db"])
+
+    assert result.exit_code == 0, result.output
+    indexes = inspect(db.engine).get_indexes("streams")
+    assert "ix_streams_streamer_id_created_at" in {index["name"] for index in indexes}
+    latest = session.scalars(db.latest_stream(streamer.name)).one()
+    assert latest.created_at == dt.datetime(2022, 1, 3)
+
+
 def test_init_db_failure(runner, monkeypatch):
     bad_engine = create_engine("sqlite:////")
     try:
@@ -143,3 +165,53 @@ def test_setup(runner):
 
     assert result.exit_code == 0
     assert not result.output
+
+
+@pytest.mark.parametrize(
+    "engine, recorder_class", [("thread", "Recorder"), ("async", "AsyncRecorder")]
+)
+def test_record_engine(runner, engine, recorder_class, monkeypatch):
+    monkeypatch.setenv("OFFSTREAM_ENGINE", engine)
+    with patch(f"offstream.cli.{recorder_class}") as recorder:
+        result = runner.invoke(args=["offstream", "record"])
+
+    assert result.exit_code == 0
+    recorder.return_value.start.assert_called_once()
+
+
+def test_record_serves_metrics(runner):
+    servers = []
+
+    def _make_server(*args, **kwargs):
+        servers.append(make_server(*args, **kwargs))
+        return servers[-1]
+
+    def _scrape():
+        with urlopen(f"http://127.0.0.1:{servers[0].port}/metrics") as response:
+            scraped.append(response.read())
+
+    scraped = []
+    with patch("offstream.cli.Recorder") as recorder, patch(
+        "offstream.cli.make_server", side_effect=_make_server
+    ):
+        recorder.return_value.start.side_effect = _scrape
+        result = runner.invoke(args=["offstream", "record", "--metrics-port", "0"])
+
+    assert result.exit_code == 0, result.output
+    assert "Serving metrics" in result.output
+    assert b"offstream_active_recordings" in scraped[0]
+
+
+def test_record_traces_to_file(runner, tmp_path):
+    def _start():
+        with tracing.span("segment", segment="0.ts"):
+            pass
+
+    path = tmp_path / "trace.jsonl"
+    with patch("offstream.cli.Recorder") as recorder:
+        recorder.return_value.start.side_effect = _start
+        result = runner.invoke(args=["offstream", "record", "--trace-file", path])
+
+    assert result.exit_code == 0, result.output
+    assert json.loads(path.read_text())["segment"] == "0.ts"
+    assert not tracing.enabled()
@@ -0,0 +1,86 @@
+import pytest
+
+from offstream.metrics import Registry, _Metric, wsgi_app
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter(registry):
+    counter = registry.counter("bytes_total", "Bytes", ["streamer"])
+    counter.inc(10, streamer="x")
+    counter.inc(5, streamer='say "hi"\n')
+
+    assert registry.render().splitlines() == [
+        "# HELP bytes_total Bytes",
+        "# TYPE bytes_total counter",
+        'bytes_total{streamer="x"} 10.0',
+        'bytes_total{streamer="say \\"hi\\"\\n"} 5.0',
+    ]
+
+
+def test_gauge_without_labels_starts_at_zero(registry):
+    gauge = registry.gauge("pending", "Pending")
+
+    assert "pending 0.0" in registry.render()
+
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+
+    assert gauge.value() == 1
+    assert "pending 1.0" in registry.render()
+
+
+def test_gauge_remove(registry):
+    gauge = registry.gauge("dirty", "Dirty", ["streamer"])
+    gauge.set(3, streamer="x")
+    gauge.remove(streamer="x")
+
+    assert "dirty{" not in registry.render()
+
+
+def test_histogram(registry):
+    histogram = registry.histogram("latency", "Latency", ["method"], buckets=[1, 5])
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value, method="GET")
+
+    assert histogram.count(method="GET") == 4
+    assert registry.render().splitlines()[2:] == [
+        'latency_bucket{method="GET",le="1.0"} 2.0',
+        'latency_bucket{method="GET",le="5.0"} 3.0',
+        'latency_bucket{method="GET",le="+Inf"} 4.0',
+        'latency_sum{method="GET"} 14.5',
+        'latency_count{method="GET"} 4.0',
+    ]
+
+
+def test_wrong_labels(registry):
+    counter = registry.counter("bytes_total", "Bytes", ["streamer"])
+
+    with pytest.raises(ValueError):
+        counter.inc(other="x")
+
+
+def test_duplicate_metric(registry):
+    registry.counter("bytes_total", "Bytes")
+
+    with pytest.raises(ValueError):
+        registry.gauge("bytes_total", "Bytes")
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        _Metric("name", "help")
+
+
+def test_wsgi_app():
+    started = []
+    body = b"".join(wsgi_app({}, lambda *args: started.append(args)))
+
+    ((status, headers),) = started
+    assert status == "200 OK"
+    assert ("Content-Length", str(len(body))) in headers
+    assert b"# TYPE offstream_ingest_bytes_total counter" in body
@@ -0,0 +1,150 @@
+import socket
+from http.client import HTTPConnection
+from threading import Event, Thread
+
+import pytest
+
+from offstream.server import PooledWSGIServer
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def _serve(app, **kwargs):
+        server = PooledWSGIServer("127.0.0.1", 0, app, **kwargs)
+        thread = Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append((server, thread))
+        return server
+
+    yield _serve
+    for server, thread in servers:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def _app(environ, start_response):
+    if environ["PATH_INFO"] == "/slow":
+        _app.release.wait(timeout=10)
+    body = b"ok"
+    start_response("200 OK", [("content-length", str(len(body)))])
+    return [body]
+
+
+_app.release = Event()
+
+
+def _get(server, path, connection=None):
+    connection = connection or HTTPConnection("127.0.0.1", server.port, timeout=5)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def test_keep_alive(serve):
+    server = serve(_app, keep_alive=5)
+    connection = HTTPConnection("127.0.0.1", server.port, timeout=5)
+
+    first, _ = _get(server, "/", connection)
+    sock = connection.sock
+    second, _ = _get(server, "/", connection)
+
+    assert first.status == second.status == 200
+    assert first.version == second.version == 11
+    assert not first.will_close
+    assert connection.sock is sock
+
+
+def test_keep_alive_skips_unread_request_body(serve):
+    server = serve(_app)
+    connection = HTTPConnection("127.0.0.1", server.port, timeout=5)
+    connection.request("POST", "/", body=b"x" * 100)
+    connection.getresponse().read()
+
+    response, body = _get(server, "/", connection)
+
+    assert response.status == 200
+    assert body == b"ok"
+
+
+def test_keep_alive_disabled(serve):
+    server = serve(_app, keep_alive=0)
+
+    response, _ = _get(server, "/")
+
+    assert response.version == 10
+    assert response.will_close
+
+
+def test_slow_request_does_not_block_others(serve):
+    _app.release.clear()
+    server = serve(_app, threads=2)
+    slow = Thread(target=_get, args=(server, "/slow"))
+    slow.start()
+    try:
+        response, _ = _get(server, "/")
+
+        assert response.status == 200
+        assert slow.is_alive()
+    finally:
+        _app.release.set()
+        slow.join()
+
+
+def test_bind_failure():
+    server = PooledWSGIServer("127.0.0.1", 0, _app)
+    try:
+        with pytest.raises(OSError):
+            PooledWSGIServer("127.0.0.1", server.port, _app)
+    finally:
+        server.server_close()
+
+
+def test_idle_connection_does_not_take_a_thread(serve):
+    server = serve(_app, threads=1)
+    idle = socket.create_connection(("127.0.0.1", server.port))
+    idle.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    idle.recv(4096)
+    try:
+        response, _ = _get(server, "/")
+
+        assert response.status == 200
+    finally:
+        idle.close()
+
+
+def test_idle_connection_is_closed(serve):
+    server = serve(_app, keep_alive=0.1)
+    idle = socket.create_connection(("127.0.0.1", server.port), timeout=5)
+
+    assert idle.recv(4096) == b""
+
+
+def test_pipelined_requests(serve):
+    server = serve(_app)
+    sock = socket.create_connection(("127.0.0.1", server.port), timeout=5)
+    request = b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n"
+    sock.sendall(request * 2)
+    received = b""
+    while received.count(b"ok") < 2:
+        received += sock.recv(4096)
+    sock.close()
+
+    assert received.count(b"200 OK") == 2
+
+
+@pytest.mark.parametrize("length", [b"x", b"-1"])
+def test_bad_content_length(serve, length):
+    server = serve(_app)
+    sock = socket.create_connection(("127.0.0.1", server.port), timeout=5)
+    sock.sendall(
+        b"POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: %s\r\n\r\n" % length
+    )
+    received = b""
+    while chunk := sock.recv(4096):
+        received += chunk
+    sock.close()
+
+    assert received.startswith(b"HTTP/1.1 400 ")